@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Benchmark the Ackerman steering table against the closed-form calculation.
+Run from the main folder: python3 benchmarks/bench_ackermann.py
+"""
+
+# pylint: disable=line-too-long
+# pylint: disable=wrong-import-position
+
+import os
+import sys
+import random
+from timeit import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from driveconfig import driveCfg
+from drivefunc import AckermanTable, calc_ackerman_steering
+
+NUM_SAMPLES = 10000
+NUM_REPEAT = 10
+
+
+def main() -> None:
+    """Run the benchmark and print the results"""
+    random.seed(1)
+    samples = [(random.uniform(-45.0, 45.0), random.uniform(-100.0, 100.0)) for _ in range(NUM_SAMPLES)]
+
+    for _interp in (True, False):
+        table = AckermanTable(driveCfg.DoL, step_deg=0.5, interp=_interp)
+
+        t_calc = timeit(lambda: [calc_ackerman_steering(_d, _s) for _d, _s in samples], number=NUM_REPEAT)
+        t_table = timeit(lambda: [table.steer(_d, _s) for _d, _s in samples], number=NUM_REPEAT)
+
+        num_diff = sum(calc_ackerman_steering(_d, _s) != table.steer(_d, _s) for _d, _s in samples)
+        err_dir, err_speed = table.max_error()
+
+        print(f"Table step {table.step_deg:.3f} deg, interpolation {_interp}:")
+        print(f"  closed-form: {1e6*t_calc/(NUM_REPEAT*NUM_SAMPLES):.2f} us/call")
+        print(f"  table:       {1e6*t_table/(NUM_REPEAT*NUM_SAMPLES):.2f} us/call ({t_calc/t_table:.1f}x)")
+        print(f"  max error:   {err_dir:.4f} deg, {err_speed:.6f} speed scale")
+        print(f"  integer results differing by 1: {num_diff} of {NUM_SAMPLES}")
+
+
+if __name__ == '__main__':
+    main()
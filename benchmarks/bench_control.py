@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""End-to-end benchmark of the driveRover_wugc control loop.
+Run from the main folder: python3 benchmarks/bench_control.py [--modes simple ackermann] [--duration 20] [--output results.json]
+
+For each driving mode, the driveRover_wugc.py script is run in a separate process (in a temporary folder),
+with a generated recorded session as controller input (step changes of the sticks, played back in real time)
+and the simulated rover library (roversim.py) as hardware. The session ends by holding the Home button.
+
+The results are printed and written as JSON:
+- stick-to-actuator latency percentiles (p50, p99, max): from a stick change to the end of the actuator update
+  (the servo/motor commands issued back-to-back after the change),
+- loop iterations per second and CPU time per iteration,
+- actuator commands and I2C transactions per second,
+- max RSS of the process.
+"""
+
+# pylint: disable=line-too-long
+# pylint: disable=import-outside-toplevel
+
+import os
+import sys
+import json
+import random
+import argparse
+import resource
+import subprocess
+import tempfile
+
+import yaml
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# The rover commands which move the servos or the motors
+ACTUATOR_COMMANDS = ('setServo', 'write_i2c_block_data', 'forward', 'reverse', 'turnForward', 'turnReverse', 'spinLeft', 'spinRight', 'stop', 'brake')
+# Max gap between the commands of one actuator update (s)
+UPDATE_GAP = 0.001
+
+
+def make_session(filename: str, duration: float, step: float, seed: int, home_held: float) -> None:
+    """
+    Write a recorded session with random step changes of the sticks at random times,
+    followed by holding the Home button to stop the program.
+    """
+    random.seed(seed)
+    with open(filename, 'w', encoding='utf-8') as stream:
+        _t = 0.0
+        while _t < duration:
+            _frame = {'t': round(_t, 3), 'lx': 0.0, 'ly': round(random.uniform(-1.0, 1.0), 2),
+                      'rx': round(random.uniform(-1.0, 1.0), 2), 'ry': round(random.uniform(0.0, 1.0), 2), 'buttons': []}
+            stream.write(json.dumps(_frame) + '\n')
+            # Random time between the changes, not locked to the loop period
+            _t += step * random.uniform(0.8, 1.2)
+        stream.write(json.dumps({'t': round(_t, 3), 'lx': 0.0, 'ly': 0.0, 'rx': 0.0, 'ry': 0.0, 'buttons': []}) + '\n')
+        stream.write(json.dumps({'t': round(_t + 0.5, 3), 'buttons': ['home']}) + '\n')
+        stream.write(json.dumps({'t': round(_t + 1.0 + home_held, 3), 'buttons': ['home']}) + '\n')
+
+
+def percentile(values: list, per: float) -> float:
+    """The percentile of the values (nearest rank)"""
+    if not values:
+        return 0.0
+    _values = sorted(values)
+    return _values[min(len(_values) - 1, int(per / 100.0 * len(_values)))]
+
+
+def worker() -> None:
+    """Run driveRover_wugc.py in this process and print the results as JSON"""
+    import runpy
+    sys.path.insert(0, BASE_DIR)
+    _globals = runpy.run_path(os.path.join(BASE_DIR, 'driveRover_wugc.py'), run_name='__main__')
+
+    import roversim
+    _ctrl = _globals['pihutwugc']
+    _loop = _globals['loopSched']
+
+    # Stick changes and actuator commands completion times
+    _changes = []
+    _prev = None
+    for _t, _axes in _ctrl.changes:
+        if _axes != _prev:
+            _changes.append(_t)
+        _prev = _axes
+    _cmds = [(_t, _t + _cost / 1e6) for _t, _name, _args, _cost in roversim.commands if _name in ACTUATOR_COMMANDS]
+
+    # Latency from each stick change to the end of the actuator update after it
+    _latency = []
+    _k = 0
+    for _i, _t in enumerate(_changes):
+        _t_next = _changes[_i + 1] if _i + 1 < len(_changes) else float('inf')
+        while _k < len(_cmds) and _cmds[_k][0] < _t:
+            _k += 1
+        if _k < len(_cmds) and _cmds[_k][0] < _t_next:
+            _end = _cmds[_k][1]
+            while _k + 1 < len(_cmds) and _cmds[_k + 1][0] < min(_end + UPDATE_GAP, _t_next):
+                _k += 1
+                _end = _cmds[_k][1]
+            _latency.append(1000.0 * (_end - _t))
+
+    _stats = roversim.stats()
+    _wall = _ctrl.wall_time
+    _results = {
+        'mode': _globals['driveCfg'].mainCfg.mode,
+        'duration_s': _wall,
+        'stick_changes': len(_changes),
+        'latency_ms': {'p50': percentile(_latency, 50), 'p99': percentile(_latency, 99), 'max': max(_latency, default=0.0), 'count': len(_latency)},
+        'iterations_per_s': _loop.ticks / _wall if _wall > 0 else 0.0,
+        'cpu_us_per_iteration': 1e6 * _ctrl.cpu_time / _loop.ticks if _loop.ticks else 0.0,
+        'loop': _loop.stats(),
+        'actuator_commands_per_s': sum(1 for _t, _ in _cmds if _t <= _ctrl.changes[-1][0]) / _wall if _wall > 0 else 0.0,
+        'i2c_transactions_per_s': _stats['i2c_transactions'] / _wall if _wall > 0 else 0.0,
+        'commands': _stats['commands'],
+        'actuator_writes': _globals['driveActuators'].stats(),
+        'actuator_thread': _globals['driveWorker'].stats(),
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    print(json.dumps(_results))
+
+
+def run_mode(mode: str, duration: float, step: float, seed: int) -> dict:
+    """Run the benchmark worker for one driving mode"""
+    with open(os.path.join(BASE_DIR, 'driveconfig.yaml'), 'r', encoding='utf-8') as stream:
+        _docs = list(yaml.load_all(stream, Loader=yaml.SafeLoader))
+
+    with tempfile.TemporaryDirectory() as _dir:
+        _session = os.path.join(_dir, 'session.jsonl')
+        make_session(_session, duration, step, seed, home_held=3.0)
+
+        _docs[0].update({'mode': mode, 'input': 'replay', 'input_file': _session, 'input_realtime': True, 'input_record': ''})
+        with open(os.path.join(_dir, 'driveconfig.yaml'), 'w', encoding='utf-8') as stream:
+            yaml.dump_all(_docs, stream, explicit_start=True)
+
+        _proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker'],
+                               cwd=_dir, capture_output=True, text=True, check=True)
+        return json.loads(_proc.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    """Run the benchmark for each driving mode, print and save the results"""
+    _parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    _parser.add_argument('--modes', nargs='+', default=['simple', 'ackermann'], help='driving modes')
+    _parser.add_argument('--duration', type=float, default=20.0, help='session duration (s)')
+    _parser.add_argument('--step', type=float, default=0.25, help='time between stick changes (s)')
+    _parser.add_argument('--seed', type=int, default=1, help='random seed of the session')
+    _parser.add_argument('--output', default='bench_control.json', help='JSON results file')
+    _parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    _args = _parser.parse_args()
+
+    if _args.worker:
+        worker()
+        return
+
+    _results = []
+    for _mode in _args.modes:
+        _res = run_mode(_mode, _args.duration, _args.step, _args.seed)
+        _results.append(_res)
+        print(f"{_mode}: latency p50/p99/max {_res['latency_ms']['p50']:.2f}/{_res['latency_ms']['p99']:.2f}/{_res['latency_ms']['max']:.2f} ms, "
+              f"{_res['iterations_per_s']:.1f} it/s, {_res['cpu_us_per_iteration']:.0f} us CPU/it, "
+              f"{_res['actuator_commands_per_s']:.1f} cmd/s, {_res['i2c_transactions_per_s']:.1f} I2C/s, "
+              f"RSS {_res['max_rss_kb']/1024:.1f} MB")
+
+    with open(_args.output, 'w', encoding='utf-8') as stream:
+        json.dump(_results, stream, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -28,27 +28,32 @@
 # pylint: disable=line-too-long
 
 import os
-import sys
-from time import sleep
-from datetime import datetime, timedelta
+import asyncio
+from functools import partial
+from time import sleep, monotonic
 import logging
 import subprocess
 #import tty
 #import termios
 
-# Attempt to import approxeng.input library
-try:
-    # All we need, as we don't care which controller we bind to, is the ControllerResource
-    from approxeng.input.selectbinder import ControllerResource
-except ImportError:
-    logging.error("The approxeng.input library must be installed! Bye!")
-    sys.exit()
+# Start of the local modules import, for the startup timing
+STARTUP_T0 = monotonic()
 
 # Local
-from drivelogger import driveLogger
-from driveconfig import driveExit, driveCfg
-from drivefunc import init_rover, move_rover, move_rover_ackerman, stop_rover, cleanup_rover
-from drivefunc import mixer_dir, mixer_speed, rumble_start, rumble_end, seq_all_leds
+from drivelogger import driveLogger, driveLogQueue, stop_logger, flush_logger
+from driveconfig import driveExit, driveCfg, process_age
+from driveinput import controller_resource, held_action, InputFileError
+from drivefunc import init_rover, stop_rover, cleanup_rover
+from drivefunc import rumble_start, rumble_end, driveLeds, driveActuators, driveWorker
+from drivemodes import DRIVE_MODES, make_mode, next_mode
+from drivereload import driveConfigWatcher, apply_config
+from drivesched import LoopScheduler
+from driverecorder import driveRecorder
+from drivesession import driveSession
+from drivetimers import driveTimers
+from drivepower import drivePower
+from driveshaping import driveShaper
+from driveasync import AsyncRuntime
 
 
 class RoverStopException(Exception):
@@ -59,34 +64,117 @@ class RoverStopException(Exception):
     # pass
 
 
+def log_status() -> None:
+    """Log the status of the actuator thread and of the periodic tasks"""
+    driveLogger.info("Status: actuator thread %s, timers %s", driveWorker.stats(), driveTimers.stats())
+
+
+def bind_drive(mode: str) -> tuple:
+    """
+    Bind the loop-invariant config values and create the driving mode.
+
+    :param mode:
+        The driving mode name
+    :return:
+        The max speed, the evdev input timeout, the mode button, the mode cycle and the driving mode
+    """
+    #pylint: disable=no-member
+    _max_speed = driveCfg.mainCfg.max_speed
+    return (_max_speed, driveCfg.mainCfg.input_timeout, driveCfg.mainCfg.mode_button,
+            driveCfg.mainCfg.mode_cycle, make_mode(mode, max_speed=_max_speed))
+    #pylint: enable=no-member
+
+
+# Periodic tasks periods (seconds)
+SESSION_FLUSH_PERIOD = 1.0
+STATUS_PERIOD = 60.0
+
 # Main loop
 # Outer try / except catches the RoverStopException to
 # bail out of the loop cleanly, shutting the motors down.
-ROVER_SPEED = -1
-ROVER_DIR = -1
-SD_SQUARE = False
-SD_CIRCLE = False
 SD_CMD = False
-
-RB_TRIANGLE = False
-RB_CROSS = False
 RB_CMD = False
+pihutwugc = None
+
+# Fixed-rate scheduler for the driving loop
+#pylint: disable=no-member
+loopSched = LoopScheduler(
+    rate_hz=driveCfg.mainCfg.loop_hz,
+    overrun=driveCfg.mainCfg.loop_overrun)
+
+# Play back the scripted/recorded controller input as fast as possible (no loop pacing)
+PLAYBACK_FAST = driveCfg.mainCfg.input in ('script', 'replay') and not driveCfg.mainCfg.input_realtime
+
+# Wait for the controller events instead of the loop ticks
+EVENT_INPUT = driveCfg.mainCfg.input == 'evdev'
+#pylint: enable=no-member
 
 try:
     # Init the rover
+    STARTUP_T1 = monotonic()
     init_rover(driveCfg.LED_BRIGHT)
 
     # Notify systemd.daemon
     driveCfg.daemon_notify("READY=1")
 
+    # Watch driveconfig.yaml for changes
+    if driveCfg.mainCfg.config_reload: #pylint: disable=no-member
+        driveConfigWatcher.start()
+
+    # Dump the flight recorder on SIGUSR1
+    driveRecorder.start(mode_names=tuple(DRIVE_MODES))
+
+    # Log the controller input and the driving commands to the session file
+    driveSession.start(mode_names=tuple(DRIVE_MODES))
+
+    # Monitor the power button and the battery-low signal (replaces the cleansd.sh and battsd.sh daemons)
+    if driveCfg.pwrCfg is not None:
+        drivePower.start(driveCfg.pwrCfg)
+
+    # Periodic tasks, run from the driving loop: the systemd watchdog (half of the watchdog timeout,
+    # but not faster than the driving loop), the session log flush and the status update
+    #pylint: disable=no-member
+    driveTimers.add('watchdog', max(0.5e-6*driveCfg.WATCHDOG_USEC, 1.0/driveCfg.mainCfg.loop_hz), partial(driveCfg.daemon_notify, "WATCHDOG=1"))
+    #pylint: enable=no-member
+    driveTimers.add('session', SESSION_FLUSH_PERIOD, driveSession.flush)
+    driveTimers.add('status', STATUS_PERIOD, log_status)
+
+    # Startup timing: process start (including the Python startup) to READY=1, local modules import and rover init
+    STARTUP_AGE = process_age()
+    driveLogger.info("Startup (ms): ready %s, imports %.1f, init_rover %.1f, config phases %s",
+        f"{1000.0*STARTUP_AGE:.0f}" if STARTUP_AGE is not None else "n/a",
+        1000.0*(STARTUP_T1 - STARTUP_T0), 1000.0*(monotonic() - STARTUP_T1), driveCfg.STARTUP_MS)
+
+    # Run the asyncio tasks until stopped
+    #pylint: disable=no-member
+    if driveCfg.mainCfg.runtime == 'asyncio':
+        driveRuntime = AsyncRuntime()
+        STOP_ACTION = asyncio.run(driveRuntime.run())
+        pihutwugc = driveRuntime.controller
+        driveLogger.info("Tasks stats: %s", driveRuntime.stats())
+
+        if STOP_ACTION == 'shutdown':
+            SD_CMD = True
+            driveLogger.info('Initiate RPi shutdown!')
+        elif STOP_ACTION == 'reboot':
+            RB_CMD = True
+            driveLogger.info('Initiate RPi reboot!')
+        elif STOP_ACTION == 'exit':
+            INFO_STR = 'Program stopped by the User'
+            driveLogger.info(INFO_STR)
+            driveCfg.journal_send(INFO_STR)
+        elif STOP_ACTION == 'end':
+            driveCfg.journal_send('End of the controller input playback.')
+        raise RoverStopException()
+    #pylint: enable=no-member
+
     while True:
         # Inner try / except is used to wait for a controller to become available, at which point we
         # bind to it and enter a loop where we read axis values and send commands to the motors.
-        watchdog_tprev = datetime.now()
         try:
-            # Bind to any available controller.
+            # Bind to any available controller, or to the scripted/recorded controller input.
             # This will use whatever's connected as long as the library supports it.
-            with ControllerResource(dead_zone=0.05, hot_zone=0.05) as pihutwugc:
+            with controller_resource(dead_zone=0.05, hot_zone=0.05) as pihutwugc:
                 INFO_STR = 'Controller found.'
                 driveLogger.info(INFO_STR)
                 driveCfg.journal_send(INFO_STR)
@@ -100,137 +188,131 @@ try:
                 rumble_start(pihutwugc)
 
                 # Rotating LED lights
-                seq_all_leds(2, 0.2, driveCfg.LED_GREEN)
+                driveLeds.post('seq', col=driveCfg.LED_GREEN, fnum=2, dly=0.2)
+
+                # Loop-invariant config values and the driving mode, bound once when driving starts
+                MAX_SPEED, INPUT_TIMEOUT, MODE_BUTTON, MODE_CYCLE, DRIVE = bind_drive(driveCfg.mainCfg.mode) #pylint: disable=no-member
+                driveShaper.reset()
+
+                # Start the loop schedule
+                loopSched.reset_stats()
+                loopSched.start()
+                TICK_LATE = 0.0
 
                 # Loop until the pihutwugc disconnects,
                 # or we deliberately stop by raising a RoverStopException
                 while pihutwugc.connected:
 
+                    # Swap in the reloaded configuration between two ticks, and re-bind the config values.
+                    # The driving mode switched with the mode button is kept, unless the mode was changed.
+                    NEW_CFG = driveConfigWatcher.take()
+                    if NEW_CFG is not None:
+                        CFG_DIFF = apply_config(NEW_CFG)
+                        if CFG_DIFF:
+                            #pylint: disable=no-member
+                            MAX_SPEED, INPUT_TIMEOUT, MODE_BUTTON, MODE_CYCLE, DRIVE = bind_drive(
+                                driveCfg.mainCfg.mode if 'mainCfg.mode' in CFG_DIFF else DRIVE.name)
+                            if 'mainCfg.loop_hz' in CFG_DIFF:
+                                loopSched.set_rate(driveCfg.mainCfg.loop_hz)
+                            #pylint: enable=no-member
+
                     # Get pihutwugc values from the left and right circular analogue axes
                     #lx_axis, ly_axis, rx_axis, ry_axis = pihutwugc['lx', 'ly', 'rx', 'ry']
+                    TICK_T0 = monotonic()
                     lx_axis, ly_axis = pihutwugc['l']
                     rx_axis, ry_axis = pihutwugc['r']
-
-                    # Driving modes
-                    #pylint: disable=no-member
-                    if driveCfg.mainCfg.mode == 'simple':
-                        # Get rover speed from mixer function (= rover speed value for all 6 motors)
-                        ROVER_SPEED_CURRENT, _ = mixer_speed(
-                            yaw=0,
-                            throttle=ly_axis)
-
-                        # Get rover direction from mixer function (= angle value for all 4 motors)
-                        ROVER_DIR_CURRENT = mixer_dir(
-                            l_r=rx_axis,
-                            f_b=ry_axis,
-                            max_dir=30)
-
-                        # Set rover rover direction and rover speed
-                        if ROVER_SPEED != ROVER_SPEED_CURRENT or ROVER_DIR != ROVER_DIR_CURRENT:
-                            move_rover(
-                                dir_deg=ROVER_DIR_CURRENT,
-                                speed_per=ROVER_SPEED_CURRENT)
-                            ROVER_DIR = ROVER_DIR_CURRENT
-                            ROVER_SPEED = ROVER_SPEED_CURRENT
-
-                    elif driveCfg.mainCfg.mode == 'ackermann':
-                        # Get rover speed from mixer function (= speed of the rover)
-                        ROVER_SPEED_CURRENT, _ = mixer_speed(
-                            yaw=0,
-                            throttle=ly_axis)
-
-                        # Get rover direction from mixer function (= steering angle of the rover)
-                        ROVER_DIR_CURRENT = mixer_dir(
-                            l_r=rx_axis,
-                            f_b=ry_axis)
-
-                        # Set rover rover direction and rover speed
-                        if ROVER_SPEED != ROVER_SPEED_CURRENT or ROVER_DIR != ROVER_DIR_CURRENT:
-                            move_rover_ackerman(
-                                dir_deg=ROVER_DIR_CURRENT,
-                                speed_per=ROVER_SPEED_CURRENT)
-                            ROVER_DIR = ROVER_DIR_CURRENT
-                            ROVER_SPEED = ROVER_SPEED_CURRENT
-                    #pylint: enable=no-member
+                    AXES = (lx_axis, ly_axis, rx_axis, ry_axis)
+
+                    # Driving command from the driving mode for the shaped axes, when changed
+                    TICK_T1 = monotonic()
+                    SHAPED_AXES = driveShaper.shape(TICK_T0, AXES)
+                    DRIVE_CMD = DRIVE.step(SHAPED_AXES)
+                    TICK_T2 = monotonic()
+                    if DRIVE_CMD is not None:
+                        driveWorker.post(*DRIVE_CMD)
+                        driveSession.command(TICK_T0, DRIVE.mode_id, DRIVE_CMD[1], DRIVE_CMD[2])
+                    TICK_T3 = monotonic()
+
+                    # Flight recorder: the tick telemetry
+                    driveRecorder.record(TICK_T0, SHAPED_AXES, DRIVE.mode_id, DRIVE.last, DRIVE_CMD is not None,
+                                         TICK_T1 - TICK_T0, TICK_T2 - TICK_T1, TICK_T3 - TICK_T2, TICK_LATE)
 
                     # Get a ButtonPresses object containing everything that was pressed
                     # since the last time around this loop.
                     # The PiHut controller Turbo button is not currently mapped
                     # to any button in the API!
                     pihutwugc.check_presses()
+                    driveSession.input(TICK_T0, AXES, pihutwugc.presses)
 
                     # Print out any buttons that were pressed, if we had any
                     if pihutwugc.has_presses:
                         driveLogger.debug(pihutwugc.presses)
 
-                    # If square was pressed, ...
-                    held_square = pihutwugc.square
-                    if held_square is not None:
+                        # Switch to the next driving mode
+                        if MODE_BUTTON and MODE_BUTTON in pihutwugc.presses and MODE_CYCLE:
+                            DRIVE = make_mode(next_mode(DRIVE.name, MODE_CYCLE), max_speed=MAX_SPEED)
+                            driveLogger.info("Driving mode: %s", DRIVE.name)
+                            driveLeds.post('flash', col=driveCfg.LED_BLUE_H, fnum=2, dly=0.1)
 
-                        if held_square >= driveCfg.SHUTDOWN_HELD:
-                            SD_SQUARE = True
-
-                    # If circle was pressed, ...
-                    held_circle = pihutwugc.circle
-                    if held_circle is not None:
-
-                        if held_circle >= driveCfg.SHUTDOWN_HELD:
-                            SD_CIRCLE = True
-
-                    # Initiate RPi shutdown
-                    if SD_SQUARE and SD_CIRCLE:
+                    # Initiate RPi shutdown (Square+Circle held), RPi reboot (Triangle+Cross held),
+                    # or stop the program (Home held).
+                    # The PiHut controller Analog button is mapped to the home button in the API
+                    HELD_ACTION = held_action(pihutwugc)
+                    if HELD_ACTION == 'shutdown':
                         SD_CMD = True
                         INFO_STR = 'Initiate RPi shutdown!'
                         driveLogger.info(INFO_STR)
                         raise RoverStopException()
 
-                    SD_SQUARE = False
-                    SD_CIRCLE = False
-
-                    # If triangle was pressed, ...
-                    held_triangle = pihutwugc.triangle
-                    if held_triangle is not None:
-
-                        if held_triangle >= driveCfg.REBOOT_HELD:
-                            RB_TRIANGLE = True
-
-                    # If cross was pressed, ...
-                    held_cross = pihutwugc.cross
-                    if held_cross is not None:
-
-                        if held_cross >= driveCfg.REBOOT_HELD:
-                            RB_CROSS = True
-
-                    # Initiate RPi reboot
-                    if RB_TRIANGLE and RB_CROSS:
+                    if HELD_ACTION == 'reboot':
                         RB_CMD = True
                         INFO_STR = 'Initiate RPi reboot!'
                         driveLogger.info(INFO_STR)
                         raise RoverStopException()
-                    RB_TRIANGLE = False
-                    RB_CROSS = False
-
-                    # If start was pressed, ...
-                    # if pihutwugc.start:
-
-                    # The PiHut controller Analog button is mapped to the home button in the API
-                    held_home = pihutwugc.home
-                    if held_home is not None and held_home >= driveCfg.HOME_HELD:
 
+                    if HELD_ACTION == 'exit':
                         INFO_STR = 'Program stopped by the User'
                         driveLogger.info(INFO_STR)
                         driveCfg.journal_send(INFO_STR)
                         raise RoverStopException()
 
+                    # Power button held or battery low
+                    if drivePower.action == 'shutdown':
+                        SD_CMD = True
+                        INFO_STR = 'Initiate RPi shutdown!'
+                        driveLogger.info(INFO_STR)
+                        raise RoverStopException()
+
                     # This exception will be rised for SIGINT, SIGTERM and SIGABRT
                     if driveExit.kill_now:
                         raise RoverStopException()
 
-                    # Update the systemd watchdog when needed
-                    watchdog_tcrt = datetime.now()
-                    if watchdog_tcrt - watchdog_tprev > timedelta(seconds=int(1.0*driveCfg.WATCHDOG_USEC/2000000.0)):
-                        driveCfg.daemon_notify("WATCHDOG=1")
-                        watchdog_tprev = watchdog_tcrt
+                    # Run the due periodic tasks (systemd watchdog etc.)
+                    driveTimers.run_due()
+
+                    # Wait for the next controller events, or for the next loop tick
+                    # (at the loop rate while the shaped axes are settling)
+                    if EVENT_INPUT:
+                        pihutwugc.wait(INPUT_TIMEOUT if driveShaper.settled else loopSched.period)
+                    elif not PLAYBACK_FAST:
+                        TICK_LATE = loopSched.wait()
+
+                driveLogger.info("Controller disconnected. Loop stats: %s", loopSched.stats())
+                if EVENT_INPUT:
+                    driveLogger.info("Controller events stats: %s", pihutwugc.stats())
+
+                # End of the scripted/recorded controller input
+                if getattr(pihutwugc, 'finished', False):
+                    INFO_STR = 'End of the controller input playback.'
+                    driveLogger.info(INFO_STR)
+                    driveCfg.journal_send(INFO_STR)
+                    raise RoverStopException()
+
+        except InputFileError as _e:
+            # The scripted/recorded input file is missing or invalid, retrying does not help
+            driveLogger.error("%s. Bye!", _e)
+            driveCfg.journal_send(str(_e))
+            raise RoverStopException() from _e
 
         except IOError:
             # We get an IOError when using the ControllerResource if we don't have a controller yet,
@@ -239,11 +321,14 @@ try:
             driveLogger.info(INFO_STR)
             driveCfg.journal_send(INFO_STR)
 
-            # Update the systemd watchdog when needed
-            watchdog_tcrt = datetime.now()
-            if watchdog_tcrt - watchdog_tprev > timedelta(seconds=int(1.0*driveCfg.WATCHDOG_USEC/2000000.0)):
-                driveCfg.daemon_notify("WATCHDOG=1")
-                watchdog_tprev = watchdog_tcrt
+            # Run the due periodic tasks (systemd watchdog etc.)
+            driveTimers.run_due()
+
+            # Power button held or battery low
+            if drivePower.action == 'shutdown':
+                SD_CMD = True
+                driveLogger.info('Initiate RPi shutdown!')
+                raise RoverStopException()
 
             # Sleep
             sleep(3)
@@ -253,9 +338,23 @@ except RoverStopException:
     # - for the home button pressed
     # - for SIGINT, SIGTERM and SIGABRT events
     # - for reboot/shutdown commmands
+    # - for the power button held or the battery low
+    drivePower.stop()
+    driveRecorder.dump('stop', wait=True)
+    driveSession.stop()
+    driveConfigWatcher.stop()
     stop_rover()
     rumble_end(pihutwugc)
 
+    driveLogger.info("Loop stats: %s", loopSched.stats())
+    driveLogger.info("Actuator writes stats: %s", driveActuators.stats())
+    driveLogger.info("Actuator thread stats: %s", driveWorker.stats())
+    driveLogger.info("Timers stats: %s", driveTimers.stats())
+    if driveCfg.pwrCfg is not None:
+        driveLogger.info("Power monitor stats: %s", drivePower.stats())
+    if EVENT_INPUT and pihutwugc is not None:
+        driveLogger.info("Controller events stats: %s", pihutwugc.stats())
+
     INFO_STR = 'Stop rover and clean exit.'
     driveLogger.info(INFO_STR)
     driveCfg.journal_send(INFO_STR)
@@ -271,6 +370,7 @@ except RoverStopException:
 finally:
     if SD_CMD:
         driveLogger.info('Shutdown initiated with ./scripts/sd.sh')
+        flush_logger()
         #os.system('(sleep 3 && sudo shutdown now)&')
         _grab_cmd = subprocess.Popen(os.path.join(os.path.dirname(
             __file__), "./scripts/sd.sh"), stderr=subprocess.PIPE, stdout=subprocess.PIPE)
@@ -280,6 +380,7 @@ finally:
 
     elif RB_CMD:
         driveLogger.info('Reboot initiated ./scripts/rb.sh')
+        flush_logger()
         #os.system('(sleep 3 && sudo reboot)&')
         _grab_cmd = subprocess.Popen(os.path.join(os.path.dirname(
             __file__), "./scripts/rb.sh"), stderr=subprocess.PIPE, stdout=subprocess.PIPE)
@@ -287,5 +388,8 @@ finally:
         driveLogger.debug(
             "Reboot cmd: output: %s, error: %s", _cmdoutput, _cmderrors.decode())
 
-    # Shutdown logging
+    # Shutdown logging, after the queued records are written
+    if driveLogQueue is not None:
+        driveLogger.info("Log queue stats: %s", driveLogQueue.stats())
+    stop_logger()
     logging.shutdown()
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Implements the asyncio runtime for the driveRover_wugc.
+
+The controller input, the driving, the periodic tasks of driveTimers (systemd watchdog etc.), the LED effects, the
+shutdown handling and the configuration reload run as separate periodic asyncio tasks. The blocking rover calls
+(actuators, LEDs, force-feedback) run in a single rover executor thread,
+and the controller binding in the default executor, such that no task can starve
+the watchdog or the stick sampling.
+"""
+
+# pylint: disable=line-too-long
+
+import asyncio
+import inspect
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+
+# Local
+from drivelogger import driveLogger
+from driveconfig import driveExit, driveCfg
+from driveinput import controller_resource, held_action, InputFileError
+from drivefunc import rumble_start, driveLeds, driveWorker
+from drivemodes import make_mode, next_mode
+from drivereload import driveConfigWatcher, apply_config
+from driverecorder import driveRecorder
+from drivesession import driveSession
+from drivetimers import driveTimers
+from drivepower import drivePower
+from driveshaping import driveShaper
+
+# Tasks periods (seconds)
+LED_PERIOD = 0.04
+SHUTDOWN_PERIOD = 0.1
+RECONNECT_PERIOD = 3.0
+
+
+class TaskStats:
+    """Scheduling statistics of a periodic task"""
+
+    def __init__(self, name: str, period: float):
+        self.name = name
+        self.period = period
+        self.runs = 0
+        self.late_sum = 0.0
+        self.late_max = 0.0
+        self.busy_max = 0.0
+        # The wake-up lateness of the current run (seconds)
+        self.late = 0.0
+
+    def update(self, late: float, busy: float) -> None:
+        """Add one run: wake-up lateness and run time (seconds)"""
+        self.runs += 1
+        self.late_sum += late
+        self.late_max = max(self.late_max, late)
+        self.busy_max = max(self.busy_max, busy)
+
+    def stats(self) -> dict:
+        """
+        :return:
+            Dictionary with the period (ms), the number of runs, the mean and max wake-up lateness (ms) and the max run time (ms)
+        """
+        return {
+            'period_ms': 1000.0 * self.period,
+            'runs': self.runs,
+            'late_mean_ms': 1000.0 * self.late_sum / self.runs if self.runs else 0.0,
+            'late_max_ms': 1000.0 * self.late_max,
+            'busy_max_ms': 1000.0 * self.busy_max,
+        }
+
+
+class AsyncRuntime:
+    """
+    The asyncio runtime.
+    run() returns the stop action: 'shutdown', 'reboot', 'exit' (Home button),
+    'signal' (SIGINT, SIGTERM, SIGABRT) or 'end' (end of the controller input playback).
+    """
+
+    def __init__(self):
+        self.controller = None
+        self.action = None
+        self.tasks = {}
+
+        self._stop = None
+        self._rover = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Rover')
+        self._axes = (0.0, 0.0, 0.0, 0.0)
+        self._input_s = 0.0
+        self._move = None
+
+        # Loop-invariant config values and the driving mode, bound once when driving starts
+        #pylint: disable=no-member
+        self._max_speed = driveCfg.mainCfg.max_speed
+        self._evdev = driveCfg.mainCfg.input == 'evdev'
+        self._mode_button = driveCfg.mainCfg.mode_button
+        self._mode_cycle = driveCfg.mainCfg.mode_cycle
+        self.mode = make_mode(driveCfg.mainCfg.mode, max_speed=self._max_speed)
+        #pylint: enable=no-member
+
+    def stop(self, action: str) -> None:
+        """Request the runtime to stop"""
+        if self.action is None:
+            self.action = action
+        self._stop.set()
+
+    async def _periodic(self, name: str, period: float, func) -> None:
+        """Run func() every period seconds, at absolute deadlines on the loop (monotonic) clock"""
+        _loop = asyncio.get_running_loop()
+        _stats = self.tasks[name] = TaskStats(name, period)
+        _next = _loop.time() + period
+        while True:
+            await asyncio.sleep(max(0.0, _next - _loop.time()))
+            _now = _loop.time()
+            _late = _now - _next
+            _next += period
+            if _late >= period:
+                # Skip the missed runs
+                _next += period * int(_late / period)
+
+            _stats.late = _late
+            _result = func()
+            if inspect.isawaitable(_result):
+                await _result
+            _stats.update(_late, _loop.time() - _now)
+
+    async def _input(self) -> None:
+        """Bind to the controller and sample the controller input"""
+        _loop = asyncio.get_running_loop()
+        while True:
+            try:
+                _resource = controller_resource(dead_zone=0.05, hot_zone=0.05)
+                self.controller = await _loop.run_in_executor(None, _resource.__enter__)
+            except InputFileError as _e:
+                # The scripted/recorded input file is missing or invalid, retrying does not help
+                driveLogger.error("%s. Bye!", _e)
+                driveCfg.journal_send(str(_e))
+                self.stop('error')
+                return
+            except IOError:
+                driveLogger.info('No controller found yet. Keep trying!')
+                await asyncio.sleep(RECONNECT_PERIOD)
+                continue
+
+            _info = 'Controller found.'
+            driveLogger.info(_info)
+            driveCfg.journal_send(_info)
+            await _loop.run_in_executor(self._rover, rumble_start, self.controller)
+            driveLogger.debug(self.controller.controls)
+            driveLeds.post('seq', col=driveCfg.LED_GREEN, fnum=2, dly=0.2)
+            driveShaper.reset()
+
+            try:
+                await self._periodic('input', 1.0 / driveCfg.mainCfg.loop_hz, self._sample) #pylint: disable=no-member
+            except _Disconnected:
+                driveLogger.info('Controller disconnected.')
+            finally:
+                _resource.__exit__(None, None, None)
+
+            if getattr(self.controller, 'finished', False):
+                driveLogger.info('End of the controller input playback.')
+                self.stop('end')
+                return
+            self.controller = None
+
+    def _sample(self) -> None:
+        """Sample the controller axes and the held buttons"""
+        _ctrl = self.controller
+        if not _ctrl.connected:
+            raise _Disconnected()
+
+        # Read the pending events of the event-driven controller
+        _t0 = monotonic()
+        if self._evdev:
+            _ctrl.wait(0)
+        self._axes = _ctrl['l'] + _ctrl['r']
+        self._input_s = monotonic() - _t0
+        _ctrl.check_presses()
+        driveSession.input(_t0, self._axes, _ctrl.presses)
+        if _ctrl.has_presses:
+            driveLogger.debug(_ctrl.presses)
+
+            # Switch to the next driving mode
+            if self._mode_button and self._mode_button in _ctrl.presses and self._mode_cycle:
+                self.mode = make_mode(next_mode(self.mode.name, self._mode_cycle), max_speed=self._max_speed)
+                driveLogger.info("Driving mode: %s", self.mode.name)
+                driveLeds.post('flash', col=driveCfg.LED_BLUE_H, fnum=2, dly=0.1)
+
+        _action = held_action(_ctrl)
+        if _action is not None:
+            self.stop(_action)
+
+    def _drive(self) -> None:
+        """Mix the sampled controller axes and move the rover"""
+        if self.controller is None:
+            return
+        # The previous move is still running in the rover executor: retry at the next run with the latest axes
+        if self._move is not None and not self._move.done():
+            return
+
+        _t0 = monotonic()
+        _axes = driveShaper.shape(_t0, self._axes)
+        _cmd = self.mode.step(_axes)
+        _t1 = monotonic()
+        if _cmd is not None:
+            self._move = asyncio.get_running_loop().run_in_executor(self._rover, *_cmd)
+            driveSession.command(_t0, self.mode.mode_id, _cmd[1], _cmd[2])
+        _t2 = monotonic()
+
+        # Flight recorder: the tick telemetry
+        driveRecorder.record(_t0, _axes, self.mode.mode_id, self.mode.last, _cmd is not None,
+                             self._input_s, _t1 - _t0, _t2 - _t1, self.tasks['drive'].late)
+
+    def _leds(self):
+        """Render the LED effects"""
+        return asyncio.get_running_loop().run_in_executor(self._rover, driveLeds.render)
+
+    def _reload(self) -> None:
+        """Swap in the reloaded configuration between two task runs, and re-bind the config values"""
+        _sections = driveConfigWatcher.take()
+        if _sections is None:
+            return
+        _diff = apply_config(_sections)
+        if not _diff:
+            return
+
+        #pylint: disable=no-member
+        self._max_speed = driveCfg.mainCfg.max_speed
+        self._mode_button = driveCfg.mainCfg.mode_button
+        self._mode_cycle = driveCfg.mainCfg.mode_cycle
+        self.mode = make_mode(driveCfg.mainCfg.mode if 'mainCfg.mode' in _diff else self.mode.name, max_speed=self._max_speed)
+        #pylint: enable=no-member
+        if 'mainCfg.loop_hz' in _diff:
+            driveLogger.warning("The loop rate is applied at the next restart of the asyncio runtime.")
+
+    def _shutdown(self) -> None:
+        """Stop for SIGINT, SIGTERM and SIGABRT, and for the power button held or the battery low"""
+        if driveExit.kill_now:
+            self.stop('signal')
+        elif drivePower.action is not None:
+            self.stop(drivePower.action)
+
+    async def run(self) -> str:
+        """
+        Run the tasks until stopped.
+
+        :return:
+            The stop action
+        """
+        self._stop = asyncio.Event()
+
+        # The LED effects and the actuators are run from the tasks, not in their own threads
+        driveWorker.stop()
+        driveLeds.stop()
+        driveLeds.start(thread=False)
+
+        #pylint: disable=no-member
+        _tasks = [
+            asyncio.create_task(self._input(), name='input'),
+            asyncio.create_task(self._periodic('drive', 1.0 / driveCfg.mainCfg.loop_hz, self._drive), name='drive'),
+            asyncio.create_task(self._periodic('timers', 1.0 / driveCfg.mainCfg.loop_hz, driveTimers.run_due), name='timers'),
+            asyncio.create_task(self._periodic('leds', LED_PERIOD, self._leds), name='leds'),
+            asyncio.create_task(self._periodic('shutdown', SHUTDOWN_PERIOD, self._shutdown), name='shutdown'),
+            asyncio.create_task(self._periodic('config', SHUTDOWN_PERIOD, self._reload), name='config'),
+        ]
+        #pylint: enable=no-member
+
+        _stop = asyncio.create_task(self._stop.wait())
+        await asyncio.wait(_tasks + [_stop], return_when=asyncio.FIRST_COMPLETED)
+        for _task in _tasks:
+            if _task.done() and not _task.cancelled() and _task.exception() is not None:
+                driveLogger.error("Task %s failed: %s", _task.get_name(), _task.exception())
+                self.stop('error')
+            _task.cancel()
+        await asyncio.gather(*_tasks, _stop, return_exceptions=True)
+
+        # Wait for the last rover calls
+        self._rover.shutdown(wait=True)
+        return self.action
+
+    def stats(self) -> dict:
+        """
+        :return:
+            Dictionary with the scheduling statistics of each periodic task
+        """
+        return {_name: _stats.stats() for _name, _stats in self.tasks.items()}
+
+
+class _Disconnected(Exception):
+    """The controller was disconnected"""
@@ -23,10 +23,13 @@
 import os
 import sys
 import socket
-import subprocess
 import signal
+import pickle
+import hashlib
+import threading
+from time import monotonic, clock_gettime, CLOCK_BOOTTIME
 from dataclasses import dataclass, field
-from drivelogger import driveLogger
+from drivelogger import driveLogger, flush_logger
 try:
     import yaml
 except ImportError as e:
@@ -42,22 +45,293 @@ except ImportError as e:
     SYSTEMD_MOD = False
     #pass
 
-class Struct(object):
-    """Custom object for converting dict to object"""
+# The C YAML loader (libyaml) when available
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Timeout of the internet connection probe (seconds)
+INTERNET_TIMEOUT = 2.0
+
+
+def process_age() -> float:
+    """
+    The time since the process was started by the OS (e.g. by systemd ExecStart),
+    including the Python interpreter startup.
+
+    :return:
+        The process age in seconds, or None if not available
+    """
+    try:
+        with open('/proc/self/stat', 'r', encoding='utf-8') as stream:
+            _start_ticks = int(stream.read().rsplit(')', 1)[1].split()[19])
+        return clock_gettime(CLOCK_BOOTTIME) - _start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class CfgSection:
+    """
+    Typed config section with __slots__, built from a YAML document and validated.
+    FIELDS maps each parameter name to its type, its default value and its allowed values (None for any value).
+    """
+    __slots__ = ()
+    FIELDS = {}
+
+    def __init__(self, **values):
+        """
+        :raises ValueError:
+            For a parameter with a wrong type or a not allowed value
+        """
+        _name_cls = type(self).__name__
+        for _name in values:
+            if _name not in self.FIELDS:
+                driveLogger.warning("%s: unknown parameter '%s' ignored.", _name_cls, _name)
+
+        for _name, (_type, _default, _allowed) in self.FIELDS.items():
+            _val = values.get(_name, _default)
+            if _type is float and isinstance(_val, int) and not isinstance(_val, bool):
+                _val = float(_val)
+            if not isinstance(_val, _type) or (_type is int and isinstance(_val, bool)):
+                raise ValueError(f"{_name_cls}: '{_name}' must be of type {_type.__name__}, not {_val!r}")
+            if _allowed is not None and _val not in _allowed:
+                raise ValueError(f"{_name_cls}: '{_name}' must be one of {_allowed}, not {_val!r}")
+            setattr(self, _name, _val)
 
-    def __init__(self, **dict_):
-        self.__dict__.update(dict_)
     def __repr__(self):
-        _s=", ".join('%s: %s' % (k, repr(v)) for (k, v) in self.__dict__.items())
+        _s=", ".join(f"{_name}: {getattr(self, _name)!r}" for _name in self.FIELDS)
         return f"<{_s:s}>"
 
+
+class MainCfg(CfgSection):
+    """The mainCfg section of driveconfig.yaml"""
+    FIELDS = {
+        'mode': (str, 'simple', None),
+        'mode_cycle': (list, [], None),
+        'mode_button': (str, '', None),
+        'max_speed': (int, 100, None),
+        'loop_hz': (float, 50.0, None),
+        'loop_overrun': (str, 'skip', ('skip', 'catchup')),
+        'ackermann_lut': (bool, True, None),
+        'ackermann_lut_step': (float, 0.5, None),
+        'ackermann_lut_interp': (bool, True, None),
+        'servo_deadband': (float, 1.0, None),
+        'speed_deadband': (float, 2.0, None),
+        'servo_bulk': (bool, False, None),
+        'actuator_thread': (bool, True, None),
+        'runtime': (str, 'sync', ('sync', 'asyncio')),
+        'input': (str, 'wugc', ('wugc', 'evdev', 'script', 'replay')),
+        'input_timeout': (float, 0.25, None),
+        'input_file': (str, 'drivescript.yaml', None),
+        'input_realtime': (bool, True, None),
+        'input_record': (str, '', None),
+        'config_reload': (bool, True, None),
+        'recorder': (bool, True, None),
+        'recorder_seconds': (float, 30.0, None),
+        'recorder_dir': (str, 'flightrec', None),
+        'session_log': (bool, False, None),
+        'session_dir': (str, 'sessions', None),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class AuxCfg(CfgSection):
+    """The auxCfg section of driveconfig.yaml"""
+    FIELDS = {
+        'led': (bool, True, None),
+        'mast': (bool, False, None),
+        'sonar': (bool, False, None),
+        'cam': (bool, False, None),
+        'power': (bool, False, None),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class LedCfg(CfgSection):
+    """The ledCfg section of driveconfig.yaml"""
+    FIELDS = {
+        'led_bright': (int, 20, None),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class MastCfg(CfgSection):
+    """The mastCfg section of driveconfig.yaml"""
+    FIELDS = {
+        'mast_type': (str, 'pan', ('pan', 'pantilt')),
+        'servo_pan': (int, 0, None),
+        'servo_tilt': (int, 1, None),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class CamCfg(CfgSection):
+    """The camCfg section of driveconfig.yaml"""
+    FIELDS = {
+        'cam_type': (str, 'day', None),
+        'image_dir': (str, './webcam', None),
+        'image_id': (str, 'CAM1', None),
+        'image_rot': (int, 180, None),
+        'use_irl': (int, 1, None),
+        'bcm_pirport': (int, 16, None),
+        'interval_sec': (list, [10], None),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class PwrCfg(CfgSection):
+    """The pwrCfg section of driveconfig.yaml"""
+    FIELDS = {
+        'gpio_base': (int, -1, None),
+        'button_pin': (int, 17, None),
+        'button_on': (int, 0, (0, 1)),
+        'button_hold': (float, 3.0, None),
+        'battery_pin': (int, 27, None),
+        'battery_on': (int, 1, (0, 1)),
+        'battery_window': (float, 30.0, None),
+        'battery_trigger': (float, 20.0, None),
+        'battery_bins': (int, 30, None),
+        'governor': (bool, True, None),
+        'governor_start': (float, 0.1, None),
+        'governor_min': (int, 40, None),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class ShapeCfg(CfgSection):
+    """The shapeCfg section of driveconfig.yaml"""
+    FIELDS = {
+        'shaping': (bool, True, None),
+        'lut_size': (int, 256, None),
+        'lx': (dict, {}, None),
+        'ly': (dict, {}, None),
+        'rx': (dict, {}, None),
+        'ry': (dict, {}, None),
+    }
+    __slots__ = tuple(FIELDS)
+
+    # The shaping parameters of each axis and their allowed ranges
+    AXIS_PARAMS = {
+        'deadband': (0.0, 0.9),
+        'expo': (0.0, 1.0),
+        'smooth': (0.0, 10.0),
+        'slew': (0.0, 1000.0),
+    }
+
+    def __init__(self, **values):
+        """
+        :raises ValueError:
+            For a parameter with a wrong type or a not allowed value, or an axis parameter out of range
+        """
+        super().__init__(**values)
+        if self.lut_size < 2:
+            raise ValueError(f"ShapeCfg: 'lut_size' must be at least 2, not {self.lut_size!r}")
+        for _axis in ('lx', 'ly', 'rx', 'ry'):
+            for _name, _val in getattr(self, _axis).items():
+                if _name not in self.AXIS_PARAMS:
+                    raise ValueError(f"ShapeCfg: unknown '{_axis}' parameter '{_name}', one of {tuple(self.AXIS_PARAMS)}")
+                _min, _max = self.AXIS_PARAMS[_name]
+                if not isinstance(_val, (int, float)) or isinstance(_val, bool) or not _min <= _val <= _max:
+                    raise ValueError(f"ShapeCfg: '{_axis}' parameter '{_name}' must be in [{_min}, {_max}], not {_val!r}")
+
+
+class ServoCfg(CfgSection):
+    """The servoCfg section of driveconfig.yaml"""
+    FIELDS = {
+        'lut_step': (float, 0.5, None),
+        'fl': (dict, {}, None),
+        'fr': (dict, {}, None),
+        'rl': (dict, {}, None),
+        'rr': (dict, {}, None),
+        'pan': (dict, {}, None),
+        'tilt': (dict, {}, None),
+    }
+    __slots__ = tuple(FIELDS)
+
+    # The calibration parameters of each servo and their allowed ranges
+    SERVO_PARAMS = {
+        'trim': (-45.0, 45.0),
+        'scale': (0.1, 2.0),
+        'min': (-90.0, 90.0),
+        'max': (-90.0, 90.0),
+    }
+
+    def __init__(self, **values):
+        """
+        :raises ValueError:
+            For a parameter with a wrong type or a not allowed value, or a servo parameter out of range
+        """
+        super().__init__(**values)
+        if not 0.0 < self.lut_step <= 10.0:
+            raise ValueError(f"ServoCfg: 'lut_step' must be in (0.0, 10.0], not {self.lut_step!r}")
+        for _servo in ('fl', 'fr', 'rl', 'rr', 'pan', 'tilt'):
+            _cal = getattr(self, _servo)
+            for _name, _val in _cal.items():
+                if _name not in self.SERVO_PARAMS:
+                    raise ValueError(f"ServoCfg: unknown '{_servo}' parameter '{_name}', one of {tuple(self.SERVO_PARAMS)}")
+                _min, _max = self.SERVO_PARAMS[_name]
+                if not isinstance(_val, (int, float)) or isinstance(_val, bool) or not _min <= _val <= _max:
+                    raise ValueError(f"ServoCfg: '{_servo}' parameter '{_name}' must be in [{_min}, {_max}], not {_val!r}")
+            if _cal.get('min', -90.0) >= _cal.get('max', 90.0):
+                raise ValueError(f"ServoCfg: '{_servo}' parameter 'min' must be lower than 'max'")
+
+
+# The driveconfig.yaml sections, in the order of the YAML documents, and their DriveConfig attribute names
+CFG_SECTIONS = (MainCfg, AuxCfg, LedCfg, MastCfg, CamCfg, PwrCfg, ShapeCfg, ServoCfg)
+CFG_SECTION_NAMES = ('mainCfg', 'auxCfg', 'ledCfg', 'mastCfg', 'camCfg', 'pwrCfg', 'shapeCfg', 'servoCfg')
+
+
+def compile_config(yaml_file: str, cache_file: str = None) -> tuple:
+    """
+    Read and validate the YAML configuration file into the typed config sections.
+    The compiled sections are cached (pickle) in cache_file, keyed on the YAML file mtime and hash
+    and on the sections definitions, such that the YAML file is parsed only when changed.
+
+    :param yaml_file:
+        The YAML configuration file
+    :param cache_file:
+        The compiled configuration cache file, None for no cache
+    :return:
+        The config sections (one per CFG_SECTIONS) and True if read from the cache
+    :raises yaml.YAMLError, ValueError:
+        For errors in the YAML configuration file
+    """
+    with open(yaml_file, 'rb') as stream:
+        _raw = stream.read()
+    _schema = tuple((_cls.__name__, tuple(_cls.FIELDS.items())) for _cls in CFG_SECTIONS)
+    _key = (os.stat(yaml_file).st_mtime_ns, hashlib.sha256(_raw).hexdigest(), _schema)
+
+    if cache_file is not None:
+        try:
+            with open(cache_file, 'rb') as stream:
+                _cached_key, _sections = pickle.load(stream)
+            if _cached_key == _key:
+                return _sections, True
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError, TypeError):
+            pass
+
+    _docs = list(yaml.load_all(_raw, Loader=YAML_LOADER))
+    if len(_docs) != len(CFG_SECTIONS):
+        raise ValueError(f"{len(CFG_SECTIONS)} YAML documents expected, {len(_docs)} found")
+    _sections = tuple(_cls(**(_doc or {})) for _cls, _doc in zip(CFG_SECTIONS, _docs))
+
+    if cache_file is not None:
+        try:
+            with open(cache_file + '.tmp', 'wb') as stream:
+                pickle.dump((_key, _sections), stream, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_file + '.tmp', cache_file)
+        except OSError as _e:
+            driveLogger.warning("The compiled configuration could not be cached: %s", _e)
+
+    return _sections, False
+
+
 @dataclass
 class DriveConfig:
     """The class setting and storing all the config parameters"""
     ## Custom configuration START
 
-    # Configuration file
+    # Configuration file, and the compiled configuration cache file (None for no cache)
     YAMLCFG_FILE: str = field(default="driveconfig.yaml")
+    YAMLCFG_CACHE: str = field(default=".driveconfig.cache")
 
     # Internet connection
     INTERNETUSE: bool = field(default=True)
@@ -69,6 +343,10 @@ class DriveConfig:
     # NOT enabled in the Raspbian kernel (Jan 2023)!
     FFDEVICEUSE: bool = field(default=False)
 
+    # Fast startup: the internet connection probe runs in the background,
+    # and the rover init LED flashes are not waited for
+    FASTSTART: bool = field(default=True)
+
     ## Custom configuration END
 
 
@@ -79,6 +357,9 @@ class DriveConfig:
     WATCHDOG_USEC: float = field(default = 15.0)
     FF_DEVICE: str = field(default="")
 
+    ## Startup phases duration (ms)
+    STARTUP_MS: dict = field(default_factory=dict)
+
     ## Rover physical parameters
     # The ratio between the left-right wheel distance (chasis width) and
     # the front-back wheel distance (chassis length)
@@ -125,11 +406,17 @@ class DriveConfig:
     CROSS_HELD: int = field(default = 1)
 
     ## Parameters read from YAML config file
-    mainCfg: dict = field(default = None)
-    auxCfg: dict = field(default = None)
-    ledCfg: dict = field(default = None)
-    mastCfg: dict = field(default = None)
-    camCfg: dict = field(default = None)
+    mainCfg: MainCfg = field(default = None)
+    auxCfg: AuxCfg = field(default = None)
+    ledCfg: LedCfg = field(default = None)
+    mastCfg: MastCfg = field(default = None)
+    camCfg: CamCfg = field(default = None)
+    pwrCfg: PwrCfg = field(default = None)
+    shapeCfg: ShapeCfg = field(default = None)
+    servoCfg: ServoCfg = field(default = None)
+
+    # All the config sections, as compiled (see compile_config())
+    cfgSections: tuple = field(default = None, repr = False)
 
     ## Post init function
     def __post_init__(self):
@@ -141,30 +428,27 @@ class DriveConfig:
             sys.exit()
 
         # Hostname
-        self.HOST_NAME = subprocess.check_output(["hostname", ""], shell=True).strip().decode('utf-8')
+        _t = monotonic()
+        self.HOST_NAME = socket.gethostname()
+        self._phase('hostname', _t)
 
         # When the DNS server google-public-dns-a.google.com is reachable on port 53/tcp,
         # then the internet connection is up and running.
+        _t = monotonic()
         if self.INTERNETUSE:
-            try:
-                socket.setdefaulttimeout(10)
-                socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect(("8.8.8.8", 53))
-                driveLogger.info("Internet connection available.")
-
-            except TimeoutError:
-                driveLogger.info("Internet connection NOT available (socket timeout)!? Continuing in off-line mode.")
-                self.INTERNETUSE = False
-                
-            except OSError:
-                driveLogger.info("Network is unreachable!? Continuing in off-line mode.")
-                self.INTERNETUSE = False
+            if self.FASTSTART:
+                threading.Thread(target=self._probe_internet, name='NetProbe', daemon=True).start()
+            else:
+                self._probe_internet()
 
         else:
             self.INTERNETUSE = False
             driveLogger.info("Internet connection not used.")
+        self._phase('internet', _t)
 
 
         # Use systemd features when available
+        _t = monotonic()
         if SYSTEMD_MOD:
             self.SYSTEMDUSE = daemon.booted()
             if self.SYSTEMDUSE:
@@ -181,37 +465,52 @@ class DriveConfig:
                 driveLogger.warning("The system is not running under SystemD. Continuing without SystemD features.")
 
         else:
+            self.SYSTEMDUSE = False
             driveLogger.info("SystemD features not used.")
+        self._phase('systemd', _t)
 
 
         # Read the configuration parameters
         if self.YAMLCFG_FILE is not None:
+            _t = monotonic()
             try:
-                with open(self.YAMLCFG_FILE, 'r', encoding='utf-8') as stream:
-                    _maincfg, _auxcfg, _ledcfg, _mastcfg, _camcfg = yaml.load_all(stream, Loader=yaml.SafeLoader)
-
-                driveLogger.info("YAML configuration file read.")
+                _sections, _cached = compile_config(self.YAMLCFG_FILE, self.YAMLCFG_CACHE)
+                _maincfg, _auxcfg, _ledcfg, _mastcfg, _camcfg, _pwrcfg, _shapecfg, _servocfg = _sections
+                driveLogger.info("YAML configuration file read%s.", " (compiled cache)" if _cached else "")
 
-            except yaml.YAMLError as _e:
+            except (yaml.YAMLError, ValueError) as _e:
                 driveLogger.error("Error in YAML configuration file: %s", _e)
                 sys.exit()
 
-            ## Convert config info to objects
-            self.mainCfg = Struct(**_maincfg)
+            ## Typed config sections
+            self.cfgSections = _sections
+            self.mainCfg = _maincfg
             driveLogger.debug("driveCfg: %s", self.mainCfg)
 
-            self.auxCfg = Struct(**_auxcfg)
+            self.auxCfg = _auxcfg
             driveLogger.debug("auxCfg: %s", self.auxCfg)
 
+            self.shapeCfg = _shapecfg
+            driveLogger.debug("shapeCfg: %s", self.shapeCfg)
+
+            self.servoCfg = _servocfg
+            driveLogger.debug("servoCfg: %s", self.servoCfg)
+
+            self._phase('yaml', _t)
+
             # Settings based on the read config params
             #pylint: disable=no-member
+            _t = monotonic()
             if self.auxCfg.led:
-                self.ledCfg = Struct(**_ledcfg)
+                self.ledCfg = _ledcfg
                 driveLogger.debug("ledCfg: %s", self.ledCfg)
 
                 # Rover LEDs colors
                 #pylint: disable=import-outside-toplevel
-                from rover import numPixels, fromRGB
+                try:
+                    from rover import numPixels, fromRGB
+                except ImportError:
+                    from roversim import numPixels, fromRGB
                 self.LED_BRIGHT = self.ledCfg.led_bright
                 self.LED_NUM    = numPixels
                 self.LED_RED    = fromRGB(255,0,0)
@@ -226,9 +525,10 @@ class DriveConfig:
                 self.LED_BLUE_H   = fromRGB(0,0,100)
                 self.LED_WHITE_H  = fromRGB(100,100,100)
                 #pylint: enable=import-outside-toplevel
+            self._phase('leds', _t)
 
             if self.auxCfg.mast:
-                self.mastCfg = Struct(**_mastcfg)
+                self.mastCfg = _mastcfg
                 driveLogger.debug("mastCfg: %s", self.mastCfg)
 
                 self.SERVO_MP = self.mastCfg.servo_pan
@@ -236,9 +536,13 @@ class DriveConfig:
                     self.SERVO_MT = self.mastCfg.servo_tilt
 
             if self.auxCfg.cam:
-                self.camCfg = Struct(**_camcfg)
+                self.camCfg = _camcfg
                 driveLogger.debug("camCfg: %s", self.camCfg)
 
+            if self.auxCfg.power:
+                self.pwrCfg = _pwrcfg
+                driveLogger.debug("pwrCfg: %s", self.pwrCfg)
+
             #pylint: enable=no-member
 
         # Force-feedback config (if any)
@@ -246,6 +550,67 @@ class DriveConfig:
             self.FF_DEVICE = None
             driveLogger.warning("Force-feedback events are not enabled!")
 
+        driveLogger.info("Config startup phases (ms): %s", self.STARTUP_MS)
+
+    def reload_sections(self, sections: tuple) -> dict:
+        """
+        Swap in new config sections, e.g. compiled after driveconfig.yaml was edited.
+        The LEDs and the force-feedback are set up only at startup: the ledCfg section
+        is swapped only when the LEDs were enabled at startup.
+
+        :param sections:
+            The config sections, as returned by compile_config()
+        :return:
+            Dictionary with the changed parameters ('section.param') and their (old, new) values
+        """
+        _diff = {}
+        for _name, _old, _new in zip(CFG_SECTION_NAMES, self.cfgSections, sections):
+            for _param in _new.FIELDS:
+                _old_val = getattr(_old, _param)
+                _new_val = getattr(_new, _param)
+                if _old_val != _new_val:
+                    _diff[f"{_name}.{_param}"] = (_old_val, _new_val)
+
+        #pylint: disable=no-member
+        _maincfg, _auxcfg, _ledcfg, _mastcfg, _camcfg, _, _shapecfg, _servocfg = sections
+        self.cfgSections = sections
+        self.mainCfg = _maincfg
+        self.auxCfg = _auxcfg
+
+        if self.ledCfg is not None:
+            self.ledCfg = _ledcfg
+            self.LED_BRIGHT = _ledcfg.led_bright
+
+        self.mastCfg = _mastcfg if _auxcfg.mast else None
+        if _auxcfg.mast:
+            self.SERVO_MP = _mastcfg.servo_pan
+            if _mastcfg.mast_type == 'pantilt':
+                self.SERVO_MT = _mastcfg.servo_tilt
+
+        self.camCfg = _camcfg if _auxcfg.cam else None
+        self.shapeCfg = _shapecfg
+        self.servoCfg = _servocfg
+        #pylint: enable=no-member
+
+        return _diff
+
+    def _phase(self, name: str, t_start: float) -> None:
+        """Store the duration of a startup phase"""
+        self.STARTUP_MS[name] = round(1000.0 * (monotonic() - t_start), 1)
+
+    def _probe_internet(self) -> None:
+        """Check the internet connection (DNS server port 53/tcp), set INTERNETUSE"""
+        try:
+            with socket.create_connection(("8.8.8.8", 53), timeout=INTERNET_TIMEOUT):
+                driveLogger.info("Internet connection available.")
+
+        except TimeoutError:
+            driveLogger.info("Internet connection NOT available (socket timeout)!? Continuing in off-line mode.")
+            self.INTERNETUSE = False
+
+        except OSError:
+            driveLogger.info("Network is unreachable!? Continuing in off-line mode.")
+            self.INTERNETUSE = False
 
     ## SystemD functions
     def journal_send(self, msg_str: str) -> None:
@@ -255,6 +620,9 @@ class DriveConfig:
 
     def daemon_notify(self, msg_str: str) -> None:
         """ Send notification message to the systemd daemon """
+        # Write the queued and staged log records before the stop
+        if msg_str.startswith("STOPPING="):
+            flush_logger()
         if self.SYSTEMDUSE:
             daemon.notify(msg_str)
 
@@ -19,18 +19,41 @@
 
 # pylint: disable=line-too-long
 
-from time import sleep
+import threading
+from collections import Counter
+from time import sleep, monotonic
 from math import tan, atan2, pi, sqrt
 
 # Local
-from approxeng.input.selectbinder import ControllerResource
 from drivelogger import driveLogger
 from driveconfig import driveCfg
+from drivepca import PCA9685Bulk, servo_tables
+from driverecorder import driveRecorder
+from drivepower import drivePower
+
+# Attempt to import the rover library, otherwise use the simulated rover library
+try:
+    import rover
+    ROVER_SIM = False
+except ImportError:
+    import roversim as rover
+    ROVER_SIM = True
+    driveLogger.warning("M.A.R.S. Rover library is NOT available, using the simulated rover library!")
+
+try:
+    import numpy as np
+    NUMPY_MOD = True
+except ImportError:
+    driveLogger.info("The numpy module was not found. The array mixer functions are not available.")
+    NUMPY_MOD = False
 
 # Default/initial rover speed and movement direction
 SPEED = 20
 DIR = 0
 
+# The steering servo IDs (front left, front right, rear left, rear right), bound once
+STEER_SERVOS = (driveCfg.SERVO_FL, driveCfg.SERVO_FR, driveCfg.SERVO_RL, driveCfg.SERVO_RR)
+
 # The last direction used
 #prev_dir = 0
 
@@ -144,16 +167,238 @@ def calc_ackerman_steering(dir_deg: float = DIR, speed_per: float = SPEED) -> tu
 
     return dir_left, dir_right, speed_left, speed_right
 
+
+class AckermanTable:
+    """
+    Precomputed Ackerman rover steering.
+    The wheel angles and speed scale factors used in calc_ackerman_steering() depend only on
+    the (clamped) steering angle, and are tabulated once for quantized steering angles
+    between 0 and the max steering angle allowed by the chassis (see calc_ackerman_steering).
+    The steer() method is a drop-in replacement for calc_ackerman_steering().
+
+    With the default 0.5 deg table step and linear interpolation the wheel angles
+    are within 0.005 deg and the speed scale factors within 1e-4 of the closed-form values,
+    i.e. the returned (truncated) integer values are identical or differ by 1
+    when the closed-form value is within the tolerance of an integer.
+    """
+
+    def __init__(self, dol: float = driveCfg.DoL, step_deg: float = 0.5, interp: bool = True):
+        """
+        :param dol:
+            The ratio between the chassis width and length (driveCfg.DoL)
+        :param step_deg:
+            Steering angle table step (degrees)
+        :param interp:
+            Use linear interpolation between the table entries (True) or the nearest entry (False)
+        """
+        self.dol = dol
+        self.interp = interp
+        self.max_deg = (180.0/pi) * atan2(1.0, 1.2*dol)
+
+        _num = int(self.max_deg / step_deg + 0.999999) + 1
+        self.step_deg = self.max_deg / (_num - 1)
+        self._inv_step = 1.0 / self.step_deg
+
+        # Table rows: dir_up_deg, dir_down_deg, speed_up_scale, speed_down_scale,
+        # followed by the differences to the next row (used for interpolation)
+        _rows = [self._closed_form(_k * self.step_deg) for _k in range(_num)]
+        _rows.append(_rows[-1])
+        self._table = [
+            _r0 + tuple(_v1 - _v0 for _v0, _v1 in zip(_r0, _r1))
+            for _r0, _r1 in zip(_rows[:-1], _rows[1:])]
+        self._last = _num - 1
+
+    def _closed_form(self, dir_deg: float) -> tuple[float, float, float, float]:
+        """
+        The closed-form wheel angles and speed scale factors, as in calc_ackerman_steering().
+
+        :param dir_deg:
+            Steering angle, ranges from 0 to max_deg (degrees)
+        :return:
+            A tuple with dir_up_deg, dir_down_deg, speed_up_scale, speed_down_scale
+        """
+        if dir_deg == 0.0:
+            return 0.0, 0.0, 1.0, 1.0
+        _tan = tan(min((pi/180.0) * dir_deg, atan2(1.0, 1.2*self.dol)))
+        return (
+            (180.0/pi) * atan2(1.0, (1.0/_tan - self.dol)),
+            (180.0/pi) * atan2(1.0, (1.0/_tan + self.dol)),
+            sqrt(_tan**2 + (1 + self.dol*_tan)**2),
+            sqrt(_tan**2 + (1 - self.dol*_tan)**2))
+
+    def lookup(self, dir_deg: float) -> tuple[float, float, float, float]:
+        """
+        The tabulated wheel angles and speed scale factors.
+
+        :param dir_deg:
+            Steering angle (degrees), only the absolute value is used
+        :return:
+            A tuple with dir_up_deg, dir_down_deg, speed_up_scale, speed_down_scale
+        """
+        _idx = abs(dir_deg) * self._inv_step
+        if _idx >= self._last:
+            _r = self._table[self._last]
+            return _r[0], _r[1], _r[2], _r[3]
+        if self.interp:
+            _k = int(_idx)
+            _f = _idx - _k
+            _r = self._table[_k]
+            return _r[0] + _f*_r[4], _r[1] + _f*_r[5], _r[2] + _f*_r[6], _r[3] + _f*_r[7]
+        _r = self._table[int(_idx + 0.5)]
+        return _r[0], _r[1], _r[2], _r[3]
+
+    def steer(self, dir_deg: float = DIR, speed_per: float = SPEED) -> tuple[int, int, int, int]:
+        """
+        Calculate Ackerman rover steering using the table.
+        Same parameters and return values as calc_ackerman_steering().
+        """
+        if dir_deg == 0.0:
+            # Limit the speed to 100, as in calc_ackerman_steering()
+            if speed_per != 0.0 and 1.0 > 100/speed_per:
+                speed_per = 100.0
+            return 0, 0, speed_per, speed_per
+
+        dir_up, dir_down, speed_up_scale, speed_down_scale = self.lookup(dir_deg)
+        if speed_per == 0.0:
+            speed_up_scale = 1.0
+            speed_down_scale = 1.0
+        elif speed_up_scale > 100/speed_per:
+            speed_per = 100/speed_up_scale
+
+        if dir_deg > 0:
+            return int(dir_down), int(dir_up), int(speed_per * speed_up_scale), int(speed_per * speed_down_scale)
+        return int(-dir_up), int(-dir_down), int(speed_per * speed_down_scale), int(speed_per * speed_up_scale)
+
+    def max_error(self, num: int = 10000) -> tuple[float, float]:
+        """
+        The max deviation from the closed-form values over the steering angle range.
+
+        :param num:
+            Number of steering angles to test
+        :return:
+            A tuple with the max wheel angle error (degrees) and the max speed scale factor error
+        """
+        _err_dir = 0.0
+        _err_speed = 0.0
+        for _k in range(num + 1):
+            _deg = 1.1 * self.max_deg * _k / num
+            _ref = self._closed_form(_deg)
+            _val = self.lookup(_deg)
+            _err_dir = max(_err_dir, abs(_val[0] - _ref[0]), abs(_val[1] - _ref[1]))
+            _err_speed = max(_err_speed, abs(_val[2] - _ref[2]), abs(_val[3] - _ref[3]))
+        return _err_dir, _err_speed
+
+
+#pylint: disable=no-member
+ackermanTable = AckermanTable(
+    driveCfg.DoL,
+    step_deg=driveCfg.mainCfg.ackermann_lut_step,
+    interp=driveCfg.mainCfg.ackermann_lut_interp)
+if driveCfg.mainCfg.ackermann_lut:
+    ackerman_steering = ackermanTable.steer
+else:
+    ackerman_steering = calc_ackerman_steering
+#pylint: enable=no-member
+
+# Array mixers functions
+# The same mapping as in the mixer_speed(), mixer_dir() and calc_ackerman_steering() functions,
+# applied element-wise to numpy arrays of controller axes values (e.g. a recorded session).
+# NOTE: The numpy and math trigonometric functions can differ in the last bit,
+# which (rarely) changes a truncated integer value by 1.
+
+
+def mixer_speed_array(yaw, throttle, max_speed: int = 100) -> tuple:
+    """
+    Array version of mixer_speed().
+
+    :param yaw: 
+        Array of yaw axis values, ranges from -1.0 to 1.0
+    :param throttle: 
+        Array of throttle axis values, ranges from -1.0 to 1.0
+    :param max_speed: 
+        Maximum speed that should be returned from the mixer
+        defaults to 100.0 (percentage of max speed)
+    :return: 
+        A pair of arrays with the power_left, power_right values;
+        power_right is 0 where yaw = 0 (as in mixer_speed())
+    """
+    yaw, throttle = np.broadcast_arrays(np.asarray(yaw, dtype=float), np.asarray(throttle, dtype=float))
+    left = throttle + yaw
+    right = throttle - yaw
+    scale = float(max_speed) / np.maximum(1, np.maximum(np.abs(left), np.abs(right)))
+    return left * scale, np.where(yaw == 0.0, 0.0, right * scale)
+
+
+def mixer_dir_array(l_r, f_b, max_dir: float = 45.0):
+    """
+    Array version of mixer_dir().
+
+    :param l_r: 
+        Array of left-right axis values, ranges from -1.0 to +1.0
+    :param f_b: 
+        Array of fwd-back axis values, ranges from -1.0 to +1.0
+    :param max_dir: 
+        Maximum direction that should be returned from the mixer
+        defaults to 45 (degrees)
+    :return: 
+        An array of direction values (degrees)
+    """
+    angle_rel = (2/pi)*np.arctan2(np.asarray(l_r, dtype=float), np.abs(np.asarray(f_b, dtype=float)))
+    scale = float(max_dir) / np.maximum(1, np.abs(angle_rel))
+    return angle_rel * scale
+
+
+def calc_ackerman_steering_array(dir_deg, speed_per, dol: float = driveCfg.DoL) -> tuple:
+    """
+    Array version of calc_ackerman_steering().
+
+    :param dir_deg: 
+        Array of direction angle values (bicycle steering angle of the rover)
+        ranges from -90.0 to +90.0 (degrees)
+    :param speed_per: 
+        Array of speed values (chassis speed of the rover)
+        ranges from -100.0 to 100.0 (percentage of max speed)
+    :param dol:
+        The ratio between the chassis width and length
+    :return:
+        A tuple with the arrays dir_left, dir_right (int), speed_left, speed_right (float);
+        the speeds are truncated to integer values, except where dir_deg = 0 (as in calc_ackerman_steering())
+    """
+    dir_deg, speed_per = np.broadcast_arrays(np.asarray(dir_deg, dtype=float), np.asarray(speed_per, dtype=float))
+    dir_rad = np.minimum(np.abs((pi/180.0) * dir_deg), atan2(1.0, 1.2*dol))
+    tan_dir = np.tan(dir_rad)
+    with np.errstate(divide='ignore'):
+        # 1/tan = inf for dir_deg = 0, where arctan2(1, inf) = 0
+        cot_dir = 1.0 / tan_dir
+        dir_up = (180.0/pi) * np.arctan2(1.0, cot_dir - dol)
+        dir_down = (180.0/pi) * np.arctan2(1.0, cot_dir + dol)
+
+        # Limit the (higher) speed of the outer wheels to 100
+        speed_up_scale = np.sqrt(tan_dir**2 + (1 + dol*tan_dir)**2)
+        speed_down_scale = np.sqrt(tan_dir**2 + (1 - dol*tan_dir)**2)
+        speed_per = np.where((speed_per != 0.0) & (speed_up_scale > 100/speed_per), 100/speed_up_scale, speed_per)
+
+    pos = dir_deg > 0
+    neg = dir_deg < 0
+    dir_left = np.where(pos, np.trunc(dir_down), np.where(neg, np.trunc(-dir_up), 0)).astype(int)
+    dir_right = np.where(pos, np.trunc(dir_up), np.where(neg, np.trunc(-dir_down), 0)).astype(int)
+    speed_left = np.where(pos, np.trunc(speed_per * speed_up_scale),
+                          np.where(neg, np.trunc(speed_per * speed_down_scale), speed_per))
+    speed_right = np.where(pos, np.trunc(speed_per * speed_down_scale),
+                           np.where(neg, np.trunc(speed_per * speed_up_scale), speed_per))
+
+    return dir_left, dir_right, speed_left, speed_right
+
 # Force-feedback functions
 
 
-def rumble_start(wugc: ControllerResource = None) -> None:
+def rumble_start(wugc=None) -> None:
     """
     Activate force-feedback.
     Rumble tow times shortly.
 
     :param wugc: 
-        approxeng.input.selectbinder.ControllerResource
+        The game controller, as approxeng.input.selectbinder.ControllerResource (see driveinput.py)
     """
     if wugc is not None and driveCfg.FF_DEVICE is not None:
         wugc.ff_device = driveCfg.FF_DEVICE
@@ -163,13 +408,13 @@ def rumble_start(wugc: ControllerResource = None) -> None:
         sleep(0.5)
 
 
-def rumble_end(wugc: ControllerResource = None) -> None:
+def rumble_end(wugc=None) -> None:
     """
     Activate force-feedback.
     Rumble tow times shortly.
 
     :param wugc: 
-        approxeng.input.selectbinder.ControllerResource
+        The game controller, as approxeng.input.selectbinder.ControllerResource (see driveinput.py)
     """
     if wugc is not None and driveCfg.FF_DEVICE is not None:
         wugc.rumble()
@@ -249,311 +494,822 @@ def flash_led(led: int = 0, fnum: int = 3, dly: float = 0.5, col1: int = driveCf
 def set_rlfb_led(fwd: bool = True, dir_deg: float = 0.0) -> None:
     """
     Set forward-back and left-right LED.
+    The LED state is posted to the LED effects engine and rendered in the background.
+    Only the sign of the direction is posted, such that the turn indicators keep blinking
+    (the effect restarts only when the turn direction changes).
 
     :param fwd: 
         Movement forward (True) or reverse (False)
     :param dir_deg: 
-        Movement right (>0) or straight (=0) or left (<0)
+        Movement right (>0) or straight (=0 or None) or left (<0)
     """
-    if driveCfg.LED_NUM > 0:
-        if fwd:
-            # Set forward-back LEDs
-            if dir_deg > 0:  # right
-                rover.setPixel(1, driveCfg.LED_WHITE_H)
-                rover.setPixel(2, driveCfg.LED_WHITE)
+    _sign = 0 if dir_deg is None else (dir_deg > 0) - (dir_deg < 0)
+    driveLeds.post('drive', fwd=fwd, dir_sign=_sign)
 
-                flash_led(3, 1, 0.2, driveCfg.LED_RED, driveCfg.LED_RED_H)
+# LED effects engine
+# Each effect is a frame function returning the colors of all LEDs
+# at the time t (seconds) elapsed since the effect was posted
 
-            elif dir_deg < 0:  # left
-                rover.setPixel(1, driveCfg.LED_WHITE)
-                rover.setPixel(2, driveCfg.LED_WHITE_H)
 
-                flash_led(0, 1, 0.2, driveCfg.LED_RED, driveCfg.LED_RED_H)
+def _frame_solid(t: float, col: int = 0) -> tuple:
+    """All LEDs set to the same color"""
+    return (col,) * driveCfg.LED_NUM
 
-            else:
-                rover.setPixel(1, driveCfg.LED_WHITE_H)
-                rover.setPixel(2, driveCfg.LED_WHITE_H)
 
-            # Set back LEDs
-            rover.setPixel(0, driveCfg.LED_RED_H)
-            rover.setPixel(3, driveCfg.LED_RED_H)
+def _frame_flash(t: float, col: int = 0, fnum: int = 3, dly: float = 0.5) -> tuple:
+    """All LEDs flash fnum times, dly seconds on and dly seconds off"""
+    _phase = int(t / dly)
+    if _phase < 2*fnum and _phase % 2 == 0:
+        return (col,) * driveCfg.LED_NUM
+    return (driveCfg.LED_BLACK,) * driveCfg.LED_NUM
 
-        else:
-            # Set back LEDs
-            if dir_deg > 0:  # right
-                rover.setPixel(0, driveCfg.LED_RED_H)
 
-                flash_led(3, 1, 0.2, driveCfg.LED_RED, driveCfg.LED_RED_H)
+def _frame_seq(t: float, col: int = 0, fnum: int = 3, dly: float = 0.5) -> tuple:
+    """All LEDs lit in sequence, fnum times, for dly seconds each"""
+    _step = int(t / dly)
+    _frame = [driveCfg.LED_BLACK] * driveCfg.LED_NUM
+    if _step < fnum * driveCfg.LED_NUM:
+        _frame[_step % driveCfg.LED_NUM] = col
+    return tuple(_frame)
 
-            elif dir_deg < 0:  # left
-                rover.setPixel(3, driveCfg.LED_RED_H)
 
-                flash_led(0, 1, 0.2, driveCfg.LED_RED, driveCfg.LED_RED_H)
+def _frame_drive(t: float, fwd: bool = True, dir_sign: int = 0, dly: float = 0.2) -> tuple:
+    """Forward-back and left-right LEDs, with blinking turn indicators (dir_sign 1 right, 0 straight, -1 left)"""
+    _blink = driveCfg.LED_RED if int(t / dly) % 2 == 0 else driveCfg.LED_RED_H
+    _frame = [driveCfg.LED_RED_H, driveCfg.LED_WHITE_H, driveCfg.LED_WHITE_H, driveCfg.LED_RED_H]
 
-            else:
-                rover.setPixel(0, driveCfg.LED_RED_H)
-                rover.setPixel(3, driveCfg.LED_RED_H)
+    if fwd:
+        if dir_sign > 0:  # right
+            _frame[2] = driveCfg.LED_WHITE
+            _frame[3] = _blink
+        elif dir_sign < 0:  # left
+            _frame[1] = driveCfg.LED_WHITE
+            _frame[0] = _blink
+    else:
+        if dir_sign > 0:  # right
+            _frame[3] = _blink
+        elif dir_sign < 0:  # left
+            _frame[0] = _blink
 
-            # Set forward LEDs
-            rover.setPixel(1, driveCfg.LED_WHITE_H)
-            rover.setPixel(2, driveCfg.LED_WHITE_H)
+    return tuple(_frame[:driveCfg.LED_NUM])
 
-        rover.show()
 
+LED_EFFECTS = {
+    'solid': _frame_solid,
+    'flash': _frame_flash,
+    'seq': _frame_seq,
+    'drive': _frame_drive,
+}
 
-# Attempt to import and initialise rover library
-try:
-    import rover
 
-    def init_rover(led_brightness: int = 0) -> None:
+class LedEngine:
+    """
+    LED effects engine.
+    The LED effects are rendered as time-based frames in a background thread,
+    and only the LEDs which changed since the previous frame are written.
+    The driving code only posts the requested effect and returns immediately.
+    """
+
+    def __init__(self, fps: float = 25.0):
+        """
+        :param fps:
+            Frame rate used to render the LED effects
+        """
+        self.period = 1.0 / fps
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._effect = None
+        self._pixels = []
+        self._thread = None
+        self._running = False
+
+        # Counters
+        self.posts = 0
+        self.frames = 0
+
+    def start(self, thread: bool = True) -> None:
         """
-        Initialise rover library.
+        Start the LED effects.
 
-        :param led_brightness: 
-            LEDs default brightness, rnages from 0 to 100
-        :return: 
-            String with intialisation message
+        :param thread:
+            Render the LED effects in the LED effects thread (True), or with render() calls (False)
         """
-        if driveCfg.LED_NUM > 0:
-            # Init rover with initial LED brightness
-            rover.init(led_brightness)
-            # Set all LED to green
-            flash_all_leds(3, 0.5, driveCfg.LED_GREEN)
-            flash_all_leds(1, 0.1, driveCfg.LED_GREEN_H)
-        else:
-            # No LEDs
-            rover.init(0)
-
-        driveLogger.debug(
-            "Rover initialisation. LED brightness = %d", led_brightness)
-        info_str = 'M.A.R.S. Rover library available.'
-        driveLogger.info(info_str)
-        driveCfg.journal_send(info_str)
-
-    def move_rover(dir_deg: float = DIR, speed_per: float = SPEED) -> None:
-        """
-        Set simple rover steering: direction (left or right) and speed (forward or reverse).
-        All motors set to the same speed.
-
-        :param dir_deg: 
-            Direction angle value
-            ranges from -90.0 to +90.0 (degrees)
-            A None value keeps unchnaged the current direction
-        :param speed_per: 
-            Speed value
-            ranges from -100 .0 to 100.0 (percentage of max speed)
-        """
-        if dir_deg is not None:
-            rover.setServo(driveCfg.SERVO_FL, dir_deg)
-            rover.setServo(driveCfg.SERVO_FR, dir_deg)
-            rover.setServo(driveCfg.SERVO_RL, -1*dir_deg)
-            rover.setServo(driveCfg.SERVO_RR, -1*dir_deg)
-            driveLogger.debug("Direction=%f", dir_deg)
-
-        if speed_per == 0:
-            # Coast to stop
-            rover.stop()
-
-            # Set all LED to red
-            flash_all_leds(1, 0.1, driveCfg.LED_RED_H)
-
-        elif speed_per > 0:
-            # Move forward
-            rover.forward(abs(int(speed_per)))
-
-            # Set forward-back left-right LED
-            set_rlfb_led(True, dir_deg)
-
-        elif speed_per < 0:
-            # Move backward
-            rover.reverse(abs(int(speed_per)))
-
-            # Set forward-back left-right LED
-            set_rlfb_led(False, dir_deg)
-
-        driveLogger.debug("Speed=%f", speed_per)
-
-    def move_rover_ackerman(dir_deg: float = DIR, speed_per: float = SPEED) -> None:
-        """
-        Set Ackerman rover steering: direction (left or right) and speed (forward or reverse).
-        Left and Right motors can be set to different speeds and angles 
-        according to Ackerman steering geometry. 
-        See https://www.mathworks.com/help/sm/ug/mars_rover.html
-        NOTE: Due to the 4tronix circuit design of the Main Board 
-        all three wheels on the same side of the rover are set to the same speed!
-
-        :param dir_deg: 
-            Direction angle value (steering angle of the rover)
-            ranges from -90.0 to +90.0 (degrees)
-            A None value keeps unchanged the current direction
-        :param speed_per: 
-            Speed value (speed of the rover) 
-            ranges from -100.0 to 100.0 (percentage of max speed)
-        """
-
-        # Calculate the Ackerman steering parameters
-        if dir_deg is not None:
-            dir_left, dir_right, speed_left, speed_right = calc_ackerman_steering(
-                dir_deg, speed_per)
-            prev_dir = dir_deg
-
-            # Apply new steering angles
-            rover.setServo(driveCfg.SERVO_FL, dir_left)
-            rover.setServo(driveCfg.SERVO_FR, dir_right)
-            rover.setServo(driveCfg.SERVO_RL, -1*dir_left)
-            rover.setServo(driveCfg.SERVO_RR, -1*dir_right)
+        if self._running or driveCfg.LED_NUM == 0:
+            return
+        self._pixels = [None] * driveCfg.LED_NUM
+        if not thread:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='LedEngine', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the LED effects"""
+        if not self._running:
+            self._pixels = []
+            return
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self._pixels = []
+
+    def post(self, effect: str = 'solid', **kwargs) -> None:
+        """
+        Post a new LED effect.
+        Posting the effect which is already shown does not restart it.
 
-        else:
-            # Use the last direction value
-            dir_deg = prev_dir
-            dir_left, dir_right, speed_left, speed_right = calc_ackerman_steering(
-                dir_deg, speed_per)
+        :param effect:
+            Effect name, one of LED_EFFECTS
+        :param kwargs:
+            Effect parameters
+        """
+        _func = LED_EFFECTS[effect]
+        with self._lock:
+            if self._effect is not None and self._effect[0] is _func and self._effect[1] == kwargs:
+                return
+            self._effect = (_func, kwargs, monotonic())
+            self.posts += 1
+        self._wake.set()
+
+    def _run(self) -> None:
+        """Render the LED frames"""
+        while self._running:
+            self.render()
+            self._wake.wait(self.period)
+            self._wake.clear()
+
+    def render(self) -> None:
+        """
+        Render one frame of the current LED effect.
+        Called from the LED effects thread, or periodically by the caller when the thread is not started.
+        """
+        with self._lock:
+            _effect = self._effect
+        if _effect is not None and self._pixels:
+            _func, _kwargs, _t0 = _effect
+            self._show(_func(monotonic() - _t0, **_kwargs))
+
+    def _show(self, frame: tuple) -> None:
+        """Write the changed LEDs"""
+        _changed = False
+        for _l, _col in enumerate(frame):
+            if self._pixels[_l] != _col:
+                rover.setPixel(_l, _col)
+                self._pixels[_l] = _col
+                _changed = True
+        if _changed:
+            rover.show()
+            self.frames += 1
 
-        driveLogger.debug("Direction=%d (left=%d, right=%d)",
-                          dir_deg, dir_left, dir_right)
 
-        if speed_per == 0:
-            # Coast to stop
-            rover.stop()
+driveLeds = LedEngine()
 
-            speed_left = 0
-            speed_right = 0
 
-            # Set all LED to red
-            flash_all_leds(1, 0.1, driveCfg.LED_RED_H)
+# Actuator writes
 
-        elif speed_per > 0:
-            # Move forward
-            rover.turnForward(speed_left, speed_right)
 
-            # Set front-back left-right LEDs
-            set_rlfb_led(True, dir_deg)
+class ActuatorCache:
+    """
+    Delta-suppressed actuator writes.
+    The last value written to each servo channel and to the (left, right) motors is cached,
+    and a new value is written only when it differs from the last written value by at least the deadband
+    (i.e. with hysteresis around the last written value). The servo centre (0 deg) and
+    a change of the motor command (e.g. forward to stop) are always written.
+    The calibrated servos are set through their lookup tables (see drivepca.ServoTable).
+    """
 
-        elif speed_per < 0:
-            # Move backward
-            rover.turnReverse(speed_left, speed_right)
+    def __init__(self, servo_deadband: float = 1.0, speed_deadband: float = 1.0):
+        """
+        :param servo_deadband:
+            Servo angle deadband (degrees)
+        :param speed_deadband:
+            Motor speed deadband (percentage of max speed)
+        """
+        self.servo_deadband = servo_deadband
+        self.speed_deadband = speed_deadband
+        self._servos = {}
+        self._motors = None
 
-            # Set front-back left-right LEDs
-            set_rlfb_led(False, dir_deg)
+        # Bulk PCA9685 servo writes (drivepca.PCA9685Bulk), when used
+        self.bulk = None
+        # The servo lookup tables, by servo ID (see calibrate_servos())
+        self.tables = {}
 
-        driveLogger.debug("Speed=%d (left=%d, right=%d)",
-                          speed_per, speed_left, speed_right)
+        # Counters per channel
+        self.writes = Counter()
+        self.suppressed = Counter()
 
-    def stop_rover() -> None:
+    def set_servo(self, servo: int, degrees: float) -> bool:
         """
-        Coast to stop.
+        Set the servo angle, when changed.
+
+        :param servo:
+            Servo ID
+        :param degrees:
+            Servo angle (degrees)
+        :return:
+            True if the servo was written
         """
+        _last = self._servos.get(servo)
+        if _last is not None and abs(degrees - _last) < self.servo_deadband and (degrees != 0 or _last == 0):
+            self.suppressed[servo] += 1
+            return False
+
+        # Set with the rover library, with its EEPROM servo offset
+        rover.setServo(servo, self.servo_angle(servo, degrees))
+        if self.bulk is not None:
+            self.bulk.update_shadow({servo: degrees})
+        self._servos[servo] = degrees
+        self.writes[servo] += 1
+        return True
+
+    def set_servos(self, servos: dict) -> int:
+        """
+        Set several servo angles, when changed.
+        The changed servos are written together in one bulk PCA9685 update when available.
 
-        # Stop rover
-        rover.stop()
+        :param servos:
+            Dictionary with the servo ID and the servo angle (degrees)
+        :return:
+            The number of servos written
+        """
+        _changed = {}
+        for _servo, _deg in servos.items():
+            _last = self._servos.get(_servo)
+            if _last is not None and abs(_deg - _last) < self.servo_deadband and (_deg != 0 or _last == 0):
+                self.suppressed[_servo] += 1
+            else:
+                _changed[_servo] = _deg
+                self.writes[_servo] += 1
 
-        # Flash 3 times all LEDs in red
-        flash_all_leds(3, 0.5, driveCfg.LED_RED)
+        if _changed:
+            if self.bulk is not None:
+                self.bulk.set_servos(_changed)
+            else:
+                for _servo, _deg in _changed.items():
+                    rover.setServo(_servo, self.servo_angle(_servo, _deg))
+            self._servos.update(_changed)
+        return len(_changed)
 
-        driveLogger.debug('Motors coast to stop!')
+    def set_tables(self, tables: dict) -> None:
+        """
+        Set the servo lookup tables; the servos are written at their next update.
 
-    def brake_rover() -> None:
+        :param tables:
+            Dictionary with the servo ID and its lookup table (see drivepca.servo_tables())
         """
-        Brake and stop quickly.
+        self.tables = tables
+        if self.bulk is not None:
+            self.bulk.tables = tables
+        # Forget the last servo angles only: the tables are swapped while the actuator thread may be writing
+        self._servos.clear()
+
+    def servo_angle(self, servo: int, degrees: float) -> float:
+        """The calibrated servo angle, for rover.setServo()"""
+        _table = self.tables.get(servo)
+        return degrees if _table is None else _table.angles[_table.index(degrees)]
+
+    def set_motors(self, command: str, *speeds) -> bool:
         """
-        rover.brake()
-        rover.setServo(driveCfg.SERVO_FL, 0)
-        rover.setServo(driveCfg.SERVO_FR, 0)
-        rover.setServo(driveCfg.SERVO_RL, 0)
-        rover.setServo(driveCfg.SERVO_RR, 0)
-
-        # Flash 3 times all LEDs in red
-        flash_all_leds(3, 1, driveCfg.LED_RED)
-
-        driveLogger.debug('Motors stop quickly!')
-
-    def cleanup_rover() -> None:
+        Set the motors, when changed.
+
+        :param command:
+            The rover motor command: 'stop', 'forward', 'reverse', 'turnForward', 'turnReverse', 'spinLeft' or 'spinRight'
+        :param speeds:
+            The rover motor command speed values
+        :return:
+            True if the motors were written
         """
-        Cleanup rover library.
+        # Speed governor: the speeds are capped when the battery weakens (see drivepower.py)
+        _cap = drivePower.speed_cap
+        if _cap < 100:
+            speeds = tuple(int(_s * _cap / 100) for _s in speeds)
+
+        _last = self._motors
+        if _last is not None and _last[0] == command and all(abs(_s - _l) < self.speed_deadband for _s, _l in zip(speeds, _last[1])):
+            self.suppressed['motors'] += 1
+            return False
+
+        getattr(rover, command)(*speeds)
+        self._motors = (command, speeds)
+        self.writes['motors'] += 1
+        return True
+
+    def invalidate(self) -> None:
+        """Forget the cached values, e.g. after direct writes to the rover"""
+        self._servos.clear()
+        self._motors = None
+        if self.bulk is not None:
+            self.bulk.refresh()
+
+    def stats(self) -> dict:
         """
-        # Rotating LED lights
-        seq_all_leds(3, 0.1, driveCfg.LED_RED)
+        Write statistics.
 
-        # Clean exit
-        rover.cleanup()
+        :return:
+            Dictionary with the total number of writes and suppressed writes,
+            and the numbers per channel (servo ID or 'motors')
+        """
+        return {
+            'writes': sum(self.writes.values()),
+            'suppressed': sum(self.suppressed.values()),
+            'channels': {str(_ch): (self.writes[_ch], self.suppressed[_ch]) for _ch in set(self.writes) | set(self.suppressed)},
+        }
 
-        driveLogger.debug('Rover cleanup!')
 
+#pylint: disable=no-member
+driveActuators = ActuatorCache(
+    servo_deadband=driveCfg.mainCfg.servo_deadband,
+    speed_deadband=driveCfg.mainCfg.speed_deadband)
+#pylint: enable=no-member
 
-# No rover libary - do nothing.
-except ImportError:
 
-    def init_rover(led_brightness: int = 0) -> str:
+class Mailbox:
+    """
+    Latest-value-wins mailbox.
+    A posted item replaces the item not yet taken (which is counted as dropped),
+    such that the consumer always gets the most recent item.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._t_post = 0.0
+
+        # Counters and queue age (seconds)
+        self.posted = 0
+        self.taken = 0
+        self.dropped = 0
+        self.age_sum = 0.0
+        self.age_max = 0.0
+
+    def post(self, item) -> None:
+        """Post an item, replacing the item not yet taken"""
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._t_post = monotonic()
+            self.posted += 1
+            self._cond.notify()
+
+    def take(self, timeout: float = None):
         """
-        No rover libary - do nothing.
+        Take the item, waiting for it max timeout seconds.
 
-        :param led_brightness: 
-            LEDs default brightness, rnages from 0 to 100
-        :return: 
-            String with intialisation message
+        :return:
+            The item, or None on timeout
+        """
+        with self._cond:
+            if self._item is None and not self._cond.wait(timeout):
+                return None
+            _item = self._item
+            if _item is None:
+                return None
+            self._item = None
+            _age = monotonic() - self._t_post
+            self.taken += 1
+            self.age_sum += _age
+            self.age_max = max(self.age_max, _age)
+            return _item
+
+    def clear(self) -> None:
+        """Drop the item not yet taken"""
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = None
+
+    def wake(self) -> None:
+        """Wake up the consumer waiting in take()"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
         """
-        driveLogger.info('Dummy: Rover initialisation. LED brightness = %d)', led_brightness)
-        warn_str = 'M.A.R.S. Rover library is NOT available, using dummy functions!'
-        driveLogger.warning(warn_str)
-        return warn_str
+        Mailbox statistics.
 
-    def move_rover(dir_deg: float = DIR, speed_per: int = SPEED) -> None:
+        :return:
+            Dictionary with the number of items posted, taken and dropped,
+            and the mean and max queue age (ms)
         """
-        No rover libary - print what we would have sent to it if we'd had one.
+        return {
+            'posted': self.posted,
+            'taken': self.taken,
+            'dropped': self.dropped,
+            'age_mean_ms': 1000.0 * self.age_sum / self.taken if self.taken else 0.0,
+            'age_max_ms': 1000.0 * self.age_max,
+        }
 
-        :param dir_deg: 
-            Direction angle value, ranges from -90.0 to +90.0
-            A None value keeps unchnaged the current direction
-        :param speed_per: 
-            Speed value, ranges from -100 to 100
+
+class ActuatorWorker:
+    """
+    Actuator thread.
+    The driving commands (e.g. move_rover(dir_deg, speed_per)) are posted to a latest-value-wins mailbox,
+    and executed in the actuator thread, such that the input sampling is not delayed by the actuator writes.
+    The stale commands not yet executed are dropped.
+    When the thread is not started, the posted commands are executed immediately.
+    """
+
+    def __init__(self):
+        self.mailbox = Mailbox()
+        self._thread = None
+        self._running = False
+        self.errors = 0
+
+    def start(self) -> None:
+        """Start the actuator thread"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='Actuators', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the actuator thread, dropping the command not yet executed"""
+        if not self._running:
+            return
+        self._running = False
+        self.mailbox.clear()
+        self.mailbox.wake()
+        self._thread.join()
+        self._thread = None
+
+    def post(self, func, *args) -> None:
         """
-        driveLogger.info("Dummy: Direction=%d, Speed=%d", dir_deg, speed_per)
-        sleep(0.1)
+        Post a driving command.
 
-    def move_rover_ackerman(dir_deg: float = DIR, speed_per: int = SPEED) -> None:
+        :param func:
+            The driving function, e.g. move_rover
+        :param args:
+            The driving function arguments
+        """
+        if self._running:
+            self.mailbox.post((func, args))
+        else:
+            func(*args)
+
+    def _run(self) -> None:
+        """Execute the driving commands"""
+        while self._running:
+            _cmd = self.mailbox.take(timeout=0.5)
+            if _cmd is None:
+                continue
+            _func, _args = _cmd
+            try:
+                _func(*_args)
+            except Exception as _e: #pylint: disable=broad-except
+                self.errors += 1
+                driveLogger.error("Actuator command %s%s failed: %s", _func.__name__, _args, _e)
+
+    def stats(self) -> dict:
         """
-        No rover libary - print what we would have sent to it if we'd had one.
+        Actuator thread statistics.
 
-        :param dir_deg: 
-            Direction angle value, ranges from -90.0 to +90.0
-            A None value keeps unchnaged the current direction
-        :param speed_per: 
-            Speed value, ranges from -100 to 100
+        :return:
+            Dictionary with the mailbox statistics and the number of failed commands
         """
-        # Calculate the Ackerman steering parameters
-        if dir_deg is not None:
-            prev_dir = dir_deg
+        return dict(self.mailbox.stats(), errors=self.errors)
+
+
+driveWorker = ActuatorWorker()
+
+
+# Rover control functions
+
+
+def set_led_brightness(led_brightness: int = 0) -> bool:
+    """
+    Set the LEDs brightness, without the rover re-initialisation.
+
+    :param led_brightness: 
+        LEDs brightness, as in init_rover()
+    :return: 
+        True if set, False if the rover library LED strip is not available
+    """
+    _leds = getattr(rover, 'leds', None)
+    if driveCfg.LED_NUM == 0 or _leds is None:
+        return False
+    _leds.setBrightness(led_brightness)
+    return True
+
+
+def init_rover(led_brightness: int = 0) -> None:
+    """
+    Initialise rover library.
+
+    :param led_brightness: 
+        LEDs default brightness, rnages from 0 to 100
+    :return: 
+        String with intialisation message
+    """
+    if driveCfg.LED_NUM > 0:
+        # Init rover with initial LED brightness
+        rover.init(led_brightness)
+        if driveCfg.FASTSTART:
+            # Start the LED effects engine and flash all LEDs green, without waiting
+            driveLeds.start()
+            driveLeds.post('flash', col=driveCfg.LED_GREEN, fnum=3, dly=0.5)
         else:
-            # Use the last direction value
-            dir_deg = prev_dir
-        dir_left, dir_right, speed_left, speed_right = calc_ackerman_steering(dir_deg, speed_per)
+            # Set all LED to green
+            flash_all_leds(3, 0.5, driveCfg.LED_GREEN)
+            flash_all_leds(1, 0.1, driveCfg.LED_GREEN_H)
 
-        driveLogger.info(
-            "Dummy: Direction=%d (left=%d, right=%d)", dir_deg, dir_left, dir_right)
+            # Start the LED effects engine
+            driveLeds.start()
+    else:
+        # No LEDs
+        rover.init(0)
+
+    # Actuator thread
+    #pylint: disable=no-member
+    if driveCfg.mainCfg.actuator_thread:
+        driveWorker.start()
+    #pylint: enable=no-member
+
+    # Bulk PCA9685 servo writes
+    #pylint: disable=no-member
+    if driveCfg.mainCfg.servo_bulk:
+        try:
+            if ROVER_SIM:
+                _bus = rover.bus
+            else:
+                #pylint: disable=import-outside-toplevel
+                import smbus
+                _bus = smbus.SMBus(1)
+            driveActuators.bulk = PCA9685Bulk(_bus)
+            driveLogger.info("Bulk PCA9685 servo writes used.")
+        except (ImportError, OSError) as _e:
+            driveLogger.warning("Bulk PCA9685 servo writes not available: %s", _e)
+    #pylint: enable=no-member
+
+    # Servo calibration lookup tables
+    calibrate_servos()
+
+    driveLogger.debug(
+        "Rover initialisation. LED brightness = %d", led_brightness)
+    info_str = 'Simulated M.A.R.S. Rover library used.' if ROVER_SIM else 'M.A.R.S. Rover library available.'
+    driveLogger.info(info_str)
+    driveCfg.journal_send(info_str)
+
+
+def calibrate_servos() -> None:
+    """Build the servo lookup tables from the servoCfg section, for the steering and the mast servos"""
+    _cfg = driveCfg.servoCfg
+    _servos = {
+        driveCfg.SERVO_FL: _cfg.fl,
+        driveCfg.SERVO_FR: _cfg.fr,
+        driveCfg.SERVO_RL: _cfg.rl,
+        driveCfg.SERVO_RR: _cfg.rr}
+    if driveCfg.mastCfg is not None:
+        _servos[driveCfg.SERVO_MP] = _cfg.pan
+        if driveCfg.mastCfg.mast_type == 'pantilt':
+            _servos[driveCfg.SERVO_MT] = _cfg.tilt
+    # The bulk writes include the servo offsets of the rover library (EEPROM), added by rover.setServo()
+    _tables = servo_tables(_servos, _cfg.lut_step, getattr(rover, 'offsets', None))
+    driveActuators.set_tables(_tables)
+    driveLogger.info("Servo lookup tables (%.1f deg step): %s", _cfg.lut_step,
+                     ", ".join(f"{_servo} {_table}" for _servo, _table in _tables.items()))
+
+
+def move_rover(dir_deg: float = DIR, speed_per: float = SPEED) -> None:
+    """
+    Set simple rover steering: direction (left or right) and speed (forward or reverse).
+    All motors set to the same speed.
 
-        if speed_per == 0:
-            speed_left = 0
-            speed_right = 0
+    :param dir_deg: 
+        Direction angle value
+        ranges from -90.0 to +90.0 (degrees)
+        A None value keeps unchnaged the current direction
+    :param speed_per: 
+        Speed value
+        ranges from -100 .0 to 100.0 (percentage of max speed)
+    """
+    if dir_deg is not None:
+        _fl, _fr, _rl, _rr = STEER_SERVOS
+        driveActuators.set_servos({
+            _fl: dir_deg,
+            _fr: dir_deg,
+            _rl: -1*dir_deg,
+            _rr: -1*dir_deg})
+        driveLogger.debug("Direction=%f", dir_deg)
+    driveRecorder.set_wheels(dir_deg, dir_deg, speed_per, speed_per)
 
-        driveLogger.info("Dummy: Speed=%d (left=%d, right=%d)",
-                         speed_per, speed_left, speed_right)
-        sleep(0.1)
+    if speed_per == 0:
+        # Coast to stop
+        driveActuators.set_motors('stop')
 
-    def stop_rover() -> None:
-        """
-         No rover libary - do nothing.
-        """
-        rover.stop()
-        driveLogger.info('Dummy: Motors coast to stop!')
+        # Flash all LED in red
+        driveLeds.post('flash', col=driveCfg.LED_RED_H, fnum=1, dly=0.1)
 
-    def brake_rover() -> None:
-        """
-        No rover libary - do nothing.
-        """
-        driveLogger.info('Dummy: Motors stop quickly!')
+    elif speed_per > 0:
+        # Move forward
+        driveActuators.set_motors('forward', abs(int(speed_per)))
 
-    def cleanup_rover() -> None:
-        """
-        No rover libary - do nothing.
-        """
-        driveLogger.info('Dummy: rover.cleanup()')
+        # Set forward-back left-right LED
+        set_rlfb_led(True, dir_deg)
+
+    elif speed_per < 0:
+        # Move backward
+        driveActuators.set_motors('reverse', abs(int(speed_per)))
+
+        # Set forward-back left-right LED
+        set_rlfb_led(False, dir_deg)
+
+    driveLogger.debug("Speed=%f", speed_per)
+
+
+def move_rover_ackerman(dir_deg: float = DIR, speed_per: float = SPEED) -> None:
+    """
+    Set Ackerman rover steering: direction (left or right) and speed (forward or reverse).
+    Left and Right motors can be set to different speeds and angles 
+    according to Ackerman steering geometry. 
+    See https://www.mathworks.com/help/sm/ug/mars_rover.html
+    NOTE: Due to the 4tronix circuit design of the Main Board 
+    all three wheels on the same side of the rover are set to the same speed!
+
+    :param dir_deg: 
+        Direction angle value (steering angle of the rover)
+        ranges from -90.0 to +90.0 (degrees)
+        A None value keeps unchanged the current direction
+    :param speed_per: 
+        Speed value (speed of the rover) 
+        ranges from -100.0 to 100.0 (percentage of max speed)
+    """
+
+    # Calculate the Ackerman steering parameters
+    if dir_deg is not None:
+        dir_left, dir_right, speed_left, speed_right = ackerman_steering(
+            dir_deg, speed_per)
+        prev_dir = dir_deg
+
+        # Apply new steering angles
+        _fl, _fr, _rl, _rr = STEER_SERVOS
+        driveActuators.set_servos({
+            _fl: dir_left,
+            _fr: dir_right,
+            _rl: -1*dir_left,
+            _rr: -1*dir_right})
+
+    else:
+        # Use the last direction value
+        dir_deg = prev_dir
+        dir_left, dir_right, speed_left, speed_right = ackerman_steering(
+            dir_deg, speed_per)
+
+    driveLogger.debug("Direction=%d (left=%d, right=%d)",
+                      dir_deg, dir_left, dir_right)
+
+    if speed_per == 0:
+        # Coast to stop
+        driveActuators.set_motors('stop')
+
+        speed_left = 0
+        speed_right = 0
+
+        # Flash all LED in red
+        driveLeds.post('flash', col=driveCfg.LED_RED_H, fnum=1, dly=0.1)
+
+    elif speed_per > 0:
+        # Move forward
+        driveActuators.set_motors('turnForward', speed_left, speed_right)
+
+        # Set front-back left-right LEDs
+        set_rlfb_led(True, dir_deg)
+
+    elif speed_per < 0:
+        # Move backward
+        driveActuators.set_motors('turnReverse', speed_left, speed_right)
+
+        # Set front-back left-right LEDs
+        set_rlfb_led(False, dir_deg)
+
+    driveRecorder.set_wheels(dir_left, dir_right, speed_left, speed_right)
+    driveLogger.debug("Speed=%d (left=%d, right=%d)",
+                      speed_per, speed_left, speed_right)
+
+
+def spin_rover(dir_deg: float = 45.0, speed_per: float = SPEED) -> None:
+    """
+    Spin the rover in place: the wheels are set tangent to the turning circle
+    around the rover centre, and the left and right motors turn in opposite directions.
+
+    :param dir_deg: 
+        Wheel angle value (degrees), atan(chassis length / chassis width) for a spin around the centre
+        A None value keeps unchanged the current wheel angles
+    :param speed_per: 
+        Spin speed value
+        ranges from -100.0 (spin left) to 100.0 (spin right) (percentage of max speed)
+    """
+    if dir_deg is not None:
+        _fl, _fr, _rl, _rr = STEER_SERVOS
+        driveActuators.set_servos({
+            _fl: dir_deg,
+            _fr: -1*dir_deg,
+            _rl: -1*dir_deg,
+            _rr: dir_deg})
+    driveRecorder.set_wheels(dir_deg, None if dir_deg is None else -1*dir_deg, speed_per, -1*speed_per)
+
+    if speed_per == 0:
+        # Coast to stop
+        driveActuators.set_motors('stop')
+
+        # Flash all LED in red
+        driveLeds.post('flash', col=driveCfg.LED_RED_H, fnum=1, dly=0.1)
+
+    elif speed_per > 0:
+        driveActuators.set_motors('spinRight', abs(int(speed_per)))
+        driveLeds.post('solid', col=driveCfg.LED_BLUE_H)
+
+    elif speed_per < 0:
+        driveActuators.set_motors('spinLeft', abs(int(speed_per)))
+        driveLeds.post('solid', col=driveCfg.LED_BLUE_H)
+
+    driveLogger.debug("Spin speed=%f", speed_per)
+
+
+def crab_rover(dir_deg: float = DIR, speed_per: float = SPEED) -> None:
+    """
+    Crab rover steering: all wheels set to the same angle, such that
+    the rover moves diagonally without turning. All motors set to the same speed.
+
+    :param dir_deg: 
+        Direction angle value
+        ranges from -90.0 to +90.0 (degrees)
+        A None value keeps unchanged the current direction
+    :param speed_per: 
+        Speed value
+        ranges from -100.0 to 100.0 (percentage of max speed)
+    """
+    if dir_deg is not None:
+        driveActuators.set_servos(dict.fromkeys(STEER_SERVOS, dir_deg))
+        driveLogger.debug("Direction=%f", dir_deg)
+    driveRecorder.set_wheels(dir_deg, dir_deg, speed_per, speed_per)
+
+    if speed_per == 0:
+        # Coast to stop
+        driveActuators.set_motors('stop')
+
+        # Flash all LED in red
+        driveLeds.post('flash', col=driveCfg.LED_RED_H, fnum=1, dly=0.1)
+
+    elif speed_per > 0:
+        driveActuators.set_motors('forward', abs(int(speed_per)))
+        set_rlfb_led(True, dir_deg)
+
+    elif speed_per < 0:
+        driveActuators.set_motors('reverse', abs(int(speed_per)))
+        set_rlfb_led(False, dir_deg)
+
+    driveLogger.debug("Speed=%f", speed_per)
+
+
+def stop_rover() -> None:
+    """
+    Coast to stop.
+    """
+
+    # Stop the actuator thread and the rover
+    driveWorker.stop()
+    rover.stop()
+    driveActuators.invalidate()
+
+    # Stop the LED effects engine
+    driveLeds.stop()
+
+    # Flash 3 times all LEDs in red
+    flash_all_leds(3, 0.5, driveCfg.LED_RED)
+
+    driveLogger.debug('Motors coast to stop!')
+
+
+def brake_rover() -> None:
+    """
+    Brake and stop quickly.
+    """
+    driveWorker.stop()
+    rover.brake()
+    driveLeds.stop()
+    for _servo in STEER_SERVOS:
+        rover.setServo(_servo, driveActuators.servo_angle(_servo, 0))
+    driveActuators.invalidate()
+
+    # Flash 3 times all LEDs in red
+    flash_all_leds(3, 1, driveCfg.LED_RED)
+
+    driveLogger.debug('Motors stop quickly!')
+
+
+def cleanup_rover() -> None:
+    """
+    Cleanup rover library.
+    """
+    # Rotating LED lights
+    driveLeds.stop()
+    seq_all_leds(3, 0.1, driveCfg.LED_RED)
+
+    # Clean exit
+    rover.cleanup()
+
+    driveLogger.debug('Rover cleanup!')
@@ -0,0 +1,581 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Implements the controller input sources for the driveRover_wugc:
+the game controller (approxeng.input), the game controller read event-driven (epoll on the evdev devices),
+a scripted input (YAML keyframes) or a recorded session (JSON lines),
+with the same interface as the approxeng.input controller.
+"""
+
+# pylint: disable=line-too-long
+
+import sys
+import json
+import time
+import errno
+import fcntl
+import select
+import struct
+from time import monotonic, process_time
+
+import yaml
+
+# Local
+from drivelogger import driveLogger
+from driveconfig import driveCfg
+
+# Attempt to import approxeng.input library
+try:
+    # All we need, as we don't care which controller we bind to, is the ControllerResource
+    from approxeng.input.selectbinder import ControllerResource
+    from approxeng.input.controllers import find_matching_controllers
+    import approxeng.input.sys as approxeng_sys
+    APPROXENG_MOD = True
+except ImportError:
+    APPROXENG_MOD = False
+
+# The axes and buttons standard names
+AXES = ('lx', 'ly', 'rx', 'ry')
+CIRCULAR_AXES = {'l': ('lx', 'ly'), 'r': ('rx', 'ry')}
+BUTTONS = ('square', 'circle', 'triangle', 'cross', 'home', 'start', 'select',
+           'l1', 'r1', 'l2', 'r2', 'ls', 'rs', 'dup', 'ddown', 'dleft', 'dright')
+
+# evdev event types
+EV_KEY = 1
+EV_REL = 2
+EV_ABS = 3
+# ioctl to set the clock of the evdev event timestamps, _IOW('E', 0xa0, int)
+EVIOCSCLOCKID = 0x400445a0
+
+
+class InputFileError(Exception):
+    """The scripted or recorded controller input file cannot be loaded (not retried as a missing controller)"""
+
+
+class InputPresses:
+    """The buttons pressed between two check_presses() calls (as approxeng.input.ButtonPresses)"""
+
+    def __init__(self, names=()):
+        self.names = list(names)
+
+    def __getitem__(self, item):
+        if isinstance(item, tuple):
+            return [(_item in self.names) for _item in item]
+        return item in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    @property
+    def has_presses(self) -> bool:
+        """True if any button was pressed"""
+        return len(self.names) > 0
+
+    def __repr__(self):
+        return str(self.names)
+
+
+def load_frames(filename: str) -> list:
+    """
+    Load the input frames from a scripted input (YAML list of keyframes),
+    a recorded session (JSON lines) or a binary session log (see drivesession.py) file.
+    Each frame is a dictionary with the time 't' (seconds), the axes values and the list of held 'buttons'.
+    The axes values not set in a frame are kept from the previous frame.
+    The buttons pressed in a binary session log are held for one loop period.
+
+    :param filename:
+        The input file name, '*.jsonl' for a recorded session, '*.mrsl' for a binary session log
+    :return:
+        A list of frames (t, lx, ly, rx, ry, buttons), sorted by time
+    """
+    if filename.endswith('.mrsl'):
+        return load_session_frames(filename)
+
+    with open(filename, 'r', encoding='utf-8') as stream:
+        if filename.endswith('.jsonl'):
+            _raw = [json.loads(_line) for _line in stream if _line.strip()]
+        else:
+            _raw = yaml.load(stream, Loader=yaml.SafeLoader)
+
+    _frames = []
+    _axes = dict.fromkeys(AXES, 0.0)
+    for _f in sorted(_raw, key=lambda _f: _f['t']):
+        for _a in AXES:
+            _axes[_a] = float(_f.get(_a, _axes[_a]))
+        _frames.append((float(_f['t']),) + tuple(_axes[_a] for _a in AXES) + (frozenset(_f.get('buttons', ())),))
+    if not _frames:
+        raise ValueError(f"No input frames in {filename}")
+    return _frames
+
+
+def load_session_frames(filename: str) -> list:
+    """
+    Load the input frames from a binary session log file.
+
+    :param filename:
+        The session file name (*.mrsl)
+    :return:
+        A list of frames (t, lx, ly, rx, ry, buttons), sorted by time
+    """
+    # Imported here, drivesession uses the button names of this module
+    from drivesession import SessionReader #pylint: disable=import-outside-toplevel
+
+    _release = 1.0 / driveCfg.mainCfg.loop_hz #pylint: disable=no-member
+    _frames = []
+    with SessionReader(filename) as _session:
+        _inputs = _session.inputs()
+        for _t, _buttons, _v in zip((_inputs['t'] - _session.start_t).tolist(), _inputs['buttons'].tolist(), _inputs['v'].tolist()):
+            _axes = tuple(_v)
+            if _frames and _frames[-1][0] > _t:
+                # Release the buttons before this frame
+                _frames[-1] = (_t,) + _frames[-1][1:]
+            _names = frozenset(_b for _k, _b in enumerate(BUTTONS) if _buttons >> _k & 1)
+            _frames.append((_t,) + _axes + (_names,))
+            if _names:
+                _frames.append((_t + _release,) + _axes + (frozenset(),))
+    if not _frames:
+        raise ValueError(f"No input frames in {filename}")
+    return _frames
+
+
+class PlaybackController:
+    """
+    Controller input played back from a list of frames,
+    with the same interface as the approxeng.input controller used in driveRover_wugc:
+    ['l'], ['r'], ['lx'] etc., check_presses(), has_presses, presses, controls,
+    connected and the button held times (e.g. .home).
+
+    The input is played back in real time (monotonic clock), or as fast as possible,
+    in which case the playback time advances by one step at each check_presses() call.
+    """
+
+    def __init__(self, frames: list, interpolate: bool = False, realtime: bool = True, step: float = 0.02, loop: bool = False):
+        """
+        :param frames:
+            The input frames, see load_frames()
+        :param interpolate:
+            Interpolate linearly the axes values between the frames (True) or hold the frame values (False)
+        :param realtime:
+            Play back in real time (True), or advance by step at each check_presses() call (False)
+        :param step:
+            Playback time step (seconds) when not in real time
+        :param loop:
+            Restart the playback at the end of the frames
+        """
+        self.frames = frames
+        self.interpolate = interpolate
+        self.realtime = realtime
+        self.step = step
+        self.loop = loop
+        self.ff_device = None
+        self.finished = False
+
+        # Time since when each button is held, in each frame
+        self._held_since = []
+        _since = {}
+        for _f in frames:
+            _since = {_b: _since.get(_b, _f[0]) for _b in _f[5]}
+            self._held_since.append(_since)
+
+        self._t0 = None
+        self._t = 0.0
+        self._k = 0
+        self._held_prev = frozenset()
+        self._presses = InputPresses()
+
+        # Timestamps of the axes changes (monotonic clock), for the latency measurements
+        self.changes = []
+
+        # Wall-clock and CPU time of the playback until the last check_presses() call (seconds)
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self._cpu0 = None
+
+    def __enter__(self):
+        self._t0 = monotonic()
+        self._cpu0 = process_time()
+        self._t = 0.0
+        self._k = 0
+        self.finished = False
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    @property
+    def connected(self) -> bool:
+        """True until the end of the playback"""
+        return not self.finished
+
+    @property
+    def controls(self) -> dict:
+        """The names of the controls"""
+        return {'axes': list(AXES), 'buttons': list(BUTTONS)}
+
+    def _update(self) -> None:
+        """Update the playback time and the current frame"""
+        if self.realtime:
+            self._t = monotonic() - self._t0
+
+        _end = self.frames[-1][0]
+        if self._t > _end:
+            if self.loop and _end > 0:
+                self._t0 += _end
+                self._t -= _end
+                self._k = 0
+            else:
+                self.finished = True
+
+        _k = self._k
+        while _k + 1 < len(self.frames) and self.frames[_k + 1][0] <= self._t:
+            _k += 1
+            self.changes.append((self._t0 + self.frames[_k][0], self.frames[_k][1:5]))
+        self._k = _k
+
+    def _axis(self, name: str) -> float:
+        """The axis value at the current playback time"""
+        _i = 1 + AXES.index(name)
+        _f0 = self.frames[self._k]
+        if self.interpolate and self._k + 1 < len(self.frames):
+            _f1 = self.frames[self._k + 1]
+            _w = (self._t - _f0[0]) / (_f1[0] - _f0[0])
+            return _f0[_i] + _w * (_f1[_i] - _f0[_i])
+        return _f0[_i]
+
+    def __getitem__(self, item):
+        if self.realtime:
+            self._update()
+        if isinstance(item, tuple):
+            return tuple(self[_item] for _item in item)
+        if item in CIRCULAR_AXES:
+            return tuple(self._axis(_a) for _a in CIRCULAR_AXES[item])
+        if item in AXES:
+            return self._axis(item)
+        return self._held(item)
+
+    def __getattr__(self, item: str):
+        if item in AXES or item in BUTTONS:
+            return self[item]
+        raise AttributeError(item)
+
+    def _held(self, name: str):
+        """The button held time (seconds), or None if not held"""
+        _since = self._held_since[self._k].get(name)
+        if _since is None:
+            return None
+        return self._t - _since
+
+    def check_presses(self) -> InputPresses:
+        """The buttons pressed since the last call"""
+        if not self.realtime:
+            self._t += self.step
+        self._update()
+        self.wall_time = monotonic() - self._t0
+        self.cpu_time = process_time() - self._cpu0
+        _held = self.frames[self._k][5]
+        self._presses = InputPresses(sorted(_held - self._held_prev))
+        self._held_prev = _held
+        return self._presses
+
+    @property
+    def has_presses(self) -> bool:
+        """True if there were button presses since the last check"""
+        return self._presses.has_presses
+
+    @property
+    def presses(self) -> InputPresses:
+        """The buttons pressed between the two last check_presses() calls"""
+        return self._presses
+
+    def rumble(self, milliseconds: int = 500) -> None:
+        """No force-feedback"""
+
+
+class RecordingController:
+    """
+    Game controller wrapper which records the axes values and the held buttons
+    to a session file (JSON lines) at each check_presses() call, when changed.
+    The session file can be played back with PlaybackController.
+    The recorded time continues from the last recorded frame, when the controller is reconnected
+    or the session file is appended to, such that the sessions do not interleave on playback.
+    """
+
+    def __init__(self, controller_resource, filename: str):
+        """
+        :param controller_resource:
+            The approxeng.input ControllerResource
+        :param filename:
+            The session file name (*.jsonl), appended to
+        """
+        self._resource = controller_resource
+        self._filename = filename
+        self._controller = None
+        self._stream = None
+        self._t0 = None
+        self._t_end = None
+        self._last = None
+
+    def __enter__(self):
+        self._controller = self._resource.__enter__()
+        if self._t_end is None:
+            self._t_end = self._last_time()
+        self._stream = open(self._filename, 'a', encoding='utf-8')
+        self._t0 = monotonic() - self._t_end
+        self._last = None
+        return self
+
+    def _last_time(self) -> float:
+        """The time of the last frame in the session file, 0.0 for a new file"""
+        try:
+            with open(self._filename, 'r', encoding='utf-8') as stream:
+                return max((float(json.loads(_line)['t']) for _line in stream if _line.strip()), default=0.0)
+        except FileNotFoundError:
+            return 0.0
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stream.close()
+        return self._resource.__exit__(exc_type, exc_value, traceback)
+
+    def __getitem__(self, item):
+        return self._controller[item]
+
+    def __getattr__(self, item: str):
+        return getattr(self._controller, item)
+
+    def check_presses(self):
+        """The buttons pressed since the last call; records the current input"""
+        _presses = self._controller.check_presses()
+        _axes = tuple(round(_v, 4) for _v in self._controller[AXES])
+        _buttons = [_b for _b in BUTTONS if _b in self._controller.buttons and self._controller[_b] is not None]
+        if (_axes, _buttons) != self._last:
+            self._t_end = round(monotonic() - self._t0, 4)
+            _frame = dict(zip(AXES, _axes), t=self._t_end, buttons=_buttons)
+            self._stream.write(json.dumps(_frame) + '\n')
+            self._last = (_axes, _buttons)
+        return _presses
+
+
+class EventController:
+    """
+    Game controller read event-driven, without the approxeng.input event thread:
+    the evdev devices of the controller are registered with epoll, and the events are read and applied
+    to the approxeng.input controller in wait(), which blocks until events arrive or the timeout expires.
+    The controller interface is the approxeng.input one, plus wait() and stats().
+
+    The event timestamps are set by the kernel on the monotonic clock (EVIOCSCLOCKID),
+    such that the input latency can be measured from the kernel event.
+    """
+
+    def __init__(self, dead_zone: float = 0.05, hot_zone: float = 0.05):
+        """
+        Find the first game controller.
+
+        :param dead_zone:
+            The axes dead zone
+        :param hot_zone:
+            The axes hot zone
+        :raises IOError:
+            If no game controller is found (approxeng.input ControllerNotFoundError)
+        """
+        _discovery = find_matching_controllers(dead_zone=dead_zone, hot_zone=hot_zone)[0]
+        self.controller = _discovery.controller
+        self.name = _discovery.name
+        self.devices = {_dev.fd: _dev for _dev in _discovery.devices}
+
+        # The axes/buttons name prefix of each device, for controllers with several devices
+        self._prefix = {}
+        for _fd, _dev in self.devices.items():
+            if self.controller.node_mappings is not None and len(self.devices) > 1:
+                self._prefix[_fd] = self.controller.node_mappings.get(_dev.name)
+
+        # Offset from the event timestamps clock to the monotonic clock, per device
+        self._clock_offset = {}
+        self._epoll = None
+
+        # Monotonic timestamp of the first event read in the last wait() call, or None
+        self.event_time = None
+        self.events = 0
+        self.wakeups = 0
+        self.timeouts = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+
+    def __enter__(self):
+        approxeng_sys.scan_cache(force_update=True)
+        self._epoll = select.epoll()
+        for _fd, _dev in self.devices.items():
+            _dev.grab()
+            try:
+                fcntl.ioctl(_fd, EVIOCSCLOCKID, struct.pack('i', time.CLOCK_MONOTONIC))
+                self._clock_offset[_fd] = 0.0
+            except OSError:
+                # Realtime clock event timestamps
+                self._clock_offset[_fd] = monotonic() - time.time()
+            self._epoll.register(_fd, select.EPOLLIN)
+        self.controller.device_unique_name = self.name
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.controller.device_unique_name = None
+        self._epoll.close()
+        for _dev in self.devices.values():
+            try:
+                _dev.ungrab()
+            except OSError:
+                pass
+        return False
+
+    def __getitem__(self, item):
+        return self.controller[item]
+
+    def __getattr__(self, item: str):
+        return getattr(self.controller, item)
+
+    def wait(self, timeout: float) -> int:
+        """
+        Wait for the controller events and apply them to the controller state.
+
+        :param timeout:
+            Max waiting time (seconds), 0 to only read the pending events
+        :return:
+            The number of events read, 0 for timeout
+        """
+        _ready = self._epoll.poll(timeout)
+        if not _ready:
+            self.timeouts += 1
+            return 0
+
+        self.wakeups += 1
+        self.event_time = None
+        _count = 0
+        for _fd, _mask in _ready:
+            try:
+                if _mask & (select.EPOLLHUP | select.EPOLLERR):
+                    raise OSError(errno.ENODEV, 'Controller device removed')
+                _count += self._read(_fd)
+            except OSError as _err:
+                # Disconnected
+                self._epoll.unregister(_fd)
+                self.controller.device_unique_name = None
+                self.controller.exception = _err
+
+        if self.event_time is not None:
+            _latency = monotonic() - self.event_time
+            self._latency_sum += _latency
+            self._latency_max = max(self._latency_max, _latency)
+        self.events += _count
+        return _count
+
+    def _read(self, fd: int) -> int:
+        """Read the pending events of one device"""
+        _count = 0
+        _prefix = self._prefix.get(fd)
+        for _event in self.devices[fd].read():
+            if self.event_time is None:
+                self.event_time = _event.timestamp() + self._clock_offset[fd]
+            if _event.type in (EV_ABS, EV_REL):
+                self.controller.axes.axis_updated(_event, prefix=_prefix)
+            elif _event.type == EV_KEY:
+                if _event.value == 1:
+                    self.controller.buttons.button_pressed(_event.code, prefix=_prefix)
+                elif _event.value == 0:
+                    self.controller.buttons.button_released(_event.code, prefix=_prefix)
+            _count += 1
+        return _count
+
+    def stats(self) -> dict:
+        """
+        :return:
+            Dictionary with the number of events, wake-ups with events and timeouts,
+            and the mean and max latency from the kernel event to the wake-up (ms)
+        """
+        return {
+            'events': self.events,
+            'wakeups': self.wakeups,
+            'timeouts': self.timeouts,
+            'latency_mean_ms': 1000.0 * self._latency_sum / self.wakeups if self.wakeups else 0.0,
+            'latency_max_ms': 1000.0 * self._latency_max,
+        }
+
+
+def held_action(controller) -> str:
+    """
+    The action requested with the held buttons:
+    Square+Circle held for driveCfg.SHUTDOWN_HELD seconds for shutdown,
+    Triangle+Cross held for driveCfg.REBOOT_HELD seconds for reboot,
+    Home (the PiHut controller Analog button) held for driveCfg.HOME_HELD seconds to stop the program.
+
+    :param controller:
+        The controller
+    :return:
+        'shutdown', 'reboot', 'exit' or None
+    """
+    def _held(name: str, held_time: float) -> bool:
+        _t = getattr(controller, name)
+        return _t is not None and _t >= held_time
+
+    if _held('square', driveCfg.SHUTDOWN_HELD) and _held('circle', driveCfg.SHUTDOWN_HELD):
+        return 'shutdown'
+    if _held('triangle', driveCfg.REBOOT_HELD) and _held('cross', driveCfg.REBOOT_HELD):
+        return 'reboot'
+    if _held('home', driveCfg.HOME_HELD):
+        return 'exit'
+    return None
+
+
+def controller_resource(dead_zone: float = 0.05, hot_zone: float = 0.05):
+    """
+    The controller input source set in driveconfig.yaml mainCfg
+    ('wugc': game controller, 'evdev': game controller read event-driven,
+    'script': YAML keyframes, 'replay': recorded session).
+
+    :param dead_zone:
+        The game controller axes dead zone
+    :param hot_zone:
+        The game controller axes hot zone
+    :return:
+        A context manager which returns the controller
+    :raises InputFileError:
+        If the scripted or recorded input file cannot be loaded
+    """
+    #pylint: disable=no-member
+    _input = driveCfg.mainCfg.input
+    if _input in ('script', 'replay'):
+        driveLogger.info("Controller input from %s (%s).", driveCfg.mainCfg.input_file, _input)
+        try:
+            _frames = load_frames(driveCfg.mainCfg.input_file)
+        except (OSError, ValueError, KeyError, yaml.YAMLError) as _e:
+            raise InputFileError(f"Cannot load the controller input file {driveCfg.mainCfg.input_file}: {_e}") from _e
+        return PlaybackController(
+            _frames,
+            interpolate=(_input == 'script'),
+            realtime=driveCfg.mainCfg.input_realtime,
+            step=1.0 / driveCfg.mainCfg.loop_hz)
+
+    if not APPROXENG_MOD:
+        driveLogger.error("The approxeng.input library must be installed! Bye!")
+        sys.exit()
+
+    if _input == 'evdev':
+        _resource = EventController(dead_zone=dead_zone, hot_zone=hot_zone)
+    else:
+        _resource = ControllerResource(dead_zone=dead_zone, hot_zone=hot_zone)
+
+    if driveCfg.mainCfg.input_record:
+        return RecordingController(_resource, driveCfg.mainCfg.input_record)
+    return _resource
+    #pylint: enable=no-member
@@ -17,15 +17,41 @@
 
 """Implements the custom logging for the driveRover_wugc"""
 
+import io
+import os
+import gzip
+import fcntl
+import queue
+import shutil
+import atexit
+import threading
+from time import monotonic, sleep
 import logging
 import logging.config
+import logging.handlers
 
 ### Logging parameters
 ROOT_LOGLEVEL = 'INFO'
 FILE_LOGLEVEL = 'INFO'
 CONS_LOGLEVEL = 'WARNING' #'CRITICAL'
 LOGFILEBYTES = 3*102400
-LOG_FILENAME = 'driverover.log'
+# The log file, e.g. set in the service unit file for the other services than driverover
+LOG_FILENAME = os.environ.get('DRIVELOG_FILE', 'driverover.log')
+# Queue-based logging: the records are handed off to a listener thread, which writes them to the handlers
+LOG_QUEUE = True
+LOG_QUEUE_SIZE = 1024
+# Full queue policy: 'drop_new' (discard the new record) or 'drop_old' (discard the oldest queued record)
+LOG_QUEUE_POLICY = 'drop_new'
+# Staged log storage: the records are staged in tmpfs (or in RAM when LOG_STAGE_DIR is not available),
+# and written to the SD card in batches, every LOG_FLUSH_INTERVAL seconds or LOG_FLUSH_BYTES staged bytes.
+# The rotated log files are compressed (gzip) with LOG_COMPRESS.
+LOG_STAGING = True
+LOG_STAGE_DIR = '/dev/shm'
+LOG_FLUSH_INTERVAL = 30.0
+LOG_FLUSH_BYTES = 64*1024
+LOG_COMPRESS = True
+# Max wait for the queued records in flush_logger() (seconds)
+LOG_FLUSH_TIMEOUT = 2.0
 
 ### Define the logging filter
 class NoStringFilter(logging.Filter):
@@ -43,6 +69,234 @@ class NoStringFilter(logging.Filter):
 
         return allow
 
+### Define the queue-based logging
+class DropQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler with a bounded queue, which never blocks the caller:
+    when the queue is full, a record is dropped according to the policy and counted.
+    The records are queued as they are, the message is formatted in the listener thread.
+    """
+
+    def __init__(self, size: int = LOG_QUEUE_SIZE, policy: str = LOG_QUEUE_POLICY):
+        """
+        :param size:
+            The queue size (records)
+        :param policy:
+            The full queue policy, 'drop_new' or 'drop_old'
+        """
+        logging.handlers.QueueHandler.__init__(self, queue.Queue(size))
+        self.policy = policy
+        self.queued = 0
+        self.dropped = 0
+        self.depth_max = 0
+
+    def prepare(self, record):
+        """Queue the record unchanged (in-process queue, no pickling)"""
+        return record
+
+    def enqueue(self, record) -> None:
+        """Queue the record without blocking, drop a record when the queue is full"""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.policy != 'drop_old':
+                return
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.queue.put_nowait(record)
+            except (queue.Empty, queue.Full):
+                return
+        self.queued += 1
+        _depth = self.queue.qsize()
+        if _depth > self.depth_max:
+            self.depth_max = _depth
+
+    def stats(self) -> dict:
+        """
+        :return:
+            Dictionary with the number of queued and dropped records, and the max queue depth
+        """
+        return {
+            'queued': self.queued,
+            'dropped': self.dropped,
+            'depth_max': self.depth_max,
+        }
+
+
+class DrainQueueListener(logging.handlers.QueueListener):
+    """Queue listener which waits for room in the full queue to stop, such that the queued records are written"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+### Define the staged log storage
+class StagedRotatingFileHandler(logging.Handler):
+    """
+    Log file handler which stages the records in tmpfs (or in RAM),
+    and appends them to the log file in one write (and fsync) per batch:
+    when flushBytes are staged, every flushInterval seconds (LogFlush thread), and at flush()/close().
+    The log file is rotated after a batch when it exceeds maxBytes, and the rotated files are compressed.
+    The records staged in tmpfs by a crashed run are written to its log file at the next start.
+    The staging file is locked (flock) by the process which owns the log file: another process logging
+    to the same file (e.g. drivereplay.py) stages its records in RAM, and does not rotate the log file.
+    """
+
+    def __init__(self, filename: str, mode: str = 'a', maxBytes: int = 0, backupCount: int = 0,
+                 stageDir: str = LOG_STAGE_DIR, flushInterval: float = LOG_FLUSH_INTERVAL, flushBytes: int = LOG_FLUSH_BYTES,
+                 compress: bool = LOG_COMPRESS, encoding: str = 'utf-8'):
+        """
+        :param filename:
+            The log file name
+        :param mode:
+            'w' to start a new log file (the previous one is rotated), 'a' to append
+        :param maxBytes:
+            The log file size which triggers the rotation, 0 for no rotation
+        :param backupCount:
+            The number of rotated log files kept
+        :param stageDir:
+            The staging folder (tmpfs), None or not available for staging in RAM
+        :param flushInterval:
+            The max time between two batch writes (seconds)
+        :param flushBytes:
+            The staged size which triggers a batch write (bytes)
+        :param compress:
+            Compress the rotated log files (gzip)
+        :param encoding:
+            The log file encoding
+        """
+        logging.Handler.__init__(self)
+        self.baseFilename = os.path.abspath(filename)
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.flushBytes = flushBytes
+        self.compress = compress
+        self.encoding = encoding
+        self.batches = 0
+        self.written = 0
+        self.rotations = 0
+        # The log file is owned (rotated) by this process
+        self.owner = True
+
+        self.stageFilename = None
+        self._stage = None
+        if stageDir and os.path.isdir(stageDir):
+            _filename = os.path.join(stageDir, os.path.basename(self.baseFilename) + '.stage')
+            _stage = open(_filename, 'a+b', buffering=0)
+            try:
+                fcntl.flock(_stage.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.stageFilename = _filename
+                self._stage = _stage
+            except OSError:
+                # Staged by another process
+                _stage.close()
+                self.owner = False
+        if self._stage is None:
+            self._stage = io.BytesIO()
+        self._staged = self._stage.seek(0, io.SEEK_END)
+
+        # Keep the records staged by a crashed run, and the previous log file
+        if self._staged:
+            self._write_batch()
+        if self.owner and mode == 'w' and os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            self._rotate()
+
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._run, args=(flushInterval,), name='LogFlush', daemon=True)
+        self._flusher.start()
+
+    def emit(self, record) -> None:
+        """Stage the record"""
+        try:
+            _data = (self.format(record) + '\n').encode(self.encoding)
+            self._stage.write(_data)
+            self._staged += len(_data)
+            if self._staged >= self.flushBytes:
+                self._write_batch()
+        except Exception: #pylint: disable=broad-except
+            self.handleError(record)
+
+    def flush(self) -> None:
+        """Write the staged records to the log file"""
+        self.acquire()
+        try:
+            if self._staged:
+                self._write_batch()
+        finally:
+            self.release()
+
+    def close(self) -> None:
+        """Write the staged records, stop the LogFlush thread and remove the staging file"""
+        self._stop.set()
+        self.acquire()
+        try:
+            if self._stage is not None:
+                if self._staged:
+                    self._write_batch()
+                # Removed while locked
+                if self.stageFilename is not None:
+                    os.remove(self.stageFilename)
+                self._stage.close()
+                self._stage = None
+        finally:
+            self.release()
+        logging.Handler.close(self)
+
+    def _run(self, interval: float) -> None:
+        """LogFlush thread: write the staged records every interval seconds"""
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def _write_batch(self) -> None:
+        """Append the staged records to the log file (the handler lock is held), rotate when needed"""
+        self._stage.seek(0)
+        _data = self._stage.read()
+        with open(self.baseFilename, 'ab') as _file:
+            _file.write(_data)
+            _file.flush()
+            os.fsync(_file.fileno())
+        self._stage.seek(0)
+        self._stage.truncate()
+        self._staged = 0
+        self.batches += 1
+        self.written += len(_data)
+
+        if self.owner and self.maxBytes > 0 and os.path.getsize(self.baseFilename) >= self.maxBytes:
+            self._rotate()
+
+    def _rotate(self) -> None:
+        """Shift the rotated log files, and move (compress) the log file to the first one"""
+        _ext = '.gz' if self.compress else ''
+        if self.backupCount > 0:
+            for _k in range(self.backupCount - 1, 0, -1):
+                _src = f"{self.baseFilename}.{_k}{_ext}"
+                if os.path.exists(_src):
+                    os.replace(_src, f"{self.baseFilename}.{_k + 1}{_ext}")
+            if self.compress:
+                with open(self.baseFilename, 'rb') as _src, gzip.open(f"{self.baseFilename}.1.gz", 'wb') as _dst:
+                    shutil.copyfileobj(_src, _dst)
+                os.remove(self.baseFilename)
+            else:
+                os.replace(self.baseFilename, f"{self.baseFilename}.1")
+        else:
+            os.remove(self.baseFilename)
+        self.rotations += 1
+
+    def stats(self) -> dict:
+        """
+        :return:
+            Dictionary with the log file ownership, the number of batch writes, the written bytes and the number of rotations
+        """
+        return {
+            'owner': self.owner,
+            'batches': self.batches,
+            'written': self.written,
+            'rotations': self.rotations,
+        }
+
+
 ### Define the logging configuration
 DRIVELOG = {
     'version': 1,
@@ -69,6 +323,15 @@ DRIVELOG = {
             'formatter': 'full',
             'filename': LOG_FILENAME, 
             'filters': ['NotMainJob'],
+        } if not LOG_STAGING else {
+            'level': FILE_LOGLEVEL,
+            '()': StagedRotatingFileHandler,
+            'mode': 'w',
+            'maxBytes': LOGFILEBYTES,
+            'backupCount': 3,
+            'formatter': 'full',
+            'filename': LOG_FILENAME,
+            'filters': ['NotMainJob'],
         },
         'console': {
             'level': CONS_LOGLEVEL,
@@ -105,13 +368,54 @@ DRIVELOG = {
 ### Build the logger instance
 def drive_logger():
     """Build and return the logger.
+    With LOG_QUEUE, the configured handlers are moved behind a DropQueueHandler and its listener thread.
     :return: logger -- Logger instance
     """
+    global driveLogQueue, driveLogListener #pylint: disable=global-statement
+
     # Use the PRILOGGING logger configuration
     logging.config.dictConfig(DRIVELOG)
     _logger = logging.getLogger()
 
+    if LOG_QUEUE:
+        _handlers = list(_logger.handlers)
+        driveLogQueue = DropQueueHandler(LOG_QUEUE_SIZE, LOG_QUEUE_POLICY)
+        for _log in [_logger] + [logging.getLogger(_name) for _name in DRIVELOG['loggers']]:
+            for _handler in _handlers:
+                _log.removeHandler(_handler)
+            _log.addHandler(driveLogQueue)
+        driveLogListener = DrainQueueListener(driveLogQueue.queue, *_handlers, respect_handler_level=True)
+        driveLogListener.start()
+        # Write the queued records at exit, before the logging module closes the handlers
+        atexit.register(stop_logger)
+
     return _logger
 
 
+def stop_logger() -> None:
+    """Stop the log listener thread, after the queued records are written"""
+    global driveLogListener #pylint: disable=global-statement
+    if driveLogListener is not None:
+        driveLogListener.stop()
+        driveLogListener = None
+
+
+def flush_logger() -> None:
+    """
+    Write the queued and the staged log records to the log file,
+    e.g. before a shutdown. Waits at most LOG_FLUSH_TIMEOUT for the queued records.
+    """
+    if driveLogListener is not None:
+        _t_end = monotonic() + LOG_FLUSH_TIMEOUT
+        while driveLogQueue.queue.unfinished_tasks and monotonic() < _t_end:
+            sleep(0.01)
+        _handlers = driveLogListener.handlers
+    else:
+        _handlers = logging.getLogger().handlers
+    for _handler in _handlers:
+        _handler.flush()
+
+
+driveLogQueue = None
+driveLogListener = None
 driveLogger = drive_logger()
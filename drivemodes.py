@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Implements the driving modes for the driveRover_wugc.
+
+Each driving mode maps the controller axes to the driving commands.
+The modes are registered by name in DRIVE_MODES, and the mode object is created once,
+at startup or on a mode switch, with its constants computed in the constructor.
+A new mode is added by subclassing DriveMode and decorating the class with @register_mode.
+"""
+
+# pylint: disable=line-too-long
+
+import sys
+from math import atan, atan2, degrees
+
+# Local
+from drivelogger import driveLogger
+from driveconfig import driveCfg
+from drivefunc import mixer_dir, mixer_speed, move_rover, move_rover_ackerman, spin_rover, crab_rover
+
+# The registered driving modes, by name
+DRIVE_MODES = {}
+
+
+def register_mode(cls):
+    """Class decorator registering a driving mode under its name, and numbering it (see DriveMode.mode_id)"""
+    cls.mode_id = len(DRIVE_MODES)
+    DRIVE_MODES[cls.name] = cls
+    return cls
+
+
+class DriveMode:
+    """
+    Driving mode base class.
+    The controller axes are mixed into a (direction, speed) pair in mix(),
+    and step() returns the driving command only when the pair changed.
+    """
+    # The mode name, used in driveconfig.yaml
+    name = None
+    # The mode number, in the registration order (recorded by the flight recorder)
+    mode_id = -1
+
+    def __init__(self, max_speed: int = 100):
+        """
+        :param max_speed:
+            Maximum speed (percentage of max speed)
+        """
+        self.max_speed = max_speed
+        # The last (direction, speed) pair
+        self.last = None
+
+    def reset(self) -> None:
+        """Forget the last command, such that the next step() returns a command"""
+        self.last = None
+
+    @staticmethod
+    def move(dir_deg: float, speed_per: float) -> None:
+        """The driving function"""
+        raise NotImplementedError
+
+    def mix(self, axes: tuple) -> tuple:
+        """
+        Mix the controller axes.
+
+        :param axes:
+            The controller axes values (lx, ly, rx, ry), each ranges from -1.0 to 1.0
+        :return:
+            The (direction, speed) pair
+        """
+        raise NotImplementedError
+
+    def step(self, axes: tuple) -> tuple:
+        """
+        The driving command for the controller axes.
+
+        :param axes:
+            The controller axes values (lx, ly, rx, ry), each ranges from -1.0 to 1.0
+        :return:
+            The driving command (driving function, direction, speed) when changed, None otherwise
+        """
+        _cmd = self.mix(axes)
+        if _cmd == self.last:
+            return None
+        self.last = _cmd
+        return (self.move,) + _cmd
+
+
+@register_mode
+class SimpleMode(DriveMode):
+    """Simple steering: all wheels at the same angle (mirrored at the rear), all motors at the same speed"""
+    name = 'simple'
+    move = staticmethod(move_rover)
+
+    def __init__(self, max_speed: int = 100):
+        super().__init__(max_speed)
+        self.max_dir = 30.0
+
+    def mix(self, axes: tuple) -> tuple:
+        _, ly_axis, rx_axis, ry_axis = axes
+        _speed, _ = mixer_speed(yaw=0, throttle=ly_axis, max_speed=self.max_speed)
+        return mixer_dir(l_r=rx_axis, f_b=ry_axis, max_dir=self.max_dir), _speed
+
+
+@register_mode
+class AckermannMode(DriveMode):
+    """Ackermann steering: the wheel angles and the left/right speeds set by the Ackermann geometry"""
+    name = 'ackermann'
+    move = staticmethod(move_rover_ackerman)
+
+    def __init__(self, max_speed: int = 100):
+        super().__init__(max_speed)
+        self.max_dir = 45.0
+        # The steering angle limit of the chassis (see calc_ackerman_steering), the larger angles steer the same
+        self.dir_limit = degrees(atan2(1.0, 1.2*driveCfg.DoL))
+
+    def mix(self, axes: tuple) -> tuple:
+        _, ly_axis, rx_axis, ry_axis = axes
+        _speed, _ = mixer_speed(yaw=0, throttle=ly_axis, max_speed=self.max_speed)
+        _dir = mixer_dir(l_r=rx_axis, f_b=ry_axis, max_dir=self.max_dir)
+        return max(-self.dir_limit, min(self.dir_limit, _dir)), _speed
+
+
+@register_mode
+class SpinMode(DriveMode):
+    """Spin in place: the right stick left-right axis sets the spin speed and direction"""
+    name = 'spin'
+    move = staticmethod(spin_rover)
+
+    def __init__(self, max_speed: int = 100):
+        super().__init__(max_speed)
+        # The wheels tangent to the circle around the rover centre
+        self.spin_dir = degrees(atan(1.0/driveCfg.DoL))
+
+    def mix(self, axes: tuple) -> tuple:
+        _speed, _ = mixer_speed(yaw=0, throttle=axes[2], max_speed=self.max_speed)
+        return self.spin_dir, _speed
+
+
+@register_mode
+class CrabMode(DriveMode):
+    """Crab steering: all wheels at the same angle, the rover moves diagonally without turning"""
+    name = 'crab'
+    move = staticmethod(crab_rover)
+
+    def __init__(self, max_speed: int = 100):
+        super().__init__(max_speed)
+        self.max_dir = 60.0
+
+    def mix(self, axes: tuple) -> tuple:
+        _, ly_axis, rx_axis, ry_axis = axes
+        _speed, _ = mixer_speed(yaw=0, throttle=ly_axis, max_speed=self.max_speed)
+        return mixer_dir(l_r=rx_axis, f_b=ry_axis, max_dir=self.max_dir), _speed
+
+
+def make_mode(name: str, max_speed: int = 100) -> DriveMode:
+    """
+    Create a driving mode.
+
+    :param name:
+        The mode name, one of DRIVE_MODES
+    :param max_speed:
+        Maximum speed (percentage of max speed)
+    :return:
+        The driving mode object
+    :raises ValueError:
+        For an unknown mode name
+    """
+    try:
+        return DRIVE_MODES[name](max_speed)
+    except KeyError:
+        raise ValueError(f"Unknown driving mode '{name}', one of {tuple(DRIVE_MODES)}") from None
+
+
+def next_mode(name: str, cycle: list) -> str:
+    """
+    The next driving mode in the switching cycle.
+
+    :param name:
+        The current mode name
+    :param cycle:
+        The mode names, in the switching order
+    :return:
+        The next mode name, the first one when the current mode is not in the cycle
+    """
+    if name in cycle:
+        return cycle[(cycle.index(name) + 1) % len(cycle)]
+    return cycle[0]
+
+
+# Check the driving modes set in driveconfig.yaml
+#pylint: disable=no-member
+for _mode_name in [driveCfg.mainCfg.mode] + driveCfg.mainCfg.mode_cycle:
+    if _mode_name not in DRIVE_MODES:
+        driveLogger.error("Unknown driving mode '%s' in the YAML configuration file, one of %s!", _mode_name, tuple(DRIVE_MODES))
+        sys.exit()
+#pylint: enable=no-member
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Implements the bulk PCA9685 servo register writes for the driveRover_wugc.
+
+The 4tronix pca9685.py sets one servo with 4 single byte register writes (4 I2C transactions).
+Here the servo channels updated together are written with I2C block writes,
+using the PCA9685 register auto-increment, such that a batch of servo updates
+costs one I2C transaction (per 32 bytes of registers), and all the servos change together
+(the PCA9685 outputs are updated at the I2C STOP condition).
+
+The calibrated servos (trim, scale and limits, see servoCfg in driveconfig.yaml) are set through
+per-servo lookup tables of the register values, computed once: a servo update is an index
+computation, a table lookup and the register write.
+"""
+
+# pylint: disable=line-too-long
+
+## PCA9685 registers
+PCA9685_ADDRESS = 0x40
+MODE1 = 0x00
+MODE1_SLEEP = 0x10
+MODE1_AI = 0x20
+MODE1_RESTART = 0x80
+PRESCALE = 0xFE
+LED0_ON_L = 0x06
+NUM_CHANNELS = 16
+
+## Servo pulse
+# 50 Hz PWM, 1.5 ms pulse at centre (0 deg) and +/- 1 ms at +/- 90 deg
+# The nominal pulse widths, not the rover.py angle conversion: to be checked on the rover before enabling servo_bulk
+SERVO_HZ = 50
+SERVO_CENTRE_US = 1500.0
+SERVO_US_PER_DEG = 1000.0 / 90.0
+
+# Max number of bytes in an I2C (SMBus) block write
+I2C_BLOCK_MAX = 32
+
+# The servo calibration parameters and their defaults
+SERVO_CAL = {'trim': 0.0, 'scale': 1.0, 'min': -90.0, 'max': 90.0}
+
+
+def servo_counts(degrees: float) -> int:
+    """
+    Convert a servo angle to the PCA9685 OFF count (12-bit, ON count 0).
+
+    :param degrees:
+        Servo angle, ranges from -90 to 90 (degrees)
+    :return:
+        PWM OFF count, ranges from 0 to 4095
+    """
+    degrees = max(-90.0, min(90.0, degrees))
+    return int((SERVO_CENTRE_US + degrees * SERVO_US_PER_DEG) * 4096 * SERVO_HZ / 1000000)
+
+
+class ServoTable:
+    """
+    Angle to PCA9685 register values lookup table of one servo, with its calibration.
+    The commanded angle is scaled, trimmed and limited: angle = min(max, max(min, scale * degrees + trim)).
+    The table has one entry per step over [-90, 90] degrees, with the calibrated angle (for rover.setServo())
+    and the 4 channel registers (ON count 0, OFF count). The servo offset stored in the rover EEPROM
+    is added to the register values only, as rover.setServo() adds it to the angle.
+    """
+    __slots__ = ('trim', 'scale', 'min_deg', 'max_deg', 'step', 'offset', 'angles', 'counts', 'regs', '_inv', '_last')
+
+    def __init__(self, trim: float = 0.0, scale: float = 1.0, min_deg: float = -90.0, max_deg: float = 90.0, step: float = 0.5, offset: float = 0.0):
+        """
+        :param trim:
+            The centre correction (degrees)
+        :param scale:
+            The travel correction (calibrated degrees per commanded degree)
+        :param min_deg:
+            The min calibrated angle (degrees)
+        :param max_deg:
+            The max calibrated angle (degrees)
+        :param step:
+            The table step (degrees)
+        :param offset:
+            The servo offset of the rover library (degrees), from the rover EEPROM
+        """
+        self.trim = trim
+        self.scale = scale
+        self.min_deg = min_deg
+        self.max_deg = max_deg
+        self.step = step
+        self.offset = offset
+        self._inv = 1.0 / step
+        self._last = int(round(180.0 / step))
+
+        self.angles = [min(max_deg, max(min_deg, scale * (-90.0 + _k * step) + trim)) for _k in range(self._last + 1)]
+        self.counts = [servo_counts(_deg + offset) for _deg in self.angles]
+        self.regs = [bytes((0, 0, _c & 0xFF, _c >> 8)) for _c in self.counts]
+
+    def index(self, degrees: float) -> int:
+        """
+        :param degrees:
+            The commanded servo angle (degrees)
+        :return:
+            The table index of the nearest step
+        """
+        _k = int((degrees + 90.0) * self._inv + 0.5)
+        if _k < 0:
+            return 0
+        return _k if _k < self._last else self._last
+
+    def __repr__(self):
+        return f"<trim: {self.trim}, scale: {self.scale}, min: {self.min_deg}, max: {self.max_deg}, offset: {self.offset}, centre: {self.counts[self.index(0.0)]}>"
+
+
+def servo_tables(servos: dict, step: float = 0.5, offsets=None) -> dict:
+    """
+    Build the servo lookup tables.
+
+    :param servos:
+        Dictionary with the servo channel and its calibration parameters (see SERVO_CAL)
+    :param step:
+        The table step (degrees)
+    :param offsets:
+        The servo offsets of the rover library, by channel (rover.offsets), None for no offsets
+    :return:
+        Dictionary with the servo channel and its table
+    """
+    _tables = {}
+    for _ch, _cal in servos.items():
+        _p = dict(SERVO_CAL, **_cal)
+        _offset = float(offsets[_ch]) if offsets is not None and _ch < len(offsets) else 0.0
+        _tables[_ch] = ServoTable(float(_p['trim']), float(_p['scale']), float(_p['min']), float(_p['max']), step, _offset)
+    return _tables
+
+
+def plan_writes(channels, max_bytes: int = I2C_BLOCK_MAX) -> list:
+    """
+    Coalesce the channels into the fewest auto-increment block writes.
+    The channels are merged into one block write as long as the block (including
+    the unchanged channels in between, 4 registers each) fits in max_bytes.
+
+    :param channels:
+        The updated channel numbers
+    :param max_bytes:
+        Max number of bytes in a block write
+    :return:
+        A list of (first channel, last channel) ranges, one per block write
+    """
+    _runs = []
+    for _ch in sorted(set(channels)):
+        if _runs and 4 * (_ch - _runs[-1][0] + 1) <= max_bytes:
+            _runs[-1][1] = _ch
+        else:
+            _runs.append([_ch, _ch])
+    return [tuple(_run) for _run in _runs]
+
+
+class PCA9685Bulk:
+    """
+    Bulk servo updates on the PCA9685.
+    A shadow copy of the channel registers is kept, and used to fill the unchanged channels
+    between the updated channels of a block write.
+    """
+
+    def __init__(self, bus, address: int = PCA9685_ADDRESS):
+        """
+        Enable the register auto-increment and read the channel registers.
+        Must be used after the PCA9685 was initialised (rover.init()).
+
+        :param bus:
+            The I2C bus (smbus.SMBus(1), or roversim.bus)
+        :param address:
+            The PCA9685 I2C address
+        """
+        self.bus = bus
+        self.address = address
+        self.transactions = 0
+        self.batches = 0
+        # The servo lookup tables, by channel (see servo_tables())
+        self.tables = {}
+
+        _mode1 = bus.read_byte_data(address, MODE1)
+        if not _mode1 & MODE1_AI:
+            bus.write_byte_data(address, MODE1, (_mode1 | MODE1_AI) & ~MODE1_RESTART)
+
+        self._shadow = bytearray(4 * NUM_CHANNELS)
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Read the channel registers into the shadow copy, e.g. after servos were set directly (rover.setServo())"""
+        for _k in range(0, 4 * NUM_CHANNELS, I2C_BLOCK_MAX):
+            self._shadow[_k:_k + I2C_BLOCK_MAX] = bytes(self.bus.read_i2c_block_data(self.address, LED0_ON_L + _k, I2C_BLOCK_MAX))
+
+    def update_shadow(self, servos: dict) -> None:
+        """
+        Set the servo angles in the shadow copy, e.g. for the servos set directly (rover.setServo()).
+        The servos with a lookup table are set to their calibrated angle.
+
+        :param servos:
+            Dictionary with the servo channel and the angle (degrees)
+        """
+        _tables = self.tables
+        for _ch, _deg in servos.items():
+            _table = _tables.get(_ch)
+            if _table is not None:
+                self._shadow[4*_ch:4*_ch + 4] = _table.regs[_table.index(_deg)]
+            else:
+                _counts = servo_counts(_deg)
+                self._shadow[4*_ch:4*_ch + 4] = bytes((0, 0, _counts & 0xFF, _counts >> 8))
+
+    def set_servos(self, servos: dict) -> int:
+        """
+        Set the servo angles, in the fewest block writes.
+        The servos with a lookup table are set to their calibrated angle.
+
+        :param servos:
+            Dictionary with the servo channel and the angle (degrees)
+        :return:
+            The number of I2C transactions used
+        """
+        self.update_shadow(servos)
+        _runs = plan_writes(servos)
+        for _first, _last in _runs:
+            self.bus.write_i2c_block_data(self.address, LED0_ON_L + 4*_first, list(self._shadow[4*_first:4*_last + 4]))
+
+        self.transactions += len(_runs)
+        self.batches += 1
+        return len(_runs)
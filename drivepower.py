@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Implements the power button and battery-low monitoring for the driveRover_wugc,
+replacing the cleansd.sh and battsd.sh polling daemons.
+
+The sysfs GPIO value files of the power button and of the battery-low signal are opened with edge detection
+and waited on with poll(): the monitor wakes up only on the GPIO edges and at the trigger deadlines.
+The poweroff is triggered when the button is held for button_hold seconds, or when the battery was low
+for battery_trigger seconds in the last battery_window seconds (see pwrCfg in driveconfig.yaml).
+The battery-low time is counted in a sliding window of time bins (BatteryWindow), updated in constant time.
+
+Before the poweroff, the speed governor caps the motor speeds progressively as the battery-low fraction
+of the window grows (PowerMonitor.speed_cap, applied in ActuatorCache.set_motors()),
+such that the current peaks are reduced before the battery brownout.
+
+In the rover process (auxCfg power: true) the monitor runs in the PowerMon thread, and the driving loop
+stops the rover and starts the shutdown when drivePower.action is set.
+As a daemon (python3 drivepower.py, see scripts/drivepower.service) the monitor runs in the main thread
+and powers off the system; the speed governor is not used.
+"""
+
+# pylint: disable=line-too-long
+
+import os
+import sys
+import glob
+import select
+import threading
+import subprocess
+from array import array
+from time import sleep, monotonic
+
+# Local
+from drivelogger import driveLogger
+from driveconfig import driveExit, driveCfg, PwrCfg, CFG_SECTIONS
+
+GPIO_PATH = '/sys/class/gpio'
+# Max wait for the exported GPIO files permissions to be set by udev (seconds)
+GPIO_EXPORT_WAIT = 1.0
+# Stop check period of the monitor (seconds)
+POWER_POLL = 1.0
+
+
+def gpio_base() -> int:
+    """
+    :return:
+        The sysfs GPIO number of BCM 0: the base of the BCM pin controller (gpiochip512 on the recent kernels), 0 if not found
+    """
+    for _chip in glob.glob(os.path.join(GPIO_PATH, 'gpiochip*')):
+        try:
+            with open(os.path.join(_chip, 'label'), encoding='ascii') as _file:
+                _label = _file.read().strip()
+            if _label.startswith('pinctrl-bcm') or _label.startswith('pinctrl-rp1'):
+                with open(os.path.join(_chip, 'base'), encoding='ascii') as _file:
+                    return int(_file.read())
+        except (OSError, ValueError):
+            continue
+    return 0
+
+
+class GpioInput:
+    """sysfs GPIO input with edge detection; the value file is polled for POLLPRI"""
+
+    def __init__(self, gpio: int, edge: str = 'both'):
+        """
+        :param gpio:
+            The sysfs GPIO number
+        :param edge:
+            The edges which wake up poll(): 'rising', 'falling' or 'both'
+        :raises OSError:
+            If the GPIO cannot be set up
+        """
+        self.gpio = gpio
+        _path = os.path.join(GPIO_PATH, f"gpio{gpio}")
+        if not os.path.exists(_path):
+            with open(os.path.join(GPIO_PATH, 'export'), 'w', encoding='ascii') as _file:
+                _file.write(str(gpio))
+
+        # The permissions of the exported GPIO files are set by udev
+        _t_end = monotonic() + GPIO_EXPORT_WAIT
+        while True:
+            try:
+                for _name, _value in (('direction', 'in'), ('edge', edge)):
+                    with open(os.path.join(_path, _name), 'w', encoding='ascii') as _file:
+                        _file.write(_value)
+                break
+            except PermissionError:
+                if monotonic() > _t_end:
+                    raise
+                sleep(0.05)
+
+        self.fd = os.open(os.path.join(_path, 'value'), os.O_RDONLY | os.O_NONBLOCK)
+
+    def read(self) -> int:
+        """Read the value; this also clears the pending edge"""
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        return int(os.read(self.fd, 8)[:1])
+
+    def close(self) -> None:
+        """Close the value file"""
+        os.close(self.fd)
+
+
+class BatteryWindow:
+    """
+    Battery-low time in a sliding window, counted in a ring of time bins with a running total.
+    Each update costs one step per time bin elapsed since the last update (at most the number of bins),
+    and reading the total is constant time.
+    The window covers the current time bin and the bins - 1 bins before it.
+    """
+    __slots__ = ('window', 'width', 'low', 'total', '_bins', '_k', '_t')
+
+    def __init__(self, window: float = 30.0, bins: int = 30):
+        """
+        :param window:
+            The window length (seconds)
+        :param bins:
+            The number of time bins in the window
+        """
+        self.window = window
+        self.width = window / max(1, bins)
+        self.low = False
+        self.total = 0.0
+        self._bins = array('d', [0.0]) * max(1, bins)
+        self._k = None
+        self._t = None
+
+    def update(self, now: float, low: bool = None) -> float:
+        """
+        Advance the window, and set the battery state.
+
+        :param now:
+            The current time (time.monotonic())
+        :param low:
+            The battery state from now, None to keep it
+        :return:
+            The battery-low time in the window (seconds)
+        """
+        if self._t is None:
+            self._k = int(now / self.width)
+            self._t = now
+        elif now > self._t:
+            self._advance(now)
+            self._t = now
+        if low is not None:
+            self.low = low
+        return self.total
+
+    def fraction(self) -> float:
+        """The battery-low fraction of the window, at the last update"""
+        return self.total / self.window
+
+    def _advance(self, now: float) -> None:
+        """Add the time since the last update to the bins, recycling the bins which left the window"""
+        _bins = self._bins
+        _n = len(_bins)
+        _w = self.width
+        _k0 = self._k
+        _k1 = int(now / _w)
+        if _k1 == _k0:
+            if self.low:
+                _bins[_k0 % _n] += now - self._t
+                self.total += now - self._t
+            return
+
+        # The rest of the last updated bin, then the full bins (at most one window), and the current bin
+        if self.low:
+            _dt = (_k0 + 1) * _w - self._t
+            _bins[_k0 % _n] += _dt
+            self.total += _dt
+        _fill = _w if self.low else 0.0
+        for _k in range(max(_k0 + 1, _k1 - _n + 1), _k1):
+            _i = _k % _n
+            self.total += _fill - _bins[_i]
+            _bins[_i] = _fill
+        _i = _k1 % _n
+        _fill = now - _k1 * _w if self.low else 0.0
+        self.total += _fill - _bins[_i]
+        _bins[_i] = _fill
+        self._k = _k1
+
+
+class PowerMonitor:
+    """
+    Power button and battery-low monitor.
+    action is set to 'shutdown' when the poweroff is triggered, and reason to 'button' or 'battery'.
+    battery_low is the battery-low fraction of the window, and speed_cap the speed governor cap
+    (percentage of the motor speeds), both updated at each wake-up (at least every POWER_POLL seconds).
+    """
+
+    def __init__(self):
+        self.action = None
+        self.reason = None
+        self.wakeups = 0
+        self.edges = 0
+        self.battery_low = 0.0
+        self.speed_cap = 100
+
+        self._cfg = None
+        self._button = None
+        self._battery = None
+        self._thread = None
+        self._stop = threading.Event()
+
+        # The power button pressed time, the battery-low time window
+        self._t_pressed = None
+        self._window = None
+
+    def open(self, cfg: PwrCfg) -> None:
+        """
+        Set up the GPIO inputs.
+
+        :param cfg:
+            The pwrCfg section
+        :raises OSError:
+            If a GPIO cannot be set up
+        """
+        self._cfg = cfg
+        _base = cfg.gpio_base if cfg.gpio_base >= 0 else gpio_base()
+        self._button = GpioInput(_base + cfg.button_pin)
+        self._battery = GpioInput(_base + cfg.battery_pin)
+        self._window = BatteryWindow(cfg.battery_window, cfg.battery_bins)
+
+        _now = monotonic()
+        self._on_button(_now)
+        self._on_battery(_now)
+        driveLogger.info("Monitoring the power button on BCM %d and the battery-low on BCM %d (GPIO base %d).", cfg.button_pin, cfg.battery_pin, _base)
+
+    def close(self) -> None:
+        """Close the GPIO inputs"""
+        for _gpio in (self._button, self._battery):
+            if _gpio is not None:
+                _gpio.close()
+        self._button = self._battery = None
+
+    def start(self, cfg: PwrCfg) -> bool:
+        """
+        Set up the GPIO inputs and start the PowerMon thread.
+
+        :param cfg:
+            The pwrCfg section
+        :return:
+            True if started
+        """
+        try:
+            self.open(cfg)
+        except OSError as _e:
+            driveLogger.error("The power monitor cannot be started: %s", _e)
+            self.close()
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='PowerMon', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self) -> None:
+        """Stop the PowerMon thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.close()
+
+    def run(self) -> str:
+        """
+        Wait for the GPIO edges and the trigger deadlines until the poweroff is triggered or stopped.
+
+        :return:
+            The action, None when stopped
+        """
+        _poll = select.poll()
+        _gpios = {self._button.fd: self._on_button, self._battery.fd: self._on_battery}
+        for _fd in _gpios:
+            _poll.register(_fd, select.POLLPRI | select.POLLERR)
+
+        while not self._stop.is_set() and self.action is None and not driveExit.kill_now:
+            _now = monotonic()
+            _timeout = POWER_POLL
+            for _deadline in (self._button_deadline(), self._battery_deadline(_now)):
+                if _deadline is not None:
+                    _timeout = min(_timeout, max(0.0, _deadline - _now))
+
+            _events = _poll.poll(1000.0 * _timeout)
+            self.wakeups += 1
+            _now = monotonic()
+            for _fd, _ in _events:
+                self.edges += 1
+                _gpios[_fd](_now)
+            self._check(_now)
+        return self.action
+
+    def _on_button(self, now: float) -> None:
+        """Power button edge"""
+        if self._button.read() == self._cfg.button_on:
+            if self._t_pressed is None:
+                self._t_pressed = now
+                driveLogger.info("Power button BCM %d pressed.", self._cfg.button_pin)
+        else:
+            self._t_pressed = None
+
+    def _on_battery(self, now: float) -> None:
+        """Battery-low edge"""
+        _low = self._battery.read() == self._cfg.battery_on
+        if _low and not self._window.low:
+            driveLogger.info("Battery low on BCM %d.", self._cfg.battery_pin)
+        self._window.update(now, _low)
+
+    def _button_deadline(self) -> float:
+        """The poweroff time of the held button, None when not pressed"""
+        return None if self._t_pressed is None else self._t_pressed + self._cfg.button_hold
+
+    def _battery_deadline(self, now: float) -> float:
+        """The earliest poweroff time of the low battery, None when not low"""
+        if not self._window.low:
+            return None
+        return now + self._cfg.battery_trigger - self._window.update(now)
+
+    def _govern(self, fraction: float) -> None:
+        """
+        Lower the speed cap linearly from 100%, at the governor_start battery-low fraction,
+        to governor_min% at the poweroff trigger. The cap is not raised again.
+        """
+        _cfg = self._cfg
+        if not _cfg.governor or fraction <= _cfg.governor_start:
+            return
+        _span = max(1e-3, _cfg.battery_trigger / _cfg.battery_window - _cfg.governor_start)
+        _cap = int(100 - (100 - _cfg.governor_min) * min(1.0, (fraction - _cfg.governor_start) / _span))
+        if _cap < self.speed_cap:
+            self.speed_cap = _cap
+            driveLogger.info("Battery low %.0f%% of the last %.0f seconds, speed capped to %d%%.", 100.0*fraction, _cfg.battery_window, _cap)
+
+    def _check(self, now: float) -> None:
+        """Update the speed governor, and trigger the poweroff"""
+        _low_time = self._window.update(now)
+        self.battery_low = _low_time / self._cfg.battery_window
+        self._govern(self.battery_low)
+
+        if self._t_pressed is not None and now - self._t_pressed >= self._cfg.button_hold:
+            self.reason = 'button'
+            _info = f"Power button BCM {self._cfg.button_pin} held for {now - self._t_pressed:.1f} seconds, power down!"
+        elif _low_time >= self._cfg.battery_trigger:
+            self.reason = 'battery'
+            _info = f"Battery low for {self._cfg.battery_trigger:.0f} seconds in the last {self._cfg.battery_window:.0f} seconds, power down!"
+        else:
+            return
+        driveLogger.warning(_info)
+        driveCfg.journal_send(_info)
+        self.action = 'shutdown'
+
+    def stats(self) -> dict:
+        """
+        :return:
+            Dictionary with the number of wake-ups and GPIO edges, the battery-low fraction and the speed cap (%)
+        """
+        return {
+            'wakeups': self.wakeups,
+            'edges': self.edges,
+            'battery_low': round(self.battery_low, 3),
+            'speed_cap': self.speed_cap,
+        }
+
+
+drivePower = PowerMonitor()
+
+
+def main() -> None:
+    """Run the power monitor as a daemon, power off the system when triggered"""
+    # The pwrCfg section, also when the in-process monitor is not enabled (auxCfg power)
+    _cfg = driveCfg.cfgSections[CFG_SECTIONS.index(PwrCfg)] if driveCfg.cfgSections else PwrCfg()
+    try:
+        drivePower.open(_cfg)
+    except OSError as _e:
+        driveLogger.error("The power monitor cannot be started: %s", _e)
+        sys.exit(1)
+    driveCfg.daemon_notify("READY=1")
+
+    _action = drivePower.run()
+    drivePower.close()
+    if _action != 'shutdown':
+        driveLogger.info("Power monitor stopped.")
+        return
+
+    driveCfg.daemon_notify("STOPPING=1")
+    subprocess.run(['poweroff'], check=False)
+
+
+if __name__ == '__main__':
+    main()
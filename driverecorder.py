@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Implements the flight recorder of the driveRover_wugc.
+
+The per-tick control telemetry (shaped controller axes, mixer outputs, wheel angles and speeds, stage timings)
+is packed into a fixed-size ring buffer, preallocated at startup; the oldest records are overwritten.
+The last seconds are dumped to a CSV file on demand (FlightRecorder.dump()), on SIGUSR1,
+and when the rover is stopped.
+"""
+
+# pylint: disable=line-too-long
+
+import os
+import struct
+import signal
+import threading
+from array import array
+from datetime import datetime
+from time import monotonic
+
+# Local
+from drivelogger import driveLogger
+from driveconfig import driveCfg
+
+# The record fields, one record per driving loop tick
+RECORD_FIELDS = ('t', 'lx', 'ly', 'rx', 'ry', 'mode', 'dir', 'speed',
+                 'dir_left', 'dir_right', 'speed_left', 'speed_right', 'cmd',
+                 'input_us', 'mix_us', 'post_us', 'late_us')
+# The record layout: monotonic time (double), then float32 values
+RECORD = struct.Struct('<d16f')
+
+
+class FlightRecorder:
+    """
+    Ring buffer of the per-tick control telemetry.
+    The buffer is allocated once; record() packs the values in place.
+    The wheel angles and speeds are set by the driving functions (see set_wheels()),
+    and recorded with the next tick.
+    """
+
+    def __init__(self, seconds: float = 30.0, rate_hz: float = 50.0, folder: str = 'flightrec'):
+        """
+        :param seconds:
+            The recorded time span (seconds), 0 to disable the recorder
+        :param rate_hz:
+            The record rate (Hz), the driving loop rate
+        :param folder:
+            The folder of the dump files
+        """
+        self.capacity = max(0, int(seconds * rate_hz))
+        self.enabled = self.capacity > 0
+        self.folder = folder
+        self.mode_names = ()
+        self.dumps = 0
+
+        # The ring buffer, and the number of records written so far
+        self._buf = bytearray(RECORD.size * self.capacity)
+        self._n = 0
+        # The last wheel angles and speeds: dir_left, dir_right, speed_left, speed_right
+        self.wheels = array('f', [0.0, 0.0, 0.0, 0.0])
+        self._writer = None
+
+    def start(self, mode_names: tuple = ()) -> None:
+        """
+        Dump the recorder on SIGUSR1. Must be called from the main thread.
+
+        :param mode_names:
+            The driving mode names, by mode id (written in the dump header)
+        """
+        self.mode_names = tuple(mode_names)
+        if self.enabled:
+            signal.signal(signal.SIGUSR1, self._on_signal)
+            driveLogger.info("Flight recorder: %d records (%d bytes). Dump with: kill -USR1 %d", self.capacity, len(self._buf), os.getpid())
+
+    def set_wheels(self, dir_left: float, dir_right: float, speed_left: float, speed_right: float) -> None:
+        """
+        Set the wheel angles and speeds applied by a driving function.
+
+        :param dir_left:
+            The front left wheel angle (degrees), None keeps the last angles
+        :param dir_right:
+            The front right wheel angle (degrees)
+        :param speed_left:
+            The left motors speed (percentage of max speed)
+        :param speed_right:
+            The right motors speed (percentage of max speed)
+        """
+        _w = self.wheels
+        if dir_left is not None:
+            _w[0] = dir_left
+            _w[1] = dir_right
+        _w[2] = speed_left
+        _w[3] = speed_right
+
+    def record(self, t: float, axes: tuple, mode_id: int, mixed: tuple, cmd: bool,
+               input_s: float, mix_s: float, post_s: float, late_s: float) -> None:
+        """
+        Record one driving loop tick.
+
+        :param t:
+            The tick time (time.monotonic())
+        :param axes:
+            The controller axes values (lx, ly, rx, ry), after the input shaping
+        :param mode_id:
+            The driving mode id (see DriveMode.mode_id)
+        :param mixed:
+            The (direction, speed) pair of the driving mode, or None
+        :param cmd:
+            True when a driving command was posted in this tick
+        :param input_s:
+            The controller input stage duration (seconds)
+        :param mix_s:
+            The mixing stage duration (seconds)
+        :param post_s:
+            The command posting stage duration (seconds)
+        :param late_s:
+            The wake-up lateness of the tick (seconds)
+        """
+        if not self.enabled:
+            return
+        _dir, _speed = mixed if mixed is not None else (0.0, 0.0)
+        _w = self.wheels
+        RECORD.pack_into(self._buf, RECORD.size * (self._n % self.capacity),
+                         t, axes[0], axes[1], axes[2], axes[3], mode_id, _dir, _speed,
+                         _w[0], _w[1], _w[2], _w[3], cmd,
+                         1e6*input_s, 1e6*mix_s, 1e6*post_s, 1e6*late_s)
+        self._n += 1
+
+    def snapshot(self, seconds: float = None) -> list:
+        """
+        Copy out the recorded ticks.
+
+        :param seconds:
+            The time span before the last record (seconds), None for all
+        :return:
+            The records (tuples of RECORD_FIELDS values), oldest first
+        """
+        _n = self._n
+        _count = min(_n, self.capacity)
+        _first = _n - _count
+        # Copy the buffer first, such that the loop can keep recording
+        _buf = bytes(self._buf)
+        _records = [RECORD.unpack_from(_buf, RECORD.size * (_k % self.capacity)) for _k in range(_first, _n)]
+        if seconds is not None and _records:
+            _t_min = _records[-1][0] - seconds
+            _records = [_r for _r in _records if _r[0] >= _t_min]
+        return _records
+
+    def dump(self, reason: str = 'demand', seconds: float = None, wait: bool = False) -> str:
+        """
+        Dump the recorded ticks to a CSV file in the recorder folder.
+        The records are copied at the call, and written in a background thread.
+
+        :param reason:
+            The dump reason, in the file name and header
+        :param seconds:
+            The time span before the last record (seconds), None for all
+        :param wait:
+            Wait until the file is written
+        :return:
+            The dump file name, None when nothing was recorded
+        """
+        if not self.enabled or self._n == 0:
+            return None
+        _t_dump = monotonic()
+        _records = self.snapshot(seconds)
+        _fname = os.path.join(self.folder, f"flightrec_{datetime.now():%Y%m%d_%H%M%S}_{reason}.csv")
+        self._writer = threading.Thread(target=self._write, args=(_fname, _records, reason, _t_dump), name='FlightDump', daemon=True)
+        self._writer.start()
+        if wait:
+            self._writer.join()
+        return _fname
+
+    def _write(self, fname: str, records: list, reason: str, t_dump: float) -> None:
+        """Write the dump file; the time column is relative to the dump (seconds)"""
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(fname, 'w', encoding='utf-8') as _file:
+                _file.write(f"# driveRover flight recorder: {reason}, {datetime.now().isoformat(timespec='seconds')}, {len(records)} ticks\n")
+                _file.write(f"# modes: {', '.join(f'{_k}={_name}' for _k, _name in enumerate(self.mode_names))}\n")
+                _file.write(",".join(RECORD_FIELDS) + "\n")
+                for _r in records:
+                    _file.write(f"{_r[0] - t_dump:.4f}," + ",".join(f"{_v:.6g}" for _v in _r[1:]) + "\n")
+        except OSError as _e:
+            driveLogger.error("Flight recorder dump failed: %s", _e)
+            return
+        self.dumps += 1
+        driveLogger.info("Flight recorder dumped %d ticks to %s", len(records), fname)
+
+    def _on_signal(self, signum, frame) -> None:
+        """SIGUSR1 handler"""
+        self.dump('signal')
+
+
+#pylint: disable=no-member
+driveRecorder = FlightRecorder(
+    seconds=driveCfg.mainCfg.recorder_seconds if driveCfg.mainCfg.recorder else 0,
+    rate_hz=driveCfg.mainCfg.loop_hz,
+    folder=driveCfg.mainCfg.recorder_dir)
+#pylint: enable=no-member
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Implements the hot reload of driveconfig.yaml for the driveRover_wugc.
+
+The folder of driveconfig.yaml is watched with inotify (the editors often replace the file),
+or the file modification time is polled when inotify is not available.
+A changed file is compiled and validated in the watcher thread, and the new config sections
+are swapped in by the driving loop between two ticks (see ConfigWatcher.take() and apply_config()).
+"""
+
+# pylint: disable=line-too-long
+
+import os
+import struct
+import select
+import ctypes
+import ctypes.util
+import threading
+from time import sleep
+
+import yaml
+
+# Local
+from drivelogger import driveLogger
+from driveconfig import driveCfg, compile_config
+from drivefunc import driveActuators, set_led_brightness, calibrate_servos
+from drivemodes import DRIVE_MODES
+from driveshaping import driveShaper
+
+# inotify (libc)
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    _libc.inotify_init1.argtypes = [ctypes.c_int]
+    _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    INOTIFY_MOD = True
+except (OSError, AttributeError):
+    INOTIFY_MOD = False
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# struct inotify_event: wd, mask, cookie, len (name follows)
+_EVENT_HEADER = struct.Struct('iIII')
+
+# Wait for the writes to settle after a change (seconds)
+RELOAD_SETTLE = 0.1
+# Stop check period of the watcher thread, and the mtime poll period without inotify (seconds)
+RELOAD_POLL = 0.5
+
+# The mainCfg parameters applied only at (re)start
+RESTART_PARAMS = ('mainCfg.runtime', 'mainCfg.input', 'mainCfg.input_file', 'mainCfg.input_realtime', 'mainCfg.input_record',
+                  'mainCfg.actuator_thread', 'mainCfg.servo_bulk', 'mainCfg.loop_overrun', 'mainCfg.config_reload',
+                  'mainCfg.recorder', 'mainCfg.recorder_seconds', 'mainCfg.recorder_dir',
+                  'mainCfg.session_log', 'mainCfg.session_dir',
+                  'mainCfg.ackermann_lut', 'mainCfg.ackermann_lut_step', 'mainCfg.ackermann_lut_interp',
+                  'auxCfg.led', 'auxCfg.cam', 'auxCfg.sonar', 'auxCfg.power',
+                  'pwrCfg.gpio_base', 'pwrCfg.button_pin', 'pwrCfg.button_on', 'pwrCfg.button_hold',
+                  'pwrCfg.battery_pin', 'pwrCfg.battery_on', 'pwrCfg.battery_window', 'pwrCfg.battery_trigger',
+                  'pwrCfg.battery_bins', 'pwrCfg.governor', 'pwrCfg.governor_start', 'pwrCfg.governor_min')
+
+
+class ConfigWatcher:
+    """
+    Watch the YAML configuration file and compile it when changed.
+    The latest valid compiled config is kept until taken (latest wins);
+    an invalid file is logged and ignored, the running config is kept.
+    """
+
+    def __init__(self, yaml_file: str, cache_file: str = None):
+        """
+        :param yaml_file:
+            The YAML configuration file
+        :param cache_file:
+            The compiled configuration cache file, None for no cache
+        """
+        self.yaml_file = os.path.abspath(yaml_file)
+        self.cache_file = cache_file
+        self.reloads = 0
+        self.errors = 0
+
+        self._pending = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    def start(self) -> None:
+        """Start the watcher thread"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='CfgWatch', daemon=True)
+        self._thread.start()
+        driveLogger.info("Watching %s for changes (%s).", self.yaml_file, 'inotify' if INOTIFY_MOD else 'mtime polling')
+
+    def stop(self) -> None:
+        """Stop the watcher thread"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def take(self) -> tuple:
+        """
+        Take the new config, if any.
+
+        :return:
+            The new config sections (see compile_config()), or None when not changed
+        """
+        if self._pending is None:
+            return None
+        with self._lock:
+            _sections, self._pending = self._pending, None
+        return _sections
+
+    def _run(self) -> None:
+        """Wait for the file changes"""
+        _fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC) if INOTIFY_MOD else -1
+        if _fd < 0 or _libc.inotify_add_watch(_fd, os.path.dirname(self.yaml_file).encode(), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+            if _fd >= 0:
+                os.close(_fd)
+            self._poll_mtime()
+            return
+
+        _name = os.path.basename(self.yaml_file).encode()
+        _poll = select.poll()
+        _poll.register(_fd, select.POLLIN)
+        try:
+            while self._running:
+                if not _poll.poll(1000 * RELOAD_POLL):
+                    continue
+                if _name in self._read_names(_fd):
+                    # Let the writes settle, and drop the events of the same change
+                    sleep(RELOAD_SETTLE)
+                    self._read_names(_fd)
+                    self._compile()
+        finally:
+            os.close(_fd)
+
+    @staticmethod
+    def _read_names(fd: int) -> set:
+        """Read the pending inotify events, return the file names"""
+        _names = set()
+        try:
+            _buf = os.read(fd, 4096)
+        except BlockingIOError:
+            return _names
+        _k = 0
+        while _k + _EVENT_HEADER.size <= len(_buf):
+            _, _, _, _len = _EVENT_HEADER.unpack_from(_buf, _k)
+            _k += _EVENT_HEADER.size
+            _names.add(_buf[_k:_k + _len].rstrip(b'\0'))
+            _k += _len
+        return _names
+
+    def _poll_mtime(self) -> None:
+        """Poll the file modification time"""
+        _mtime = None
+        while self._running:
+            try:
+                _new = os.stat(self.yaml_file).st_mtime_ns
+            except OSError:
+                _new = None
+            if _mtime is not None and _new is not None and _new != _mtime:
+                sleep(RELOAD_SETTLE)
+                self._compile()
+            _mtime = _new
+            sleep(RELOAD_POLL)
+
+    def _compile(self) -> None:
+        """Compile and validate the changed file"""
+        try:
+            _sections, _ = compile_config(self.yaml_file, self.cache_file)
+            _maincfg = _sections[0]
+            for _mode in [_maincfg.mode] + _maincfg.mode_cycle:
+                if _mode not in DRIVE_MODES:
+                    raise ValueError(f"Unknown driving mode '{_mode}', one of {tuple(DRIVE_MODES)}")
+        except (OSError, yaml.YAMLError, ValueError) as _e:
+            self.errors += 1
+            driveLogger.error("Error in the changed YAML configuration file, the running configuration is kept: %s", _e)
+            return
+
+        with self._lock:
+            self._pending = _sections
+        self.reloads += 1
+
+
+def apply_config(sections: tuple) -> dict:
+    """
+    Swap in the new config sections, apply the actuator deadbands, the LED brightness, the input shaping
+    and the servo calibration,
+    and log the changed parameters.
+    Must be called from the driving loop between two ticks; the loop re-binds the other values.
+
+    :param sections:
+        The new config sections, from ConfigWatcher.take()
+    :return:
+        Dictionary with the changed parameters ('section.param') and their (old, new) values
+    """
+    _diff = driveCfg.reload_sections(sections)
+    if not _diff:
+        return _diff
+
+    driveLogger.info("Configuration reloaded: %s", ", ".join(f"{_k}: {_v[0]!r} -> {_v[1]!r}" for _k, _v in _diff.items()))
+    driveCfg.journal_send(f"Configuration reloaded ({len(_diff)} changes).")
+
+    #pylint: disable=no-member
+    driveActuators.servo_deadband = driveCfg.mainCfg.servo_deadband
+    driveActuators.speed_deadband = driveCfg.mainCfg.speed_deadband
+    if 'ledCfg.led_bright' in _diff and not set_led_brightness(driveCfg.LED_BRIGHT):
+        driveLogger.warning("The LED brightness is applied at the next restart.")
+    if any(_k.startswith('shapeCfg.') for _k in _diff):
+        driveShaper.configure(driveCfg.shapeCfg)
+    # The mast servo tables follow the mast servo channels and type
+    if any(_k.startswith(('servoCfg.', 'mastCfg.')) for _k in _diff) or 'auxCfg.mast' in _diff:
+        calibrate_servos()
+    #pylint: enable=no-member
+
+    _restart = [_k for _k in _diff if _k in RESTART_PARAMS]
+    if _restart:
+        driveLogger.warning("These changes are applied at the next restart: %s", ", ".join(_restart))
+    return _diff
+
+
+#pylint: disable=no-member
+driveConfigWatcher = ConfigWatcher(driveCfg.YAMLCFG_FILE, driveCfg.YAMLCFG_CACHE)
+#pylint: enable=no-member
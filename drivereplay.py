@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Replay a binary session log through the driving mixers.
+The controller input of the session is shaped as in shapeCfg (see driveshaping.py, --no-shaping to skip),
+and fed through mixer_speed(), mixer_dir() and calc_ackerman_steering(),
+in real time, or as fast as possible with the array mixer functions (--fast).
+The axes filters (smooth, slew) run at the input records times instead of the driving loop ticks,
+so with filters the replayed commands can differ from the recorded ones.
+The replayed direction and speed are checked against the driving commands recorded in the session.
+Run from the main folder: python3 drivereplay.py sessions/session_<date>.mrsl [--fast] [--output replay.csv]
+"""
+
+# pylint: disable=line-too-long
+
+import sys
+import argparse
+from time import sleep, monotonic
+
+import numpy as np
+
+# Local
+from driveconfig import driveCfg
+from drivefunc import mixer_speed, mixer_dir, calc_ackerman_steering
+from drivefunc import mixer_speed_array, mixer_dir_array, calc_ackerman_steering_array
+from drivemodes import make_mode
+from drivesession import SessionReader
+from driveshaping import driveShaper
+
+# The replay output columns (the shaped axes)
+REPLAY_FIELDS = ('t', 'lx', 'ly', 'rx', 'ry', 'dir', 'speed', 'dir_left', 'dir_right', 'speed_left', 'speed_right')
+# The max difference between the replayed and the recorded commands (float32 values)
+CHECK_TOL = 1e-3
+
+
+def replay_fast(inputs, mode) -> np.ndarray:
+    """
+    Replay the input records with the array mixer functions.
+
+    :param inputs:
+        The input records (see SessionReader.inputs())
+    :param mode:
+        The driving mode ('simple' or 'ackermann' DriveMode)
+    :return:
+        The replay array, one row per input record (REPLAY_FIELDS, without t)
+    """
+    _axes = driveShaper.shape_array(inputs['t'], inputs['v'])
+    _speed, _ = mixer_speed_array(0.0, _axes[:, 1], max_speed=mode.max_speed)
+    _dir = mixer_dir_array(_axes[:, 2], _axes[:, 3], max_dir=mode.max_dir)
+    if mode.name == 'ackermann':
+        _dir = np.clip(_dir, -mode.dir_limit, mode.dir_limit)
+        _wheels = calc_ackerman_steering_array(_dir, _speed, driveCfg.DoL)
+    else:
+        _wheels = (_dir, _dir, _speed, _speed)
+    return np.column_stack((_axes, _dir, _speed) + tuple(_wheels))
+
+
+def replay_realtime(inputs, t_start: float, mode, output) -> np.ndarray:
+    """
+    Replay the input records in real time with the mixer functions, writing the rows as they are computed.
+
+    :param inputs:
+        The input records (see SessionReader.inputs())
+    :param t_start:
+        The session start time (monotonic)
+    :param mode:
+        The driving mode ('simple' or 'ackermann' DriveMode)
+    :param output:
+        The output stream (CSV rows)
+    :return:
+        The replay array, one row per input record (REPLAY_FIELDS, without t)
+    """
+    _rows = []
+    _t0 = monotonic()
+    driveShaper.reset()
+    for _t, _v in zip((inputs['t'] - t_start).tolist(), inputs['v'].tolist()):
+        _wait = _t0 + _t - monotonic()
+        if _wait > 0:
+            sleep(_wait)
+        lx_axis, ly_axis, rx_axis, ry_axis = driveShaper.shape(_t, tuple(_v))
+        _speed, _ = mixer_speed(yaw=0, throttle=ly_axis, max_speed=mode.max_speed)
+        _dir = mixer_dir(l_r=rx_axis, f_b=ry_axis, max_dir=mode.max_dir)
+        if mode.name == 'ackermann':
+            _dir = max(-mode.dir_limit, min(mode.dir_limit, _dir))
+            _wheels = calc_ackerman_steering(_dir, _speed)
+        else:
+            _wheels = (_dir, _dir, _speed, _speed)
+        _row = (lx_axis, ly_axis, rx_axis, ry_axis, _dir, _speed) + tuple(_wheels)
+        _rows.append(_row)
+        if output is not None:
+            output.write(f"{_t:.4f}," + ",".join(f"{_x:.6g}" for _x in _row) + "\n")
+            output.flush()
+    return np.array(_rows, dtype=float).reshape(-1, len(REPLAY_FIELDS) - 1)
+
+
+def check_commands(session, inputs, replay: np.ndarray, mode) -> tuple:
+    """
+    Check the replayed direction and speed against the recorded driving commands of the same mode.
+
+    :return:
+        The number of checked commands, and the number of commands differing from the replay
+    """
+    _mode_id = session.mode_names.index(mode.name) if mode.name in session.mode_names else -1
+    _cmds = session.commands()
+    _cmds = _cmds[_cmds['mode'] == _mode_id]
+    if not len(_cmds) or not len(inputs):
+        return 0, 0
+    # The last input record before each command
+    _k = np.searchsorted(inputs['t'], _cmds['t'], side='right') - 1
+    _ok = _k >= 0
+    _diff = np.abs(replay[_k[_ok], 4:6] - _cmds['v'][_ok, :2]).max(axis=1) > CHECK_TOL
+    return int(np.count_nonzero(_ok)), int(np.count_nonzero(_diff))
+
+
+def main() -> None:
+    """Replay the session, print the summary and write the replay"""
+    _parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    _parser.add_argument('session', help='session file (*.mrsl)')
+    _parser.add_argument('--mode', choices=['simple', 'ackermann'], default='ackermann', help='driving mode')
+    _parser.add_argument('--max-speed', type=int, default=driveCfg.mainCfg.max_speed, help='max speed (percentage)') #pylint: disable=no-member
+    _parser.add_argument('--fast', action='store_true', help='replay as fast as possible')
+    _parser.add_argument('--no-shaping', action='store_true', help='replay without the input shaping')
+    _parser.add_argument('--output', default=None, help='CSV replay file (default: stdout in real time)')
+    _args = _parser.parse_args()
+    if _args.no_shaping:
+        driveShaper.configure(None)
+
+    _mode = make_mode(_args.mode, max_speed=_args.max_speed)
+    with SessionReader(_args.session) as _session:
+        _bad = _session.verify()
+        _inputs = _session.inputs()
+        print(f"{_args.session}: {len(_session)} records, {len(_inputs)} inputs, {_session.duration():.1f} s, modes {_session.mode_names}", file=sys.stderr)
+        if _bad:
+            print(f"Corrupted blocks: {_bad}", file=sys.stderr)
+
+        _output = open(_args.output, 'w', encoding='utf-8') if _args.output else (None if _args.fast else sys.stdout)
+        try:
+            _t0 = monotonic()
+            if _args.fast:
+                _replay = replay_fast(_inputs, _mode)
+                if _output is not None:
+                    np.savetxt(_output, np.column_stack((_inputs['t'] - _session.start_t, _replay)), fmt='%.6g', delimiter=',',
+                               header=','.join(REPLAY_FIELDS), comments='')
+            else:
+                if _output is not None:
+                    _output.write(','.join(REPLAY_FIELDS) + "\n")
+                _replay = replay_realtime(_inputs, _session.start_t, _mode, _output)
+            _t_replay = monotonic() - _t0
+        finally:
+            if _output is not None and _output is not sys.stdout:
+                _output.close()
+
+        _checked, _differ = check_commands(_session, _inputs, _replay, _mode)
+        print(f"Replayed {len(_replay)} inputs in {_t_replay:.3f} s ({_args.mode}), {_checked} recorded commands checked, {_differ} differ", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Implements the fixed-rate loop scheduler for the driveRover_wugc"""
+
+# pylint: disable=line-too-long
+
+from time import monotonic, sleep
+
+
+class LoopScheduler:
+    """
+    Fixed-rate loop scheduler.
+    The loop deadlines are absolute (start time + n * period) on the monotonic clock,
+    such that the sleep time compensates the time spent in the loop body and no drift accumulates.
+
+    When the loop body overruns one or more periods, the missed ticks are either
+    skipped (the schedule is re-aligned to the next deadline in the future), or
+    caught up (the following ticks are run back-to-back without sleep),
+    up to max_catchup ticks, after which the remaining missed ticks are skipped.
+    """
+
+    def __init__(self, rate_hz: float = 50.0, overrun: str = 'skip', max_catchup: int = 5):
+        """
+        :param rate_hz:
+            Loop rate (Hz)
+        :param overrun:
+            Overrun policy, 'skip' or 'catchup'
+        :param max_catchup:
+            Maximum number of missed ticks to catch up (for 'catchup' policy)
+        """
+        if rate_hz <= 0:
+            raise ValueError(f"Invalid loop rate {rate_hz} Hz")
+        if overrun not in ('skip', 'catchup'):
+            raise ValueError(f"Invalid loop overrun policy '{overrun}'")
+
+        self.period = 1.0 / rate_hz
+        self.overrun = overrun
+        self.max_catchup = max_catchup
+
+        self._t_start = None
+        self._t_next = None
+        self.reset_stats()
+
+    def set_rate(self, rate_hz: float) -> None:
+        """
+        Change the loop rate; the next deadline is one new period from now.
+
+        :param rate_hz:
+            Loop rate (Hz)
+        """
+        if rate_hz <= 0:
+            raise ValueError(f"Invalid loop rate {rate_hz} Hz")
+        self.period = 1.0 / rate_hz
+        if self._t_next is not None:
+            self._t_next = monotonic() + self.period
+
+    def reset_stats(self) -> None:
+        """Reset the loop statistics"""
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter_sum = 0.0
+        self.jitter_max = 0.0
+        self.busy_sum = 0.0
+        self._t_wake = None
+
+    def start(self) -> None:
+        """(Re)start the schedule; the first deadline is one period from now"""
+        self._t_start = monotonic()
+        self._t_next = self._t_start + self.period
+        self._t_wake = self._t_start
+
+    def wait(self) -> float:
+        """
+        Wait until the next tick deadline.
+        Must be called once at the end of each loop iteration.
+
+        :return:
+            The lateness of the wake-up relative to the deadline (seconds)
+        """
+        if self._t_next is None:
+            self.start()
+
+        _now = monotonic()
+        if self._t_wake is not None:
+            self.busy_sum += _now - self._t_wake
+
+        _delay = self._t_next - _now
+        if _delay > 0:
+            sleep(_delay)
+            _now = monotonic()
+
+        _late = _now - self._t_next
+        self.ticks += 1
+        self.jitter_sum += _late
+        if _late > self.jitter_max:
+            self.jitter_max = _late
+
+        if _late >= self.period:
+            # Overrun of one or more periods
+            self.overruns += 1
+            _missed = int(_late / self.period)
+            if self.overrun == 'catchup' and _missed <= self.max_catchup:
+                self._t_next += self.period
+            else:
+                self.skipped += _missed
+                self._t_next += (_missed + 1) * self.period
+        else:
+            self._t_next += self.period
+
+        self._t_wake = _now
+        return _late
+
+    def stats(self) -> dict:
+        """
+        Loop statistics.
+
+        :return:
+            A dictionary with the number of ticks, overruns, skipped ticks,
+            the mean and max jitter (ms), the loop rate (Hz) and the busy load (fraction of time not sleeping)
+        """
+        _elapsed = (monotonic() - self._t_start) if self._t_start is not None else 0.0
+        return {
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'jitter_mean_ms': 1000.0 * self.jitter_sum / self.ticks if self.ticks else 0.0,
+            'jitter_max_ms': 1000.0 * self.jitter_max,
+            'rate_hz': self.ticks / _elapsed if _elapsed > 0 else 0.0,
+            'load': self.busy_sum / _elapsed if _elapsed > 0 else 0.0,
+        }
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Implements the binary session log of the driveRover_wugc.
+
+A session file (*.mrsl) has a fixed size header followed by fixed size records (32 bytes):
+the controller input records (axes and pressed buttons), the driving command records
+(driving mode, direction and speed), and after every index_every records an index record
+with the CRC-32 of the block of records before it.
+
+    header  magic b'MRSL', version, header size, record size, index_every, start time (wall, monotonic), mode names
+    record  t (float64, monotonic), kind (uint8), mode (uint8), reserved (uint16), buttons (uint32), v (4 x float32)
+
+    input   kind 0, buttons bit mask (see BUTTONS), v = lx, ly, rx, ry
+    command kind 1, mode id, v = direction, speed, 0, 0
+    index   kind 255, buttons = CRC-32 of the block, v = block number, input records, command records, 0
+
+SessionLog writes the session during driving; SessionReader memory maps a session file,
+and exposes the records as numpy arrays without copying.
+"""
+
+# pylint: disable=line-too-long
+
+import os
+import mmap
+import struct
+import zlib
+from datetime import datetime
+from time import time, monotonic
+
+# Local
+from drivelogger import driveLogger
+from driveconfig import driveCfg
+from driveinput import BUTTONS
+
+try:
+    import numpy as np
+    NUMPY_MOD = True
+except ImportError:
+    NUMPY_MOD = False
+
+SESSION_MAGIC = b'MRSL'
+SESSION_VERSION = 1
+
+# The record kinds
+REC_INPUT = 0
+REC_COMMAND = 1
+REC_INDEX = 255
+
+# magic, version, header size, record size, reserved, index_every, start wall time, start monotonic time, mode names
+HEADER = struct.Struct('<4sHHHHIdd224s')
+RECORD = struct.Struct('<dBBHI4f')
+
+# The button bit masks
+BUTTON_BITS = {_name: 1 << _k for _k, _name in enumerate(BUTTONS)}
+
+if NUMPY_MOD:
+    RECORD_DTYPE = np.dtype([('t', '<f8'), ('kind', 'u1'), ('mode', 'u1'), ('reserved', '<u2'),
+                             ('buttons', '<u4'), ('v', '<f4', (4,))])
+
+
+class SessionLog:
+    """
+    Session log writer.
+    An input record is written when the axes changed or buttons were pressed,
+    a command record for each driving command.
+    """
+
+    def __init__(self, folder: str = 'sessions', index_every: int = 256, enabled: bool = True):
+        """
+        :param folder:
+            The folder of the session files
+        :param index_every:
+            The number of records between two index records
+        :param enabled:
+            Write the session log
+        """
+        self.folder = folder
+        self.index_every = index_every
+        self.enabled = enabled
+        self.filename = None
+
+        self._file = None
+        self._axes = None
+        self._t = 0.0
+        self._crc = 0
+        self._block = 0
+        self._count = 0
+        self._inputs = 0
+        self._commands = 0
+
+    def start(self, mode_names: tuple = ()) -> None:
+        """
+        Open a new session file, named after the start time.
+
+        :param mode_names:
+            The driving mode names, by mode id (written in the header)
+        """
+        if not self.enabled or self._file is not None:
+            return
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            self.filename = os.path.join(self.folder, f"session_{datetime.now():%Y%m%d_%H%M%S}.mrsl")
+            self._file = open(self.filename, 'wb')
+        except OSError as _e:
+            driveLogger.error("Session log not started: %s", _e)
+            self._file = None
+            return
+        self._file.write(HEADER.pack(SESSION_MAGIC, SESSION_VERSION, HEADER.size, RECORD.size, 0, self.index_every,
+                                     time(), monotonic(), ','.join(mode_names).encode()))
+        driveLogger.info("Session log: %s", self.filename)
+
+    def stop(self) -> None:
+        """Write the last index record and close the session file"""
+        if self._file is None:
+            return
+        if self._count:
+            self._index()
+        self._file.close()
+        self._file = None
+        driveLogger.info("Session log closed: %d input, %d command records.", self._inputs, self._commands)
+
+    def flush(self) -> None:
+        """Write the buffered records to the session file"""
+        if self._file is not None:
+            self._file.flush()
+
+    def input(self, t: float, axes: tuple, presses=None) -> None:
+        """
+        Write an input record, when the axes changed or buttons were pressed.
+
+        :param t:
+            The input time (time.monotonic())
+        :param axes:
+            The controller axes values (lx, ly, rx, ry)
+        :param presses:
+            The pressed buttons (ButtonPresses, iterates over the names), or None
+        """
+        _pressed = presses is not None and presses.has_presses
+        if self._file is None or (axes == self._axes and not _pressed):
+            return
+        self._axes = axes
+        _mask = 0
+        if _pressed:
+            for _name in presses:
+                _mask |= BUTTON_BITS.get(_name, 0)
+        self._inputs += 1
+        self._write(t, RECORD.pack(t, REC_INPUT, 0, 0, _mask, axes[0], axes[1], axes[2], axes[3]))
+
+    def command(self, t: float, mode_id: int, dir_deg: float, speed_per: float) -> None:
+        """
+        Write a driving command record.
+
+        :param t:
+            The command time (time.monotonic())
+        :param mode_id:
+            The driving mode id (see DriveMode.mode_id)
+        :param dir_deg:
+            The direction (degrees)
+        :param speed_per:
+            The speed (percentage of max speed)
+        """
+        if self._file is None:
+            return
+        self._commands += 1
+        self._write(t, RECORD.pack(t, REC_COMMAND, mode_id, 0, 0, dir_deg, speed_per, 0.0, 0.0))
+
+    def _write(self, t: float, rec: bytes) -> None:
+        """Append a record, and the index record after every index_every records"""
+        self._file.write(rec)
+        self._t = t
+        self._crc = zlib.crc32(rec, self._crc)
+        self._count += 1
+        if self._count == self.index_every:
+            self._index()
+
+    def _index(self) -> None:
+        """Write the index record of the current block (the file is flushed by the flush() timer, not here)"""
+        self._file.write(RECORD.pack(self._t, REC_INDEX, 0, 0, self._crc,
+                                     self._block, self._inputs, self._commands, 0.0))
+        self._block += 1
+        self._crc = 0
+        self._count = 0
+
+
+class SessionReader:
+    """
+    Session file reader.
+    The file is memory mapped, and records is a numpy structured array (RECORD_DTYPE)
+    on the mapped file: the records, the fields (e.g. records['t']), the slices (window())
+    and the index records (blocks) are views, not copies.
+    A truncated last record (e.g. after a power cut) is ignored.
+    """
+
+    def __init__(self, filename: str):
+        """
+        :param filename:
+            The session file name (*.mrsl)
+        :raises ValueError:
+            Not a session file, or an unsupported version
+        """
+        if not NUMPY_MOD:
+            raise ImportError("The numpy module is required to read the session files")
+        self.filename = filename
+        with open(filename, 'rb') as _file:
+            self._mm = mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mm) < HEADER.size:
+            raise ValueError(f"{filename}: not a session file")
+        _magic, self.version, _header_size, _record_size, _, self.index_every, self.start_time, self.start_t, _modes = HEADER.unpack_from(self._mm)
+        if _magic != SESSION_MAGIC:
+            raise ValueError(f"{filename}: not a session file")
+        if self.version > SESSION_VERSION or _record_size != RECORD.size:
+            raise ValueError(f"{filename}: unsupported session file version {self.version}")
+        self.mode_names = tuple(_modes.rstrip(b'\0').decode().split(',')) if _modes.rstrip(b'\0') else ()
+
+        self.records = np.frombuffer(self._mm, dtype=RECORD_DTYPE, count=(len(self._mm) - _header_size) // _record_size, offset=_header_size)
+        # The index records of the full blocks
+        self.blocks = self.records[self.index_every::self.index_every + 1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def close(self) -> None:
+        """Release the arrays and unmap the file"""
+        self.records = self.blocks = None
+        try:
+            self._mm.close()
+        except BufferError:
+            # Views still used by the caller, the file is unmapped when they are released
+            pass
+
+    def duration(self) -> float:
+        """The session duration (seconds)"""
+        _t = self.records['t']
+        return float(_t[-1] - _t[0]) if len(_t) else 0.0
+
+    def window(self, t_start: float, t_end: float):
+        """
+        The records in a time window, relative to the session start.
+
+        :param t_start:
+            The window start (seconds)
+        :param t_end:
+            The window end (seconds)
+        :return:
+            The records (view)
+        """
+        _t = self.records['t']
+        _k0, _k1 = np.searchsorted(_t, (self.start_t + t_start, self.start_t + t_end), side='left')
+        return self.records[_k0:_k1]
+
+    def inputs(self):
+        """The input records (copy)"""
+        return self.records[self.records['kind'] == REC_INPUT]
+
+    def commands(self):
+        """The command records (copy)"""
+        return self.records[self.records['kind'] == REC_COMMAND]
+
+    def verify(self) -> list:
+        """
+        Check the block CRCs.
+
+        :return:
+            The numbers of the corrupted blocks
+        """
+        _bad = []
+        _step = self.index_every + 1
+        _raw = self.records.view(np.uint8).reshape(len(self.records), RECORD.size)
+        for _k in range(len(self.blocks)):
+            _block = _raw[_k*_step:_k*_step + self.index_every]
+            if zlib.crc32(_block) != int(self.blocks['buttons'][_k]):
+                _bad.append(_k)
+        return _bad
+
+
+#pylint: disable=no-member
+driveSession = SessionLog(
+    folder=driveCfg.mainCfg.session_dir,
+    enabled=driveCfg.mainCfg.session_log)
+#pylint: enable=no-member
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Implements the controller input shaping of the driveRover_wugc.
+
+Each stick axis is shaped, before the driving mode mixers, by:
+    deadband  the axis values within +/- deadband are set to 0, the rest is rescaled to the full range
+    expo      the expo curve (1 - expo) * x + expo * x**3, for a finer control around the centre
+    smooth    low-pass filter time constant (seconds)
+    slew      max change rate of the axis value away from 0 (full range per second),
+              the moves toward 0 (stick releases and direction reversals) are not limited
+
+The deadband and expo curve of each axis is compiled at startup into a lookup table over [-1, 1],
+with the slope of each table step: shaping a value costs one index and one multiply-add.
+The shaping parameters are set per axis in the shapeCfg section of driveconfig.yaml;
+an axis without parameters is passed through unchanged.
+"""
+
+# pylint: disable=line-too-long
+
+# Local
+from drivelogger import driveLogger
+from driveconfig import driveCfg, ShapeCfg
+
+try:
+    import numpy as np
+    NUMPY_MOD = True
+except ImportError:
+    NUMPY_MOD = False
+
+# The shaped axes, in the order of the driving modes axes tuple
+SHAPE_AXES = ('lx', 'ly', 'rx', 'ry')
+# The filtered value is set to the input value when closer than this
+SETTLE_EPS = 1e-3
+
+
+def shape_curve(x: float, deadband: float = 0.0, expo: float = 0.0) -> float:
+    """
+    The closed-form deadband and expo curve, as tabulated in AxisShaper.
+
+    :param x:
+        The axis value, ranges from -1.0 to 1.0
+    :param deadband:
+        The deadband, ranges from 0.0 to 1.0 (excluded)
+    :param expo:
+        The expo, ranges from 0.0 (linear) to 1.0 (cubic)
+    :return:
+        The shaped axis value
+    """
+    _u = (min(1.0, abs(x)) - deadband) / (1.0 - deadband)
+    if _u <= 0.0:
+        return 0.0
+    _y = (1.0 - expo) * _u + expo * _u * _u * _u
+    return _y if x > 0 else -_y
+
+
+class AxisShaper:
+    """The shaping of one stick axis: curve lookup table, low-pass filter and slew rate limit"""
+    __slots__ = ('name', 'deadband', 'expo', 'smooth', 'slew', 'curve', 'filtered', 'value', 'last', '_lut', '_slope', '_end', '_scale', '_size')
+
+    def __init__(self, name: str, params: dict, lut_size: int = 256):
+        """
+        :param name:
+            The axis name
+        :param params:
+            The shaping parameters: deadband, expo, smooth, slew (see ShapeCfg)
+        :param lut_size:
+            The number of lookup table steps over [-1, 1]
+        """
+        self.name = name
+        self.deadband = float(params.get('deadband', 0.0))
+        self.expo = float(params.get('expo', 0.0))
+        self.smooth = float(params.get('smooth', 0.0))
+        self.slew = float(params.get('slew', 0.0))
+        # The axis has a deadband or expo curve, the axis is filtered
+        self.curve = self.deadband > 0.0 or self.expo > 0.0
+        self.filtered = self.smooth > 0.0 or self.slew > 0.0
+        # The last shaped value, None before the first value, and the last filter input
+        self.value = None
+        self.last = None
+
+        # Even number of steps, such that 0.0 is a table point
+        self._size = 2 * max(1, lut_size // 2)
+        self._scale = 0.5 * self._size
+        _points = [shape_curve(-1.0 + _k / self._scale, self.deadband, self.expo) for _k in range(self._size + 1)]
+        self._lut = _points[:-1]
+        self._slope = [_b - _a for _a, _b in zip(_points[:-1], _points[1:])]
+        self._end = _points[-1]
+
+    def lookup(self, x: float) -> float:
+        """
+        The deadband and expo curve, from the lookup table.
+
+        :param x:
+            The axis value, ranges from -1.0 to 1.0
+        :return:
+            The shaped axis value
+        """
+        _f = (x + 1.0) * self._scale
+        if _f <= 0.0:
+            return self._lut[0]
+        if _f >= self._size:
+            return self._end
+        _k = int(_f)
+        return self._lut[_k] + (_f - _k) * self._slope[_k]
+
+    def filter(self, x: float, dt: float) -> float:
+        """
+        The low-pass filter and the slew rate limit.
+
+        :param x:
+            The axis value (after the curve)
+        :param dt:
+            The time since the last value (seconds)
+        :return:
+            The filtered axis value
+        """
+        _y = self.value
+        if _y is None:
+            return x
+        if self.smooth > 0.0:
+            _y += (x - _y) * dt / (self.smooth + dt)
+        else:
+            _y = x
+        if self.slew > 0.0:
+            # Only the moves away from 0 are limited, a reversal goes through 0 at once
+            _max = self.slew * dt
+            _y0 = self.value if _y * self.value > 0.0 else 0.0
+            if abs(_y) - abs(_y0) > _max:
+                _y = _y0 + _max if _y > 0.0 else _y0 - _max
+        return x if abs(x - _y) < SETTLE_EPS else _y
+
+    def error(self) -> float:
+        """
+        :return:
+            The max difference between the lookup table and the closed-form curve, on a 10x finer grid
+        """
+        if not self.curve:
+            return 0.0
+        _n = 10 * self._size
+        return max(abs(self.lookup(_x) - shape_curve(_x, self.deadband, self.expo)) for _x in (-1.0 + 2.0 * _k / _n for _k in range(_n + 1)))
+
+
+class InputShaper:
+    """
+    Controller input shaping, one AxisShaper per stick axis.
+    shape() is called once per driving loop tick, with the tick time for the filters.
+    """
+
+    def __init__(self, cfg: ShapeCfg = None):
+        """
+        :param cfg:
+            The shapeCfg section, None for no shaping
+        """
+        self.enabled = False
+        self.axes = ()
+        self._t = None
+        self._filtered = ()
+        self.configure(cfg)
+
+    def configure(self, cfg: ShapeCfg) -> None:
+        """
+        Compile the lookup tables of the axes, and reset the filters.
+
+        :param cfg:
+            The shapeCfg section, None for no shaping
+        """
+        if cfg is None or not cfg.shaping:
+            self.enabled = False
+            self.axes = self._filtered = ()
+            return
+        self.axes = tuple(AxisShaper(_name, getattr(cfg, _name), cfg.lut_size) for _name in SHAPE_AXES)
+        self._filtered = tuple(_axis for _axis in self.axes if _axis.filtered)
+        self.enabled = bool(self._filtered) or any(_axis.curve for _axis in self.axes)
+        self.reset()
+        if self.enabled:
+            driveLogger.info("Input shaping: %s, max lookup error %.1e",
+                             ", ".join(f"{_axis.name} {getattr(cfg, _axis.name)}" for _axis in self.axes if _axis.curve or _axis.filtered),
+                             max(_axis.error() for _axis in self.axes))
+
+    def reset(self) -> None:
+        """Reset the filters, e.g. when the controller is connected"""
+        self._t = None
+        for _axis in self.axes:
+            _axis.value = _axis.last = None
+
+    @property
+    def settled(self) -> bool:
+        """True when the filtered axes have reached the input values (no change without input)"""
+        return all(_axis.value == _axis.last for _axis in self._filtered)
+
+    def shape(self, t: float, axes: tuple) -> tuple:
+        """
+        Shape the controller axes.
+
+        :param t:
+            The tick time (time.monotonic())
+        :param axes:
+            The controller axes values (lx, ly, rx, ry), each ranges from -1.0 to 1.0
+        :return:
+            The shaped axes values (lx, ly, rx, ry)
+        """
+        if not self.enabled:
+            return axes
+        _dt = 0.0 if self._t is None else t - self._t
+        self._t = t
+        _out = []
+        for _axis, _x in zip(self.axes, axes):
+            if _axis.curve:
+                _x = _axis.lookup(_x)
+            if _axis.filtered:
+                _axis.last = _x
+                _x = _axis.value = _axis.filter(_x, _dt)
+            _out.append(_x)
+        return tuple(_out)
+
+    def shape_array(self, t, axes):
+        """
+        Shape a series of controller axes values, e.g. for a session replay.
+        The curves are applied to the arrays, the filters sample by sample.
+
+        :param t:
+            The array of the sample times (seconds)
+        :param axes:
+            The array of the controller axes values, one row per sample (lx, ly, rx, ry)
+        :return:
+            The array of the shaped axes values
+        """
+        _out = np.array(axes, dtype=float)
+        if not self.enabled:
+            return _out
+        for _j, _axis in enumerate(self.axes):
+            if _axis.curve:
+                _f = np.clip((_out[:, _j] + 1.0) * _axis._scale, 0.0, _axis._size) #pylint: disable=protected-access
+                _k = np.minimum(_f.astype(int), _axis._size - 1) #pylint: disable=protected-access
+                _out[:, _j] = np.take(_axis._lut, _k) + (_f - _k) * np.take(_axis._slope, _k) #pylint: disable=protected-access
+        if self._filtered:
+            self.reset()
+            for _i, _t in enumerate(np.asarray(t, dtype=float).tolist()):
+                _dt = 0.0 if self._t is None else _t - self._t
+                self._t = _t
+                for _j, _axis in enumerate(self.axes):
+                    if _axis.filtered:
+                        _out[_i, _j] = _axis.value = _axis.filter(float(_out[_i, _j]), _dt)
+            self.reset()
+        return _out
+
+
+#pylint: disable=no-member
+driveShaper = InputShaper(driveCfg.shapeCfg)
+#pylint: enable=no-member
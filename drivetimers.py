@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Implements the periodic tasks scheduler of the driveRover_wugc.
+
+The periodic tasks (systemd watchdog, status updates, telemetry flushes, etc.) are registered
+with driveTimers, and run from the driving loop with run_due(), on the monotonic clock.
+The tasks are kept in a heap ordered by deadline: a tick without due tasks costs one comparison,
+and each due task one heap update.
+"""
+
+# pylint: disable=line-too-long
+
+import heapq
+import itertools
+from time import monotonic
+
+# Local
+from drivelogger import driveLogger
+
+
+class TimerTask:
+    """A periodic task, with its scheduling statistics"""
+    __slots__ = ('name', 'period', 'func', 'deadline', 'active', 'runs', 'skipped', 'late_sum', 'late_max')
+
+    def __init__(self, name: str, period: float, func, deadline: float):
+        self.name = name
+        self.period = period
+        self.func = func
+        self.deadline = deadline
+        self.active = True
+        self.runs = 0
+        self.skipped = 0
+        self.late_sum = 0.0
+        self.late_max = 0.0
+
+    def stats(self) -> dict:
+        """
+        :return:
+            Dictionary with the period (ms), the number of runs and skipped runs, the mean and max lateness (ms)
+        """
+        return {
+            'period_ms': 1000.0 * self.period,
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'late_mean_ms': 1000.0 * self.late_sum / self.runs if self.runs else 0.0,
+            'late_max_ms': 1000.0 * self.late_max,
+        }
+
+
+class TimerHeap:
+    """
+    Periodic tasks scheduler.
+    The tasks run at absolute deadlines (no drift); the runs missed by more than one period are skipped.
+    A task which raises an exception is logged and kept.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._tasks = {}
+        self._seq = itertools.count()
+
+    def add(self, name: str, period: float, func, delay: float = None) -> TimerTask:
+        """
+        Register a periodic task, replacing the task with the same name.
+
+        :param name:
+            The task name
+        :param period:
+            The task period (seconds)
+        :param func:
+            The task function, called without arguments
+        :param delay:
+            The delay of the first run (seconds), one period by default
+        :return:
+            The task
+        """
+        if period <= 0:
+            raise ValueError(f"Invalid period {period} s for the task {name}")
+        self.remove(name)
+        _task = TimerTask(name, period, func, monotonic() + (period if delay is None else delay))
+        self._tasks[name] = _task
+        heapq.heappush(self._heap, (_task.deadline, next(self._seq), _task))
+        return _task
+
+    def remove(self, name: str) -> None:
+        """Unregister a task; it is dropped from the heap when due"""
+        _task = self._tasks.pop(name, None)
+        if _task is not None:
+            _task.active = False
+
+    def set_period(self, name: str, period: float) -> None:
+        """Change the period of a task, from its next run"""
+        if period <= 0:
+            raise ValueError(f"Invalid period {period} s for the task {name}")
+        self._tasks[name].period = period
+
+    def next_deadline(self) -> float:
+        """
+        :return:
+            The deadline of the next task (monotonic), None when no tasks
+        """
+        while self._heap and not self._heap[0][2].active:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def run_due(self, now: float = None) -> int:
+        """
+        Run the due tasks, in deadline order.
+
+        :param now:
+            The current time (time.monotonic()), read when None
+        :return:
+            The number of tasks run
+        """
+        _heap = self._heap
+        if now is None:
+            now = monotonic()
+        if not _heap or _heap[0][0] > now:
+            return 0
+
+        _runs = 0
+        while _heap and _heap[0][0] <= now:
+            _deadline, _, _task = heapq.heappop(_heap)
+            if not _task.active:
+                continue
+
+            # Reschedule first, such that the task can remove itself
+            _late = now - _deadline
+            _missed = int(_late / _task.period)
+            _task.deadline = _deadline + (_missed + 1) * _task.period
+            heapq.heappush(_heap, (_task.deadline, next(self._seq), _task))
+
+            _task.runs += 1
+            _task.skipped += _missed
+            _task.late_sum += _late
+            if _late > _task.late_max:
+                _task.late_max = _late
+            _runs += 1
+            try:
+                _task.func()
+            except Exception as _e: #pylint: disable=broad-except
+                driveLogger.error("Timer task %s failed: %s", _task.name, _e)
+        return _runs
+
+    def stats(self) -> dict:
+        """
+        :return:
+            Dictionary with the statistics of each task (see TimerTask.stats())
+        """
+        return {_name: _task.stats() for _name, _task in self._tasks.items()}
+
+
+driveTimers = TimerHeap()
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+# 4tronix M.A.R.S. Rover Robot remote control using the PiHut Wireless USB Game Controller
+#
+#  Copyright 2023 Istvan Z. Kovacs. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Implements a simulated 4tronix M.A.R.S. Rover library (rover.py),
+used when the rover hardware and library are not available.
+
+The servos are driven by a PCA9685 on the I2C bus. Each setServo() call writes
+the 4 LEDn_ON/OFF registers of the servo channel with single byte writes, i.e. 4 I2C transactions.
+The motors are driven with (software) PWM on 4 GPIO pins, and the LEDs are WS2812 (rpi_ws281x).
+The time cost of the bus transactions is modelled and charged (slept when REALTIME is True),
+and all the commands are recorded with timestamps.
+"""
+
+# pylint: disable=invalid-name
+# pylint: disable=line-too-long
+# pylint: disable=global-statement
+
+from collections import deque, Counter
+from time import monotonic, sleep
+
+# Local
+from drivepca import PCA9685_ADDRESS, MODE1, MODE1_SLEEP, MODE1_AI, MODE1_RESTART, PRESCALE, LED0_ON_L, SERVO_HZ, servo_counts
+
+## Timing model
+# Charge the modelled time with sleep() (True), or only account for it (False)
+REALTIME = True
+# I2C bus clock (Hz), the Raspberry Pi default
+I2C_HZ = 100000
+# Driver and system call overhead per I2C transaction (us), on a Pi Zero
+I2C_OVERHEAD_US = 60.0
+# Overhead per GPIO PWM duty cycle update (us)
+PWM_OVERHEAD_US = 5.0
+# WS2812 bit time and reset time (us), and the rpi_ws281x render overhead (us)
+WS281X_BIT_US = 1.25
+WS281X_RESET_US = 50.0
+WS281X_OVERHEAD_US = 30.0
+# Max number of recorded commands
+RECORD_MAX = 100000
+
+## LEDs
+numPixels = 4
+
+# Motor pins (BCM)
+_MOTOR_PINS = (12, 13, 16, 19)
+
+
+class SimBus:
+    """
+    Simulated I2C (SMBus) bus with the PCA9685 register model.
+    Implements the smbus.SMBus methods used for the PCA9685.
+    """
+
+    def __init__(self, address: int = PCA9685_ADDRESS):
+        self.registers = {address: bytearray(256)}
+        self.transactions = 0
+        self.bytes = 0
+        self.busy_us = 0.0
+
+    def _charge(self, nbytes: int) -> None:
+        """Charge one transaction: START, address byte, nbytes, STOP (9 clocks per byte)"""
+        _us = I2C_OVERHEAD_US + (9 * (1 + nbytes) + 2) * 1000000.0 / I2C_HZ
+        self.transactions += 1
+        self.bytes += nbytes
+        self.busy_us += _us
+        _spend(_us)
+
+    def _write(self, address: int, register: int, data: list) -> None:
+        """Write the registers, auto-incrementing the register address when MODE1_AI is set"""
+        _regs = self.registers[address]
+        if len(data) > 1 and not _regs[MODE1] & MODE1_AI:
+            _regs[register] = data[-1]
+            return
+        for _k, _val in enumerate(data):
+            _regs[(register + _k) & 0xFF] = _val & 0xFF
+
+    def write_byte_data(self, address: int, register: int, value: int) -> None:
+        """Write one register"""
+        self._write(address, register, [value])
+        self._charge(2)
+
+    def write_i2c_block_data(self, address: int, register: int, data: list) -> None:
+        """Write a block of (max 32) registers"""
+        if len(data) > 32:
+            raise ValueError("Max 32 bytes per I2C block write")
+        _t = monotonic()
+        _us = self.busy_us
+        self._write(address, register, data)
+        self._charge(1 + len(data))
+        _record('write_i2c_block_data', (register, len(data)), _t, self.busy_us - _us)
+
+    def read_byte_data(self, address: int, register: int) -> int:
+        """Read one register"""
+        self._charge(3)
+        return self.registers[address][register]
+
+    def read_i2c_block_data(self, address: int, register: int, length: int) -> list:
+        """Read a block of (max 32) registers"""
+        self._charge(2 + length)
+        return list(self.registers[address][register:register + length])
+
+
+bus = SimBus()
+
+# Recorded commands: (timestamp, command name, arguments, modelled cost in us)
+commands = deque(maxlen=RECORD_MAX)
+_counts = Counter()
+_busy_us = Counter()
+
+# Simulated state
+_pwm = dict.fromkeys(_MOTOR_PINS, 0)
+_pixels = [0] * numPixels
+_brightness = 0
+# The servo offsets (degrees), loaded from the EEPROM by the rover library
+offsets = [0] * 16
+
+
+class _LedStrip:
+    """Simulated rpi_ws281x PixelStrip (rover.leds), brightness only"""
+
+    def setBrightness(self, brightness: int) -> None:
+        """Set the LEDs brightness, applied at the next show()"""
+        global _brightness
+        _brightness = brightness
+        _record('setBrightness', (brightness,), monotonic(), 0.0)
+
+    def getBrightness(self) -> int:
+        """The LEDs brightness"""
+        return _brightness
+
+
+leds = _LedStrip()
+
+
+def _spend(cost_us: float) -> None:
+    """Charge the modelled time"""
+    if REALTIME:
+        sleep(cost_us / 1000000.0)
+
+
+def _record(name: str, args: tuple, t_start: float, cost_us: float) -> None:
+    """Record a command"""
+    commands.append((t_start, name, args, cost_us))
+    _counts[name] += 1
+    _busy_us[name] += cost_us
+
+
+def _set_pwm(speeds: tuple) -> float:
+    """Update the motor PWM duty cycles, only the changed pins are written"""
+    _cost = 0.0
+    for _pin, _val in zip(_MOTOR_PINS, speeds):
+        if _pwm[_pin] != _val:
+            _pwm[_pin] = _val
+            _cost += PWM_OVERHEAD_US
+    _spend(_cost)
+    return _cost
+
+
+def _pca_write(channel: int, counts: int) -> float:
+    """Set the PCA9685 channel with 4 single byte register writes"""
+    _us = bus.busy_us
+    _reg = LED0_ON_L + 4 * channel
+    bus.write_byte_data(PCA9685_ADDRESS, _reg, 0)
+    bus.write_byte_data(PCA9685_ADDRESS, _reg + 1, 0)
+    bus.write_byte_data(PCA9685_ADDRESS, _reg + 2, counts & 0xFF)
+    bus.write_byte_data(PCA9685_ADDRESS, _reg + 3, counts >> 8)
+    return bus.busy_us - _us
+
+
+## rover.py API
+
+def init(brightness: int = 40, PiBit: bool = False) -> None:
+    """Initialise the simulated rover: PCA9685 at 50 Hz and LED brightness"""
+    global _brightness
+    _t = monotonic()
+    _us = bus.busy_us
+    _brightness = brightness
+    bus.write_byte_data(PCA9685_ADDRESS, MODE1, MODE1_SLEEP)
+    bus.write_byte_data(PCA9685_ADDRESS, PRESCALE, round(25000000.0 / (4096 * SERVO_HZ)) - 1)
+    bus.write_byte_data(PCA9685_ADDRESS, MODE1, MODE1_RESTART)
+    _record('init', (brightness, PiBit), _t, bus.busy_us - _us)
+
+
+def cleanup() -> None:
+    """Stop the motors and the servos"""
+    _t = monotonic()
+    _cost = _set_pwm((0, 0, 0, 0))
+    _record('cleanup', (), _t, _cost)
+
+
+def stop() -> None:
+    """Motors coast to stop"""
+    _t = monotonic()
+    _record('stop', (), _t, _set_pwm((0, 0, 0, 0)))
+
+
+def brake() -> None:
+    """Motors brake"""
+    _t = monotonic()
+    _record('brake', (), _t, _set_pwm((100, 100, 100, 100)))
+
+
+def forward(speed: int) -> None:
+    """All motors forward"""
+    _t = monotonic()
+    _record('forward', (speed,), _t, _set_pwm((speed, 0, speed, 0)))
+
+
+def reverse(speed: int) -> None:
+    """All motors reverse"""
+    _t = monotonic()
+    _record('reverse', (speed,), _t, _set_pwm((0, speed, 0, speed)))
+
+
+def spinLeft(speed: int) -> None:
+    """Left motors reverse, right motors forward"""
+    _t = monotonic()
+    _record('spinLeft', (speed,), _t, _set_pwm((0, speed, speed, 0)))
+
+
+def spinRight(speed: int) -> None:
+    """Left motors forward, right motors reverse"""
+    _t = monotonic()
+    _record('spinRight', (speed,), _t, _set_pwm((speed, 0, 0, speed)))
+
+
+def turnForward(leftSpeed: int, rightSpeed: int) -> None:
+    """Left and right motors forward at different speeds"""
+    _t = monotonic()
+    _record('turnForward', (leftSpeed, rightSpeed), _t, _set_pwm((leftSpeed, 0, rightSpeed, 0)))
+
+
+def turnReverse(leftSpeed: int, rightSpeed: int) -> None:
+    """Left and right motors reverse at different speeds"""
+    _t = monotonic()
+    _record('turnReverse', (leftSpeed, rightSpeed), _t, _set_pwm((0, leftSpeed, 0, rightSpeed)))
+
+
+def setServo(Servo: int, Degrees: float) -> None:
+    """Set the servo angle"""
+    _t = monotonic()
+    _record('setServo', (Servo, Degrees), _t, _pca_write(Servo, servo_counts(Degrees + offsets[Servo])))
+
+
+def stopServos() -> None:
+    """Stop all servos (full OFF)"""
+    _t = monotonic()
+    _us = bus.busy_us
+    for _channel in range(16):
+        bus.write_byte_data(PCA9685_ADDRESS, LED0_ON_L + 4 * _channel + 3, 0x10)
+    _record('stopServos', (), _t, bus.busy_us - _us)
+
+
+def fromRGB(red: int, green: int, blue: int) -> int:
+    """Convert the RGB color to the LED color value"""
+    return ((int(red) & 0xFF) << 16) | ((int(green) & 0xFF) << 8) | (int(blue) & 0xFF)
+
+
+def toRGB(color: int) -> tuple[int, int, int]:
+    """Convert the LED color value to RGB"""
+    return (color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF
+
+
+def setPixel(ID: int, color: int) -> None:
+    """Set one LED color (in the buffer)"""
+    _t = monotonic()
+    if 0 <= ID < numPixels:
+        _pixels[ID] = color
+    _record('setPixel', (ID, color), _t, 0.0)
+
+
+def setColor(color: int) -> None:
+    """Set all LEDs color (in the buffer)"""
+    _t = monotonic()
+    for _l in range(numPixels):
+        _pixels[_l] = color
+    _record('setColor', (color,), _t, 0.0)
+
+
+def clear() -> None:
+    """Clear all LEDs (in the buffer)"""
+    _t = monotonic()
+    for _l in range(numPixels):
+        _pixels[_l] = 0
+    _record('clear', (), _t, 0.0)
+
+
+def show() -> None:
+    """Send the LED buffer to the LEDs"""
+    _t = monotonic()
+    _cost = WS281X_OVERHEAD_US + 24 * numPixels * WS281X_BIT_US + WS281X_RESET_US
+    _spend(_cost)
+    _record('show', tuple(_pixels), _t, _cost)
+
+
+## Simulation results
+
+def servos() -> dict:
+    """
+    The current PCA9685 OFF count of each servo channel.
+
+    :return:
+        Dictionary with the channel number and the OFF count
+    """
+    _regs = bus.registers[PCA9685_ADDRESS]
+    return {_ch: _regs[LED0_ON_L + 4*_ch + 2] | (_regs[LED0_ON_L + 4*_ch + 3] & 0x0F) << 8 for _ch in range(16)}
+
+
+def motors() -> dict:
+    """
+    The current motor PWM duty cycles.
+
+    :return:
+        Dictionary with the motor pin number (BCM) and the PWM duty cycle
+    """
+    return dict(_pwm)
+
+
+def stats() -> dict:
+    """
+    The simulation statistics.
+
+    :return:
+        Dictionary with the number of calls and the modelled time cost (us) per command,
+        and the number of I2C transactions, bytes and bus time (us)
+    """
+    return {
+        'commands': dict(_counts),
+        'busy_us': dict(_busy_us),
+        'i2c_transactions': bus.transactions,
+        'i2c_bytes': bus.bytes,
+        'i2c_busy_us': bus.busy_us,
+    }
+
+
+def reset() -> None:
+    """Reset the recorded commands and the statistics"""
+    commands.clear()
+    _counts.clear()
+    _busy_us.clear()
+    bus.transactions = 0
+    bus.bytes = 0
+    bus.busy_us = 0.0